@@ -1,8 +1,19 @@
 import ckan.plugins as plugins
 import ckan.logic as logic
+import sqlalchemy as sa
+import breaker
+import bulk
+import cache
 import constants
 import validator
 import db
+import delivery
+import dispatcher
+import export
+import json
+import notifier
+import organizations
+import ratelimit
 
 toolkit = plugins.toolkit
 c = toolkit.c
@@ -10,12 +21,36 @@ c = toolkit.c
 ValidationError = logic.ValidationError
 
 
+def _commit_channel(session, field, *organization_ids):
+
+    # Committed with the channel, so other processes see the change and reload their cache
+    db.Notify_Channel_Version.bump(session, organization_ids)
+
+    # The unique indexes catch the duplicates which raced past the validator
+    try:
+        session.commit()
+    except sa.exc.IntegrityError:
+        session.rollback()
+        raise toolkit.ValidationError({field: [toolkit._('The channel already exists')]})
+
+    cache.invalidate(*organization_ids)
+
+
+def _delete_channel(session, channel):
+    db.Notify_Channel_Version.bump(session, [channel.organization_id])
+    session.delete(channel)
+    session.commit()
+    # The circuit state would otherwise outlive the channel
+    db.Notify_Channel_Health.reset([channel.id])
+    cache.invalidate(channel.organization_id)
+
+
 def _dictize_slack_details(slack_details):
 
     # Convert the slack details into a dict
     data_dict = {
         'id': slack_details.id,
-        'webhook_url': slack_details.webhook_url,
+        'webhook_url': slack_details.address,
         'slack_channel': slack_details.slack_channel,
         'organization_id': slack_details.organization_id
     }
@@ -24,7 +59,8 @@ def _dictize_slack_details(slack_details):
 
 
 def _undictize_slack_basic(slack_details, data_dict):
-    slack_details.webhook_url = data_dict['webhook_url']
+    slack_details.type = constants.CHANNEL_TYPE_SLACK
+    slack_details.address = data_dict['webhook_url']
     slack_details.slack_channel = data_dict['slack_channel']
     slack_details.organization_id = data_dict['organization_id']
 
@@ -34,7 +70,7 @@ def _dictize_email_details(email_details):
     # Convert the slack details into a dict
     data_dict = {
         'id': email_details.id,
-        'email': email_details.email,
+        'email': email_details.address,
         'organization_id': email_details.organization_id
     }
 
@@ -42,10 +78,101 @@ def _dictize_email_details(email_details):
 
 
 def _undictize_email_basic(email_details, data_dict):
-    email_details.email = data_dict['email']
+    email_details.type = constants.CHANNEL_TYPE_EMAIL
+    email_details.address = data_dict['email']
     email_details.organization_id = data_dict['organization_id']
 
 
+def _organization_id(organization_id):
+
+    # Channels are stored against the id of the organization, which does not change when it is renamed
+    resolved = organizations.resolve(organization_id)
+    if resolved is None:
+        raise toolkit.ObjectNotFound(toolkit._('Organization {0} not found').format(organization_id))
+
+    return resolved
+
+
+def _dictize_channel(channel):
+    if channel.type == constants.CHANNEL_TYPE_SLACK:
+        return _dictize_slack_details(channel)
+    return _dictize_email_details(channel)
+
+
+def _load_channels(organization_id):
+
+    # All the channels of the organization in a single query, grouped by type
+    channels = {}
+    for channel in db.Channel.records(organization_id):
+        channels.setdefault(channel.type, []).append(channel)
+
+    return dict((channel_type, tuple(records)) for channel_type, records in channels.items())
+
+
+def _organization_channels(organization_id, channel_type):
+
+    # Records are immutable, the cached ones are shared by every request
+    channels = cache.get_channels(organization_id, _load_channels)
+    return channels.get(channel_type, ())
+
+
+def _search_channels(organization_id, channel_type, data_dict):
+
+    q = (data_dict.get('q') or u'').strip()
+
+    try:
+        limit = data_dict.get('limit')
+        limit = min(int(limit), constants.CHANNELS_LIMIT) if limit not in (None, '') else None
+        offset = int(data_dict.get('offset') or 0)
+    except ValueError:
+        raise toolkit.ValidationError(toolkit._('Limit and offset must be natural numbers'))
+    if (limit is not None and limit < 1) or offset < 0:
+        raise toolkit.ValidationError(toolkit._('Limit and offset must be natural numbers'))
+
+    # Whole lists come from the cache, pages and searches only read the rows they return
+    if limit is None and not offset and not q:
+        return _organization_channels(organization_id, channel_type)
+    return db.Channel.search(organization_id, channel_type, q, limit, offset)
+
+
+def _dictize_notify_settings(organization_id, settings):
+
+    # Organizations which never saved their settings get the defaults
+    data_dict = {
+        'organization_id': organization_id,
+        'email_bcc': settings.email_bcc if settings else False,
+    }
+
+    return data_dict
+
+
+def _dictize_dead_letter(dead_letter):
+
+    # Convert the dead letter into a dict
+    data_dict = {
+        'id': dead_letter.id,
+        'organization_id': dead_letter.organization_id,
+        'channel_type': dead_letter.channel_type,
+        'channel_id': dead_letter.channel_id,
+        'channel': _dictize_channel(db.ChannelRecord.from_dict(dead_letter.channel_type,
+                                                                json.loads(dead_letter.channel))),
+        'payload': json.loads(dead_letter.payload),
+        'attempts': dead_letter.attempts,
+        'last_error': dead_letter.last_error,
+        'created': dead_letter.created.isoformat() if dead_letter.created else None,
+    }
+
+    return data_dict
+
+
+def _add_statuses(channels):
+
+    # Add the circuit breaker state of every channel
+    states = breaker.statuses([channel['id'] for channel in channels])
+    for channel in channels:
+        channel['status'] = states[channel['id']]
+
+
 def datarequest_register_slack(context, data_dict):
     '''
     Action to register a slack channel. The function checks the access rights
@@ -66,24 +193,21 @@ def datarequest_register_slack(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     session = context['session']
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Validate data
     validator.validate_slack_form(context, data_dict)
+    data_dict = dict(data_dict, organization_id=_organization_id(data_dict.get('organization_id')))
 
     # Store the data
-    slack_details = db.Org_Slack_Details()
+    slack_details = db.Channel()
     _undictize_slack_basic(slack_details, data_dict)
 
     session.add(slack_details)
-    session.commit()
+    _commit_channel(session, toolkit._('Webhook URL'), slack_details.organization_id)
 
     return _dictize_slack_details(slack_details)
 
@@ -99,32 +223,29 @@ def slack_channels_show(context, data_dict):
     :type context: dict
     :param data_dict: Contains the following
     organization_id: The ID of the organization
+    q: Only return the channels whose webhook URL or slack channel contains
+        this text, ignoring case (optional)
+    limit: The maximum number of channels returned (optional, at most 1000)
+    offset: The number of channels skipped, in order of registration
+        (optional)
     :type data_dict: dict
     :returns: A list of the slack notification details(id,
-        organization_id, webhook_url, slack_channel)
+        organization_id, webhook_url, slack_channel, status)
     :rtype: list
     '''
 
-    model = context['model']
     organization_id = data_dict.get('organization_id')
-    success = data_dict.get('success', False)
 
-    if not organization_id and not success:
+    if not organization_id:
         raise toolkit.ValidationError(toolkit._('Organization ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
-    if not success:
-        toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
+    toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
-    # Get the available slack channels
-    result = db.Org_Slack_Details.get(organization_id=organization_id)
-    if result:
-        slack_channels = [_dictize_slack_details(channel) for channel in result]
-    else:
-        slack_channels = []
+    # Get the slack channels of the organization, whole lists are cached until they change
+    slack_channels = [_dictize_slack_details(channel) for channel in
+                          _search_channels(_organization_id(organization_id), constants.CHANNEL_TYPE_SLACK, data_dict)]
+    _add_statuses(slack_channels)
 
     return slack_channels
 
@@ -146,20 +267,16 @@ def slack_channel_show(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     id = data_dict.get('id', '')
 
     if not id:
         raise toolkit.ValidationError(toolkit._('Channel ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the data request
-    result = db.Org_Slack_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_SLACK)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Channel {0} not found in the data base').format(id))
 
@@ -191,33 +308,31 @@ def slack_channel_update(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     session = context['session']
     id = data_dict.get('id', '')
 
     if not id:
         raise toolkit.ValidationError(toolkit._('Slack Channel ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the initial data
-    result = db.Org_Slack_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_SLACK)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Channel {0} not found in the database').format(id))
     slack_details = result[0]
 
     # Validate data
     validator.validate_slack_form(context, data_dict)
+    data_dict = dict(data_dict, organization_id=_organization_id(data_dict.get('organization_id')))
 
     # Set the data provided by the user in the data_red
+    previous_organization_id = slack_details.organization_id
     _undictize_slack_basic(slack_details, data_dict)
 
     session.add(slack_details)
-    session.commit()
+    _commit_channel(session, toolkit._('Webhook URL'), previous_organization_id, slack_details.organization_id)
 
     return _dictize_slack_details(slack_details)
 
@@ -234,7 +349,6 @@ def slack_channel_delete(context, data_dict):
     :type data_dict: dict
     '''
 
-    model = context['model']
     session = context['session']
     id = data_dict.get('id', '')
 
@@ -242,20 +356,15 @@ def slack_channel_delete(context, data_dict):
     if not id:
         raise toolkit.ValidationError(toolkit._('Slack Channel ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the slack channel
-    result = db.Org_Slack_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_SLACK)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Channel {0} not found in the database').format(id))
 
-    slack_details = result[0]
-    session.delete(slack_details)
-    session.commit()
+    _delete_channel(session, result[0])
 
 
 def datarequest_register_email(context, data_dict):
@@ -278,24 +387,21 @@ def datarequest_register_email(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     session = context['session']
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Validate data
     validator.validate_email_form(context, data_dict)
+    data_dict = dict(data_dict, organization_id=_organization_id(data_dict.get('organization_id')))
 
     # Store the data
-    email_details = db.Org_Email_Details()
+    email_details = db.Channel()
     _undictize_email_basic(email_details, data_dict)
 
     session.add(email_details)
-    session.commit()
+    _commit_channel(session, toolkit._('Email'), email_details.organization_id)
 
     return _dictize_email_details(email_details)
 
@@ -317,20 +423,16 @@ def email_channel_show(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     id = data_dict.get('id', '')
 
     if not id:
         raise toolkit.ValidationError(toolkit._('Email ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the data request
-    result = db.Org_Email_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_EMAIL)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Email {0} not found in the data base'.format(id)))
 
@@ -351,32 +453,29 @@ def email_channels_show(context, data_dict):
     :type data_dict: dict
     :param data_dict: Contains the following
     organization_id: The ID of the organization
+    q: Only return the channels whose email contains this text, ignoring
+        case (optional)
+    limit: The maximum number of channels returned (optional, at most 1000)
+    offset: The number of channels skipped, in order of registration
+        (optional)
     :type data_dict: dict
     :returns: A list of the email notification details(id,
-        organization_id, email)
+        organization_id, email, status)
     :rtype: list
     '''
 
-    model = context['model']
     organization_id = data_dict.get('organization_id', '')
-    success = data_dict.get('success', False)
 
-    if not organization_id and not success:
+    if not organization_id:
         raise toolkit.ValidationError(toolkit._('Organization ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
-    if not success:
-        toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
+    toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
-    # Get the available slack channels
-    result = db.Org_Email_Details.get(organization_id=organization_id)
-    if result:
-        email_channels = [_dictize_email_details(channel) for channel in result]
-    else:
-        email_channels = []
+    # Get the email channels of the organization, whole lists are cached until they change
+    email_channels = [_dictize_email_details(channel) for channel in
+                          _search_channels(_organization_id(organization_id), constants.CHANNEL_TYPE_EMAIL, data_dict)]
+    _add_statuses(email_channels)
 
     return email_channels
 
@@ -402,33 +501,31 @@ def email_channel_update(context, data_dict):
     :rtype: dict
     '''
 
-    model = context['model']
     session = context['session']
     id = data_dict.get('id', '')
 
     if not id:
         raise toolkit.ValidationError(toolkit._('Email Notification ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the initial data
-    result = db.Org_Email_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_EMAIL)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Email {0} not found in the database'.format(id)))
     email_data = result[0]
 
     # Validate data
     validator.validate_email_form(context, data_dict)
+    data_dict = dict(data_dict, organization_id=_organization_id(data_dict.get('organization_id')))
 
     # Set the data provided by the user in the data_dict
+    previous_organization_id = email_data.organization_id
     _undictize_email_basic(email_data, data_dict)
 
     session.add(email_data)
-    session.commit()
+    _commit_channel(session, toolkit._('Email'), previous_organization_id, email_data.organization_id)
 
     return _dictize_email_details(email_data)
 
@@ -445,7 +542,6 @@ def email_channel_delete(context, data_dict):
     :type data_dict: dict
     '''
 
-    model = context['model']
     session = context['session']
     id = data_dict.get('id', '')
 
@@ -453,17 +549,439 @@ def email_channel_delete(context, data_dict):
     if not id:
         raise toolkit.ValidationError(toolkit._('Email ID has not been included'))
 
-    # Init the data base
-    db.init_db(model)
-
     # Check access
     toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
 
     # Get the slack channel
-    result = db.Org_Email_Details.get(id=id)
+    result = db.Channel.get(id=id, type=constants.CHANNEL_TYPE_EMAIL)
     if not result:
         raise toolkit.ObjectNotFound(toolkit._('Email {0} not found in the database'.format(id)))
 
-    email_data = result[0]
-    session.delete(email_data)
+    _delete_channel(session, result[0])
+
+
+def channel_reenable(context, data_dict):
+    '''
+    Action to re-enable a notification channel which has been suspended, or
+    whose circuit has been opened, after failed deliveries. The function
+    checks the access rights of the user before re-enabling the channel. If
+    the user is not allowed a NotAuthorized exception will be risen.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    id: The id of the notification channel
+    channel_type: The type of the channel, slack or email
+    organization_id: The ID of the organization of the channel
+    :type data_dict: dict
+    :returns: A dict with the channel (id, channel_type, status)
+    :rtype: dict
+    '''
+
+    id = data_dict.get('id', '')
+    channel_type = data_dict.get('channel_type', '')
+
+    if not id:
+        raise toolkit.ValidationError(toolkit._('Channel ID has not been included'))
+
+    if channel_type not in (constants.CHANNEL_TYPE_SLACK, constants.CHANNEL_TYPE_EMAIL):
+        raise toolkit.ValidationError(toolkit._('Channel type must be slack or email'))
+
+    # Check access
+    toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
+
+    organization_id = _organization_id(data_dict.get('organization_id'))
+    result = db.Channel.get(id=id, type=channel_type, organization_id=organization_id)
+    if not result:
+        raise toolkit.ObjectNotFound(toolkit._('Channel {0} not found in the database').format(id))
+
+    breaker.reenable([id])
+    db.Notify_Channel_Version.touch([organization_id])
+
+    return {'id': id, 'channel_type': channel_type, 'status': breaker.CLOSED}
+
+
+def channels_bulk_register(context, data_dict):
+    '''
+    Action to register many slack and email channels at once. Access rights
+    are checked once per organization, the batch is validated with a few
+    set-based queries and the valid channels are inserted in a single
+    transaction. Invalid channels are not registered and their errors are
+    returned, so the valid ones do not have to be sent again.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following:
+    channels: A list of channels, each one with its type (slack or email),
+        organization_id and either webhook_url and slack_channel or email
+    :type data_dict: dict
+    :returns: A dict with the channels registered (channels) and the errors
+        of the others by row number, starting at 1 (errors)
+    :rtype: dict
+    '''
+
+    session = context['session']
+    rows = data_dict.get('channels')
+
+    if isinstance(rows, basestring):
+        rows = bulk.parse(rows, 'json')
+
+    if not isinstance(rows, list) or not rows:
+        raise toolkit.ValidationError(toolkit._('A list of channels is required'))
+
+    if len(rows) > bulk.max_rows():
+        raise toolkit.ValidationError(toolkit._('At most {0} channels can be registered at once').format(
+            bulk.max_rows()))
+
+    # Check access, once per organization instead of once per channel
+    allowed = set()
+    for organization_id in bulk.requested_organizations(rows):
+        try:
+            toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, {'organization_id': organization_id})
+            allowed.add(organization_id)
+        except toolkit.NotAuthorized:
+            pass
+
+    valid, errors = bulk.validate(rows, allowed)
+
+    created = []
+    if valid:
+        try:
+            created = bulk.register(session, valid)
+        except sa.exc.IntegrityError:
+            # The unique indexes catch the channels registered while the batch was validated
+            session.rollback()
+            raise toolkit.ValidationError(toolkit._('Some channels were registered meanwhile, '
+                                                    'send the batch again'))
+        cache.invalidate(*set(channel.organization_id for channel in created))
+
+    return {
+        'channels': [_dictize_channel(channel) for channel in created],
+        'errors': [{'row': number, 'errors': errors[number]} for number in sorted(errors)],
+    }
+
+
+def channels_import(context, data_dict):
+    '''
+    Action to register the slack and email channels listed in a JSON or CSV
+    file, as channels_bulk_register does. CSV files start with a header row
+    naming their columns: type, organization_id, webhook_url, slack_channel
+    and email.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following:
+    data: The content of the file, unless it is uploaded as upload
+    upload: The file uploaded, unless its content is given as data
+    format: json or csv (optional, taken from the extension of the file
+        uploaded, json by default)
+    :type data_dict: dict
+    :returns: A dict with the channels registered (channels) and the errors
+        of the others by row number, starting at 1 (errors)
+    :rtype: dict
+    '''
+
+    data = data_dict.get('data')
+    upload = data_dict.get('upload')
+    format = data_dict.get('format')
+
+    if not data and hasattr(upload, 'file'):
+        data = upload.file.read()
+        if not format and getattr(upload, 'filename', None):
+            format = upload.filename.rsplit('.', 1)[-1].lower()
+
+    if not data:
+        raise toolkit.ValidationError(toolkit._('The channels to import have not been included'))
+
+    rows = bulk.parse(data, format or 'json')
+
+    return channels_bulk_register(context, {'channels': rows})
+
+
+def channels_export(context, data_dict):
+    '''
+    Action to list the channels of every organization, a page at a time,
+    ordered by id. To get the next page, pass the next value returned as
+    after; it is None after the last page. Only sysadmins are allowed to
+    call it.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    type: slack or email, to list only the channels of a type (optional)
+    organization_id: The ID of the organization whose channels are listed
+        (optional)
+    after: The id of the last channel of the previous page (optional)
+    limit: The maximum number of channels returned (optional, at most
+        ckanext.notify.export.page_size)
+    :type data_dict: dict
+    :returns: A dict with the channels of the page (channels), each with its
+        id, type, organization_id, webhook_url, slack_channel and email, and
+        the value of after for the next page (next)
+    :rtype: dict
+    '''
+
+    channel_type = data_dict.get('type')
+
+    if channel_type and channel_type not in (constants.CHANNEL_TYPE_SLACK, constants.CHANNEL_TYPE_EMAIL):
+        raise toolkit.ValidationError(toolkit._('Channel type must be slack or email'))
+
+    try:
+        limit = min(int(data_dict.get('limit') or export.page_size()), export.page_size())
+    except ValueError:
+        raise toolkit.ValidationError(toolkit._('Limit must be a natural number'))
+    if limit < 1:
+        raise toolkit.ValidationError(toolkit._('Limit must be a natural number'))
+
+    # Check access
+    toolkit.check_access(constants.NOTIFY_ADMIN, context, data_dict)
+
+    organization_id = data_dict.get('organization_id')
+    if organization_id:
+        organization_id = export.organization_id(organization_id)
+
+    channels = db.Channel.page(data_dict.get('after'), limit, type=channel_type, organization_id=organization_id)
+
+    return {
+        'channels': [export.dictize(channel) for channel in channels],
+        'next': channels[-1].id if len(channels) == limit else None,
+    }
+
+
+def notify_datarequest_event(context, data_dict):
+    '''
+    Action to notify an organization of a datarequest event through all its
+    channels. The channels of every type are loaded with a single query, or
+    taken from the channel cache, and the message is rendered once per channel type. This action is meant to be
+    called by other extensions, such as ckanext-datarequest, with ignore_auth
+    set in the context; otherwise only sysadmins are allowed to call it.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    event: datarequest_create, datarequest_comment or datarequest_close
+    datarequest: The datarequest dict, with its organization, title,
+        description and datarequest_url. The title and datarequest_url
+        cannot be empty
+    channel_types: The types of channels to notify (optional, all of them by
+        default)
+    :type data_dict: dict
+    :returns: A dict with the idempotency key of the event (event_key) and the
+        number of channels notified per type (slack, email)
+    :rtype: dict
+    '''
+
+    event = data_dict.get('event', '')
+    datarequest = data_dict.get('datarequest') or {}
+    channel_types = data_dict.get('channel_types') or [constants.CHANNEL_TYPE_SLACK, constants.CHANNEL_TYPE_EMAIL]
+
+    if event not in constants.DATAREQUEST_EVENTS:
+        raise toolkit.ValidationError(toolkit._('Event must be one of {0}').format(
+            ', '.join(constants.DATAREQUEST_EVENTS)))
+
+    validator.validate_datarequest(context, datarequest)
+
+    # Check access
+    toolkit.check_access(constants.NOTIFY_ADMIN, context, data_dict)
+
+    summary = {'event_key': None, constants.CHANNEL_TYPE_SLACK: 0, constants.CHANNEL_TYPE_EMAIL: 0}
+
+    organization = datarequest.get('organization')
+    if not organization:
+        return summary
+    organization_id = organizations.resolve(organization.get('id') or organization.get('name'))
+    if not organization_id:
+        return summary
+
+    # The channels of every type, from the cache or a single query
+    channels = {}
+    for channel_type in channel_types:
+        type_channels = _organization_channels(organization_id, channel_type)
+        if type_channels:
+            channels[channel_type] = list(type_channels)
+
+    if not channels:
+        return summary
+
+    email_bcc = False
+    if channels.get(constants.CHANNEL_TYPE_EMAIL):
+        result = db.Org_Notify_Settings.get(organization_id=organization_id)
+        email_bcc = result[0].email_bcc if result else False
+
+    summary['event_key'] = notifier.notify(event, datarequest, organization_id, channels, email_bcc=email_bcc)
+    for channel_type, type_channels in channels.items():
+        summary[channel_type] = len(type_channels)
+
+    return summary
+
+
+def notify_settings_show(context, data_dict):
+    '''
+    Action to retrieve the notification settings of an organization. The only
+    required parameter is the ID of the organization.
+    Access rights will be checked before returning the information and an
+    exception will be risen (NotAuthorized) if the user is not authorized.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    organization_id: The ID of the organization
+    :type data_dict: dict
+    :returns: A dict with the settings (organization_id, email_bcc)
+    :rtype: dict
+    '''
+
+    organization_id = data_dict.get('organization_id', '')
+
+    if not organization_id:
+        raise toolkit.ValidationError(toolkit._('Organization ID has not been included'))
+
+    # Check access
+    toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
+
+    organization_id = _organization_id(organization_id)
+    result = db.Org_Notify_Settings.get(organization_id=organization_id)
+
+    return _dictize_notify_settings(organization_id, result[0] if result else None)
+
+
+def notify_settings_update(context, data_dict):
+    '''
+    Action to update the notification settings of an organization. The
+    function checks the access rights of the user before updating the
+    settings. If the user is not allowed a NotAuthorized exception will be
+    risen.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following:
+    organization_id: The ID of the organization
+    email_bcc: Whether a single email is sent to all the addresses of the
+        organization, as blind carbon copies, instead of one email per address
+    :type data_dict: dict
+    :returns: A dict with the settings (organization_id, email_bcc)
+    :rtype: dict
+    '''
+
+    session = context['session']
+    organization_id = data_dict.get('organization_id', '')
+
+    if not organization_id:
+        raise toolkit.ValidationError(toolkit._('Organization ID has not been included'))
+
+    # Check access
+    toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, data_dict)
+
+    organization_id = _organization_id(organization_id)
+    result = db.Org_Notify_Settings.get(organization_id=organization_id)
+    if result:
+        settings = result[0]
+    else:
+        settings = db.Org_Notify_Settings()
+        settings.organization_id = organization_id
+
+    settings.email_bcc = toolkit.asbool(data_dict.get('email_bcc', False))
+
+    # The settings are shown on the channels page, whose ETag is the version of the channels
+    db.Notify_Channel_Version.bump(session, [organization_id])
+    session.add(settings)
+    session.commit()
+
+    return _dictize_notify_settings(organization_id, settings)
+
+
+def notify_dispatch_status(context, data_dict):
+    '''
+    Action to inspect the background notification dispatcher of the process
+    serving the request. Only sysadmins are allowed to call it.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Not used
+    :type data_dict: dict
+    :returns: A dict with the dispatcher status (enabled, workers, queue_size,
+        queue_depth, scheduled), the webhook rate limiter counters
+        (ratelimit), the channel cache counters (cache) and the organization
+        cache counters (organizations)
+    :rtype: dict
+    '''
+
+    # Check access
+    toolkit.check_access(constants.NOTIFY_ADMIN, context, data_dict)
+
+    status = dispatcher.status()
+    status['ratelimit'] = ratelimit.stats()
+    status['cache'] = cache.stats()
+    status['organizations'] = organizations.stats()
+
+    return status
+
+
+def notify_dead_letters_show(context, data_dict):
+    '''
+    Action to retrieve the notifications which could not be delivered, newest
+    first. Only sysadmins are allowed to call it.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    organization_id: The ID of an organization to restrict the list to
+        (optional)
+    channel_type: slack or email, to restrict the list to (optional)
+    limit: The maximum number of dead letters returned (optional, 100 by
+        default and at most 1000)
+    :type data_dict: dict
+    :returns: A list of the dead letters (id, organization_id, channel_type,
+        channel_id, channel, payload, attempts, last_error, created)
+    :rtype: list
+    '''
+
+    # Check access
+    toolkit.check_access(constants.NOTIFY_ADMIN, context, data_dict)
+
+    filters = {}
+    for key in ('organization_id', 'channel_type'):
+        if data_dict.get(key):
+            filters[key] = data_dict[key]
+    if 'organization_id' in filters:
+        filters['organization_id'] = organizations.resolve(filters['organization_id']) or filters['organization_id']
+
+    try:
+        limit = min(int(data_dict.get('limit') or constants.DEAD_LETTERS_LIMIT), constants.DEAD_LETTERS_MAX_LIMIT)
+    except ValueError:
+        raise toolkit.ValidationError(toolkit._('Limit must be a natural number'))
+    if limit < 1:
+        raise toolkit.ValidationError(toolkit._('Limit must be a natural number'))
+
+    result = db.Notify_Dead_Letter.latest(limit, **filters)
+
+    return [_dictize_dead_letter(dead_letter) for dead_letter in result]
+
+
+def notify_dead_letter_requeue(context, data_dict):
+    '''
+    Action to dispatch again a notification which could not be delivered. The
+    dead letter is removed and the delivery starts over with a new set of
+    attempts. Only sysadmins are allowed to call it.
+    :param context: the context of the request
+    :type context: dict
+    :param data_dict: Contains the following
+    id: The id of the dead letter to requeue
+    :type data_dict: dict
+    :returns: A dict with the requeued dead letter
+    :rtype: dict
+    '''
+
+    session = context['session']
+    id = data_dict.get('id', '')
+
+    if not id:
+        raise toolkit.ValidationError(toolkit._('Dead letter ID has not been included'))
+
+    # Check access
+    toolkit.check_access(constants.NOTIFY_ADMIN, context, data_dict)
+
+    result = db.Notify_Dead_Letter.get(id=id)
+    if not result:
+        raise toolkit.ObjectNotFound(toolkit._('Dead letter {0} not found in the database').format(id))
+
+    dead_letter = result[0]
+    data_dict = _dictize_dead_letter(dead_letter)
+
+    session.delete(dead_letter)
     session.commit()
+
+    delivery.requeue(dead_letter)
+
+    return data_dict
@@ -1,10 +1,57 @@
-import ckan.lib.helpers as helpers
+import ckan.authz as authz
+import ckan.model as model
+import ckanext.notify.organizations as organizations
+
+
+def _user(context):
+    user = context.get('auth_user_obj')
+    if user is None and context.get('user'):
+        # Kept in the context, like check_access does, for the next checks of the request
+        user = context['auth_user_obj'] = model.User.get(context['user'])
+    return user
+
+
+def _can_manage(user, organization_id):
+    if organization_id is None:
+        return False
+
+    # A single indexed lookup of the membership of the user in the target organization, instead of listing
+    # every organization the user can manage
+    member = model.Session.query(model.Member.id).autoflush(False)\
+        .filter(model.Member.group_id == organization_id)\
+        .filter(model.Member.table_name == 'user')\
+        .filter(model.Member.table_id == user.id)\
+        .filter(model.Member.state == 'active')\
+        .filter(model.Member.capacity.in_(authz.get_roles_with_permission('manage_group')))\
+        .first()
+    return member is not None
 
 
 def manage_notifications(context, data_dict):
-    my_organizations = helpers.organizations_available()
-    can_manage = [org['name'] for org in my_organizations]
-    if data_dict['organization_id'] in can_manage:
+    user = _user(context)
+    if user is None:
+        return {'success': False, 'msg': 'You must be logged in to manage notifications'}
+
+    # Sysadmins manage every organization, there is nothing to look up
+    if user.sysadmin:
         return {'success': True}
-    else:
-        return {'success': False, 'msg': 'You do not have permission to register slack for this organization'}
+
+    # Forms and URLs pass the name, channels store the id
+    organization_id = organizations.resolve(data_dict.get('organization_id'))
+
+    # The context lives as long as the request, so a page checking the same organization from the controller and
+    # from several actions looks the membership up once
+    decisions = context.setdefault('__notify_auth', {})
+    key = (user.id, organization_id)
+    if key not in decisions:
+        decisions[key] = _can_manage(user, organization_id)
+
+    if decisions[key]:
+        return {'success': True}
+
+    return {'success': False, 'msg': 'You do not have permission to register slack for this organization'}
+
+
+def notify_admin(context, data_dict):
+    # Only sysadmins, who bypass auth functions, can inspect the notification system
+    return {'success': False, 'msg': 'Only sysadmins can manage the notification system'}
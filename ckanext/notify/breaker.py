@@ -0,0 +1,134 @@
+import datetime
+import logging
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.db as db
+import ckanext.notify.retry as retry
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+CLOSED = u'closed'
+OPEN = u'open'
+HALF_OPEN = u'half_open'
+SUSPENDED = u'suspended'
+
+
+class EndpointGone(Exception):
+    '''
+    A failure showing that the endpoint will never work again, such as a
+    webhook of a deleted Slack app or a bounced address. The channel is
+    suspended until it is re-enabled by an organization admin.
+    '''
+
+
+class CircuitOpen(Exception):
+    '''The channel was skipped because it failed too often recently.'''
+
+
+def _threshold():
+    return toolkit.asint(config.get('ckanext.notify.breaker.failure_threshold', 5))
+
+
+def _cooldown():
+    return datetime.timedelta(seconds=toolkit.asint(config.get('ckanext.notify.breaker.cooldown', 300)))
+
+
+def statuses(channel_ids):
+    '''Returns the circuit state of every channel given, by channel id.'''
+    health = db.Notify_Channel_Health.states(channel_ids)
+    return dict((channel_id, health[channel_id]['state'] if channel_id in health else CLOSED)
+                for channel_id in channel_ids)
+
+
+def _touch(organization_ids):
+    # The channels pages show the states, their version tells browsers and caches they changed
+    if organization_ids:
+        db.Notify_Channel_Version.touch(organization_ids)
+
+
+def allow(channel_type, channels):
+    '''
+    Splits the channels into the ones which may be notified and the ones
+    whose circuit is open. An open circuit lets a single trial delivery
+    through once the cooldown has passed; suspended channels are left out
+    entirely. Also returns the state of the channels with a recorded
+    health, by channel id, for `record`.
+    '''
+    health = db.Notify_Channel_Health.states([channel.id for channel in channels])
+    now = datetime.datetime.utcnow()
+    cutoff = now - _cooldown()
+
+    tracked = dict((channel_id, row['state']) for channel_id, row in health.items())
+    allowed = []
+    skipped = []
+    changed = set()
+    for channel in channels:
+        row = health.get(channel.id)
+        if row is None or row['state'] == CLOSED:
+            allowed.append(channel)
+        elif row['state'] == SUSPENDED:
+            log.debug('Skipping suspended %s channel %s', channel_type, channel.id)
+        elif db.Notify_Channel_Health.try_half_open(channel.id, now, cutoff):
+            log.info('Trying %s channel %s again after its circuit opened', channel_type, channel.id)
+            allowed.append(channel)
+            changed.add(channel.organization_id)
+            tracked[channel.id] = HALF_OPEN
+        else:
+            skipped.append(channel)
+
+    _touch(changed)
+    return allowed, skipped, tracked
+
+
+def _state_for(permanent, threshold):
+    def state_for(previous, failures):
+        if permanent:
+            return SUSPENDED
+        if previous == HALF_OPEN or failures >= threshold:
+            return OPEN
+        return previous
+    return state_for
+
+
+def _counts(result, trial, attempt, max_attempts):
+    # A delivery paced by a rate limit was not even tried
+    if isinstance(result.error, retry.Deferred):
+        return False
+    # A failure which will be retried is judged on its last attempt, so a single event failing once per attempt
+    # does not reach the threshold on its own
+    if trial or attempt >= max_attempts:
+        return True
+    return not isinstance(result.error, retry.RetryableError)
+
+
+def record(channel_type, results, tracked, attempt=1):
+    '''
+    Records the outcome of the deliveries of an attempt: a success closes
+    the circuit of a tracked channel, failures open it once they reach the
+    threshold, and a failed trial opens it again. Failures which are going
+    to be retried only count once the event used its last attempt.
+    '''
+    now = datetime.datetime.utcnow()
+    threshold = _threshold()
+    max_attempts = retry.max_attempts()
+
+    closed = [result.item for result in results if result.success and result.item.id in tracked]
+    db.Notify_Channel_Health.reset([channel.id for channel in closed])
+    changed = set(channel.organization_id for channel in closed)
+
+    for result in results:
+        if not result.success and _counts(result, tracked.get(result.item.id) == HALF_OPEN, attempt, max_attempts):
+            state_for = _state_for(isinstance(result.error, EndpointGone), threshold)
+            if db.Notify_Channel_Health.record_failure(result.item.id, channel_type, state_for,
+                                                       unicode(result.error), now):
+                changed.add(result.item.organization_id)
+
+    _touch(changed)
+
+
+def reenable(channel_ids):
+    '''Closes the circuit of suspended or open channels.'''
+    db.Notify_Channel_Health.reset(channel_ids)
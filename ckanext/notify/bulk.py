@@ -0,0 +1,170 @@
+import csv
+import datetime
+import json
+import StringIO
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.constants as constants
+import ckanext.notify.db as db
+import ckanext.notify.organizations as organizations
+import ckanext.notify.validator as validator
+
+from ckan.common import config
+
+
+FORMATS = ['json', 'csv']
+
+# Columns of the CSV files, the same keys are used by JSON lists
+FIELDS = ['type', 'organization_id', 'webhook_url', 'slack_channel', 'email']
+
+
+def max_rows():
+    return toolkit.asint(config.get('ckanext.notify.bulk.max_rows', 10000))
+
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return unicode(value).strip()
+
+
+def parse(data, format):
+    '''
+    Returns the list of channel dicts held by a JSON list, or by a CSV file
+    with a header row naming the FIELDS it uses.
+    '''
+    if format not in FORMATS:
+        raise toolkit.ValidationError(toolkit._('Format must be one of {0}').format(', '.join(FORMATS)))
+
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+
+    if format == 'json':
+        try:
+            rows = json.loads(data)
+        except ValueError as e:
+            raise toolkit.ValidationError(toolkit._('Invalid JSON: {0}').format(e))
+        if isinstance(rows, dict):
+            rows = rows.get('channels')
+        if not isinstance(rows, list):
+            raise toolkit.ValidationError(toolkit._('A list of channels is required'))
+        return rows
+
+    try:
+        return list(csv.DictReader(StringIO.StringIO(data)))
+    except csv.Error as e:
+        raise toolkit.ValidationError(toolkit._('Invalid CSV: {0}').format(e))
+
+
+def _normalize(row):
+    if not isinstance(row, dict):
+        return None
+    channel = dict((field, _text(row.get(field))) for field in FIELDS)
+    channel['type'] = channel['type'].lower()
+    # Slack channel names are lowercase, as the registration form stores them
+    channel['slack_channel'] = channel['slack_channel'].lower()
+    return channel
+
+
+def requested_organizations(rows):
+    '''Returns the organizations of the channels of a batch, by the name or id given.'''
+    return set(_text(row.get('organization_id')) for row in rows if isinstance(row, dict)) - set([u''])
+
+
+def _key(channel):
+    if channel['type'] == constants.CHANNEL_TYPE_SLACK:
+        return channel['type'], channel['webhook_url'], channel['slack_channel']
+    return channel['type'], channel['email'], u''
+
+
+def validate(rows, allowed_organizations):
+    '''
+    Validates a batch of channels. The fields of every channel are checked on
+    their own, while the existence of the organizations and the channels
+    already registered are checked for the whole batch at once. Only the
+    channels of `allowed_organizations` may be registered. Returns the valid
+    channels, as (row number, channel) pairs, and the errors of the others,
+    as a dict by row number.
+    '''
+    errors = {}
+    channels = []
+
+    for number, row in enumerate(rows, 1):
+        channel = _normalize(row)
+        if channel is None:
+            errors[number] = {toolkit._('Channel'): [toolkit._('A channel must be an object')]}
+            continue
+
+        if channel['type'] == constants.CHANNEL_TYPE_SLACK:
+            row_errors = validator.slack_errors(channel)
+        elif channel['type'] == constants.CHANNEL_TYPE_EMAIL:
+            row_errors = validator.email_errors(channel)
+        else:
+            row_errors = {toolkit._('Type'): [toolkit._('Channel type must be slack or email')]}
+
+        if not channel['organization_id']:
+            row_errors[toolkit._('Organization')] = [toolkit._('Organization ID has not been included')]
+        elif channel['organization_id'] not in allowed_organizations:
+            row_errors[toolkit._('Organization')] = [toolkit._('You are not allowed to manage this organization')]
+
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            channels.append((number, channel))
+
+    # One query for all the organizations of the batch, which are stored by id
+    resolved = organizations.resolve_many(set(channel['organization_id'] for _, channel in channels))
+    for number, channel in channels:
+        channel['organization_id'] = resolved.get(channel['organization_id'])
+
+    # One query per type, and chunk of addresses, for the channels already registered
+    registered = set()
+    for channel_type in (constants.CHANNEL_TYPE_SLACK, constants.CHANNEL_TYPE_EMAIL):
+        addresses = [_key(channel)[1] for _, channel in channels if channel['type'] == channel_type]
+        if addresses:
+            registered.update((channel_type,) + pair for pair in db.Channel.existing(channel_type, addresses))
+
+    valid = []
+    seen = set()
+    for number, channel in channels:
+        key = _key(channel)
+        field = toolkit._('Webhook URL') if channel['type'] == constants.CHANNEL_TYPE_SLACK else toolkit._('Email')
+        if channel['organization_id'] is None:
+            errors[number] = {toolkit._('Organization'): [toolkit._('Organization not found')]}
+        elif key in registered or key in seen:
+            errors[number] = {field: [toolkit._('The channel already exists')]}
+        else:
+            seen.add(key)
+            valid.append((number, channel))
+
+    return valid, errors
+
+
+def register(session, channels):
+    '''
+    Inserts the channels, as returned by validate, in a single transaction
+    and increments the version of their organizations. Returns the
+    ChannelRecords inserted.
+    '''
+    now = datetime.datetime.utcnow()
+    rows = []
+    for _, channel in channels:
+        channel_type, address, slack_channel = _key(channel)
+        rows.append({
+            'id': db.uuid4(),
+            'organization_id': channel['organization_id'],
+            'type': channel_type,
+            'address': address,
+            'slack_channel': slack_channel,
+            'created': now,
+        })
+
+    organization_ids = set(row['organization_id'] for row in rows)
+    db.Notify_Channel_Version.bump(session, organization_ids)
+    db.Channel.insert_many(session, rows)
+    session.commit()
+
+    return [db.ChannelRecord(row['id'], row['organization_id'], row['type'], row['address'], row['slack_channel'])
+            for row in rows]
@@ -0,0 +1,181 @@
+import collections
+import os
+import threading
+import time
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.db as db
+
+from ckan.common import config
+
+
+class LRUCache(object):
+    '''
+    Size bounded mapping which forgets the least recently used entries first
+    and the entries older than `ttl` seconds. Safe to share between threads.
+    '''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.pid = os.getpid()
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''Returns the value cached for `key`, or None if there is no fresh one.'''
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return None
+
+            # Moved back to the end, as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record_stale(self):
+        with self._lock:
+            self.stale += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+            }
+
+
+class _Entry(object):
+    '''Channels of an organization, with the version they were loaded at.'''
+
+    __slots__ = ('version', 'checked', 'channels')
+
+    def __init__(self, version, checked, channels):
+        self.version = version
+        self.checked = checked
+        self.channels = channels
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def is_enabled():
+    return toolkit.asint(config.get('ckanext.notify.cache.size', 1000)) > 0
+
+
+def get_cache():
+    '''
+    Returns the channel cache of the current process, creating it on first
+    use. A forked child starts with an empty cache of its own.
+    '''
+    global _cache
+
+    if _cache is None or _cache.pid != os.getpid():
+        with _lock:
+            if _cache is None or _cache.pid != os.getpid():
+                size = toolkit.asint(config.get('ckanext.notify.cache.size', 1000))
+                ttl = toolkit.asint(config.get('ckanext.notify.cache.ttl', 60))
+                _cache = LRUCache(size, ttl)
+
+    return _cache
+
+
+def version(organization_id):
+    '''
+    Returns the version of the channels of an organization, which every
+    process increments when it changes them.
+    '''
+    return db.Notify_Channel_Version.version(organization_id)
+
+
+def version_state(organization_id):
+    '''Returns the version of the channels of an organization and when it changed.'''
+    return db.Notify_Channel_Version.state(organization_id)
+
+
+def get_channels(organization_id, load):
+    '''
+    Returns the channels of an organization, calling `load(organization_id)`
+    only when they are not cached or when another process changed them since.
+    A cached value is checked against the version of the organization at
+    most once every ckanext.notify.cache.check_interval seconds, which costs
+    a primary key lookup instead of loading the channels. Cached values are
+    shared by every caller, so they must never be modified.
+    '''
+    if not is_enabled():
+        return load(organization_id)
+
+    cache = get_cache()
+    now = time.time()
+    entry = cache.get(organization_id)
+
+    check_interval = float(config.get('ckanext.notify.cache.check_interval', 0))
+    if entry is not None and now - entry.checked < check_interval:
+        return entry.channels
+
+    # Read before loading, a change made meanwhile leaves the entry outdated rather than wrong
+    current = version(organization_id)
+    if entry is not None:
+        if entry.version == current:
+            entry.checked = now
+            return entry.channels
+        cache.record_stale()
+
+    channels = load(organization_id)
+    cache.set(organization_id, _Entry(current, now, channels))
+
+    return channels
+
+
+def invalidate(*organization_ids):
+    '''
+    Forgets the channels of the organizations given, after they changed. The
+    other processes notice the change through the version of the
+    organizations, incremented by the writer with db.Notify_Channel_Version.
+    '''
+    if not is_enabled():
+        return
+
+    cache = get_cache()
+    for organization_id in organization_ids:
+        if organization_id:
+            cache.delete(organization_id)
+
+
+def stats():
+    '''Returns the channel cache counters of the current process.'''
+    if not is_enabled():
+        return {'enabled': False}
+
+    stats = get_cache().stats()
+    stats['enabled'] = True
+    return stats
@@ -0,0 +1,95 @@
+import logging
+import threading
+
+import ckanext.notify.constants as constants
+import ckanext.notify.delivery as delivery
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.idempotency as idempotency
+import ckanext.notify.renderer as renderer
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = {}
+
+
+def _window():
+    return float(config.get('ckanext.notify.coalesce_window', 0))
+
+
+def is_enabled():
+    return _window() > 0
+
+
+def render_slack(events):
+    '''
+    Renders the slack message for a batch of events. A single event keeps its
+    own template, several events are listed in a digest.
+    '''
+    if len(events) == 1:
+        return renderer.slack_message(events[0]['template'], events[0])
+
+    extra_vars = renderer.base_vars()
+    extra_vars['events'] = events
+    return renderer.slack_message('digest', extra_vars)
+
+
+def render_email(events):
+    '''Same as render_slack for emails, returns the subject and the body.'''
+    if len(events) == 1:
+        return renderer.email_message(events[0]['template'], events[0])
+
+    extra_vars = renderer.base_vars()
+    extra_vars.update({'action_type': 'datarequest_digest', 'events': events})
+    return renderer.email_message('digest', extra_vars)
+
+
+def add(channel_type, organization_id, channels, template, extra_vars, event_key=None, **options):
+    '''
+    Holds an event back until ckanext.notify.coalesce_window seconds have
+    passed since the first event held for the same organization and channel
+    type. All the events collected by then are sent as a single message to
+    the latest list of channels. An event whose `event_key` is already held is
+    ignored. `options` are passed to the delivery.
+    '''
+    key = (channel_type, organization_id)
+    event = dict(extra_vars, template=template)
+
+    with _lock:
+        batch = _pending.get(key)
+        first = batch is None
+        if first:
+            batch = _pending[key] = {'events': [], 'event_keys': []}
+        elif event_key is not None and event_key in batch['event_keys']:
+            return
+        batch['channels'] = channels
+        batch['options'] = options
+        batch['events'].append(event)
+        batch['event_keys'].append(event_key)
+
+    if first:
+        # Held events are sent right away if the process exits before the window ends
+        dispatcher.dispatch_later(_window(), flush, (key,), on_abandon=lambda: flush(key))
+
+
+def flush(key):
+    with _lock:
+        batch = _pending.pop(key, None)
+
+    if not batch:
+        return
+
+    channel_type = key[0]
+    events = batch['events']
+    log.debug('Sending %d coalesced %s events for organization %s', len(events), channel_type, key[1])
+
+    event_key = idempotency.combine(batch['event_keys'])
+
+    if channel_type == constants.CHANNEL_TYPE_SLACK:
+        delivery.send_slack(batch['channels'], render_slack(events), event_key=event_key, **batch['options'])
+    else:
+        email_subject, email_body = render_email(events)
+        delivery.send_email(batch['channels'], email_subject, email_body, event_key=event_key, **batch['options'])
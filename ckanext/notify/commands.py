@@ -0,0 +1,195 @@
+import sys
+import time
+
+import ckan.lib.cli as cli
+
+
+def _report(label, func, calls):
+    timings = []
+    for i in range(calls):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+
+    print('{0:<40} calls {1:>6}  mean {2:8.3f} ms  p50 {3:8.3f} ms  p99 {4:8.3f} ms'.format(
+        label, calls, sum(timings) / calls, timings[calls // 2], timings[min(calls - 1, int(calls * 0.99))]))
+
+
+class NotifyCommand(cli.CkanCommand):
+    '''Manages the database of the notify extension
+
+    Usage:
+
+        notify initdb
+            Creates the notify tables which do not exist yet
+
+        notify migrate
+            Applies the pending schema migrations, creating the tables first
+
+        notify version
+            Shows the schema version of the database and the pending migrations
+
+        notify import FILE
+            Registers the channels listed in a JSON or CSV file, as the
+            channels_import action does, and shows the rows rejected
+
+        notify export jsonl|csv [slack|email|all [ORGANIZATION]]
+            Writes the channels of every organization, or of the one given,
+            to the standard output as JSON lines or CSV, reading them a page
+            at a time
+
+        notify benchmark ORGANIZATION [CALLS [USER]]
+            Times the schema setup, which is done once when the plugin is
+            configured, against the actions which used to repeat it. With a
+            USER, also times the manage_notifications check for that user
+            against listing every organization the user can manage, as the
+            check used to do
+
+    Examples:
+
+        paster --plugin=ckanext-notify notify migrate -c /etc/ckan/default/production.ini
+        paster --plugin=ckanext-notify notify export csv slack -c /etc/ckan/default/production.ini > slack.csv
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 4
+    min_args = 1
+
+    def command(self):
+        cmd = self.args[0]
+
+        # These commands repair an outdated schema, the plugin must not refuse to start on it
+        if cmd in ('initdb', 'migrate', 'version'):
+            import ckanext.notify.migrations as migrations
+            migrations.skip_startup_check = True
+
+        self._load_config()
+
+        if cmd == 'initdb':
+            self.initdb()
+        elif cmd == 'migrate':
+            self.migrate()
+        elif cmd == 'version':
+            self.version()
+        elif cmd == 'import' and len(self.args) > 1:
+            self.import_channels()
+        elif cmd == 'export' and len(self.args) > 1:
+            self.export_channels()
+        elif cmd == 'benchmark' and len(self.args) > 1:
+            self.benchmark()
+        else:
+            print('Command {0} not recognized'.format(cmd))
+            sys.exit(1)
+
+    def initdb(self):
+        import ckan.model as model
+        import ckanext.notify.db as db
+
+        db.init_db(model)
+        db.create_tables()
+        print('Notify tables created')
+
+    def migrate(self):
+        import ckan.model as model
+        import ckanext.notify.migrations as migrations
+
+        self.initdb()
+        try:
+            applied = migrations.upgrade(model.meta.engine)
+        except migrations.MigrationError as e:
+            print(u'Migration failed: {0}'.format(e.args[0]))
+            sys.exit(1)
+
+        if applied:
+            print('Applied migrations: {0}'.format(', '.join(str(version) for version in applied)))
+        else:
+            print('The notify schema is up to date')
+
+    def version(self):
+        import ckan.model as model
+        import ckanext.notify.migrations as migrations
+
+        print('Schema version: {0}'.format(migrations.current_version(model.meta.engine)))
+        for version, description, _ in migrations.pending(model.meta.engine):
+            print('Pending migration {0}: {1}'.format(version, description))
+
+    def import_channels(self):
+        import ckan.model as model
+        import ckan.plugins.toolkit as toolkit
+        import ckanext.notify.constants as constants
+
+        path = self.args[1]
+        format = 'csv' if path.lower().endswith('.csv') else 'json'
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        context = {'model': model, 'session': model.Session, 'ignore_auth': True}
+        try:
+            result = toolkit.get_action(constants.CHANNELS_IMPORT)(context, {'data': data, 'format': format})
+        except toolkit.ValidationError as e:
+            print('Import failed: {0}'.format(e.error_dict))
+            sys.exit(1)
+
+        for error in result['errors']:
+            print('Row {0}: {1}'.format(error['row'], error['errors']))
+        print('Imported {0} channels, {1} rows rejected'.format(len(result['channels']), len(result['errors'])))
+
+    def export_channels(self):
+        import ckanext.notify.export as export
+
+        format = self.args[1]
+        channel_type = self.args[2] if len(self.args) > 2 and self.args[2] != 'all' else None
+        organization_id = self.args[3] if len(self.args) > 3 else None
+
+        if format not in export.FORMATS:
+            print('Format {0} not recognized, use {1}'.format(format, ' or '.join(export.FORMATS)))
+            sys.exit(1)
+
+        if organization_id:
+            organization_id = export.organization_id(organization_id)
+
+        for line in export.lines(format, export.channels(type=channel_type, organization_id=organization_id)):
+            sys.stdout.write(line)
+
+    def benchmark(self):
+        import ckan.model as model
+        import ckan.plugins.toolkit as toolkit
+        import ckanext.notify.constants as constants
+        import ckanext.notify.db as db
+
+        organization_id = self.args[1]
+        calls = int(self.args[2]) if len(self.args) > 2 else 100
+
+        def show(action):
+            context = {'model': model, 'session': model.Session, 'ignore_auth': True}
+            return lambda: toolkit.get_action(action)(context, {'organization_id': organization_id})
+
+        # What every action used to pay before the setup moved to startup
+        _report('schema setup (create_tables)', db.create_tables, calls)
+        _report(constants.SLACK_CHANNELS_SHOW, show(constants.SLACK_CHANNELS_SHOW), calls)
+        _report(constants.EMAIL_CHANNELS_SHOW, show(constants.EMAIL_CHANNELS_SHOW), calls)
+
+        if len(self.args) > 3:
+            self.benchmark_auth(organization_id, calls, self.args[3])
+
+    def benchmark_auth(self, organization_id, calls, user):
+        import ckan.model as model
+        import ckan.plugins.toolkit as toolkit
+        import ckanext.notify.auth as auth
+
+        def context():
+            return {'model': model, 'session': model.Session, 'user': user}
+
+        # What organizations_available did on every check, its cost grows with the organizations of the user
+        def organizations_available():
+            available = toolkit.get_action('organization_list_for_user')(context(), {'permission': 'manage_group'})
+            return organization_id in [org['name'] for org in available] + [org['id'] for org in available]
+
+        count = len(toolkit.get_action('organization_list_for_user')(context(), {'permission': 'manage_group'}))
+        print('User {0} manages {1} organizations'.format(user, count))
+
+        _report('auth (organizations_available)', organizations_available, calls)
+        _report('auth (manage_notifications)',
+                lambda: auth.manage_notifications(context(), {'organization_id': organization_id}), calls)
@@ -1,6 +1,10 @@
 DATAREQUEST_REGISTER_SLACK = 'datarequest_register_slack'
 DATAREQUEST_REGISTER_EMAIL = 'datarequest_register_email'
 MANAGE_NOTIFICATIONS = 'manage_notifications'
+NOTIFY_ADMIN = 'notify_admin'
+NOTIFY_DISPATCH_STATUS = 'notify_dispatch_status'
+NOTIFY_DEAD_LETTERS_SHOW = 'notify_dead_letters_show'
+NOTIFY_DEAD_LETTER_REQUEUE = 'notify_dead_letter_requeue'
 SLACK_CHANNELS_SHOW = 'slack_channels_show'
 SLACK_CHANNEL_SHOW = 'slack_channel_show'
 SLACK_CHANNEL_UPDATE = 'slack_channel_update'
@@ -9,6 +13,19 @@ EMAIL_CHANNEL_SHOW = 'email_channel_show'
 EMAIL_CHANNELS_SHOW = 'email_channels_show'
 EMAIL_CHANNEL_UPDATE = 'email_channel_update'
 EMAIL_CHANNEL_DELETE = 'email_channel_delete'
+CHANNEL_REENABLE = 'channel_reenable'
+CHANNELS_BULK_REGISTER = 'channels_bulk_register'
+CHANNELS_IMPORT = 'channels_import'
+CHANNELS_EXPORT = 'channels_export'
+NOTIFY_DATAREQUEST_EVENT = 'notify_datarequest_event'
+NOTIFY_SETTINGS_SHOW = 'notify_settings_show'
+NOTIFY_SETTINGS_UPDATE = 'notify_settings_update'
+CHANNEL_TYPE_SLACK = 'slack'
+CHANNEL_TYPE_EMAIL = 'email'
+DATAREQUEST_EVENTS = ['datarequest_create', 'datarequest_comment', 'datarequest_close']
 CHANNEL_MAX_LENGTH = 21
 WEBHOOK_MAX_LENGTH = 80
 EMAIL_MAX_LENGTH = 80
+DEAD_LETTERS_LIMIT = 100
+DEAD_LETTERS_MAX_LIMIT = 1000
+CHANNELS_LIMIT = 1000
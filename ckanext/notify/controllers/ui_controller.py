@@ -1,14 +1,17 @@
+import calendar
+import hashlib
 import json
 import logging
-import requests
 import ckan.model as model
 import ckan.lib.base as base
 import ckan.plugins as plugins
 import ckan.lib.helpers as helpers
+import ckanext.notify.cache as cache
 import ckanext.notify.constants as constants
+import ckanext.notify.export as export
+import ckanext.notify.organizations as organizations
 
-from ckan.common import config, request
-import ckan.lib.mailer as mailer
+from ckan.common import config, request, response
 
 
 log = logging.getLogger(__name__)
@@ -25,13 +28,16 @@ def _get_errors_summary(errors):
     return errors_summary
 
 
-class dotdict(dict):
+_CHANNELS_SHOW = {
+    constants.CHANNEL_TYPE_SLACK: constants.SLACK_CHANNELS_SHOW,
+    constants.CHANNEL_TYPE_EMAIL: constants.EMAIL_CHANNELS_SHOW,
+}
 
-    """dot.notation access to dictionary attributes"""
 
-    __getattr__ = dict.get
-    __setattr__ = dict.__setitem__
-    __delattr__ = dict.__delitem__
+def _page_size():
+    # One more channel is asked for, to know whether there is a next page
+    return min(toolkit.asint(config.get('ckanext.notify.channels.page_size', 25)), constants.CHANNELS_LIMIT - 1)
+
 
 class DataRequestsNotifyUI(base.BaseController):
 
@@ -39,17 +45,110 @@ class DataRequestsNotifyUI(base.BaseController):
         return {'model': model, 'session': model.Session,
                 'user': c.user, 'auth_user_obj': c.userobj}
 
+    def _group_dict(self, id):
+        # A cached summary, the pages do not need the datasets and members of organization_show
+        group_dict = organizations.summary(id)
+        if group_dict is None:
+            toolkit.abort(404, toolkit._('Organization {0} not found').format(id))
+        return group_dict
+
+    def _authorize_channels(self, context, id):
+        organization_id = organizations.resolve(id)
+        if organization_id is None:
+            toolkit.abort(404, toolkit._('Organization {0} not found').format(id))
+
+        try:
+            toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, {'organization_id': organization_id})
+        except toolkit.NotAuthorized as e:
+            log.warning(e)
+            toolkit.abort(403, toolkit._('You are not authorized to manage the notifications of this organization'))
+
+        return organization_id
+
+    def _not_modified(self, organization_id, *variant):
+        '''
+        Sets the ETag and Last-Modified headers of a response built from the
+        channels and settings of an organization, and returns whether the
+        copy the client already has is still current. Both come from the
+        version of the organization, incremented whenever its channels, their
+        states or its settings change.
+        '''
+        version, updated = cache.version_state(organization_id)
+        parts = [organization_id, unicode(version), c.user or u'', helpers.lang() or u''] + list(variant)
+        etag = hashlib.sha1(u'\0'.join(parts).encode('utf-8')).hexdigest()
+
+        response.etag = etag
+        # Pages depend on the user, and must be revalidated on every visit
+        response.cache_control = 'private, no-cache'
+        if updated is not None:
+            response.last_modified = updated
+
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            since = request.if_modified_since
+            not_modified = updated is not None and since is not None and \
+                calendar.timegm(since.utctimetuple()) >= calendar.timegm(updated.timetuple())
+
+        if not_modified:
+            response.status_int = 304
+        return not_modified
+
+    def _channels_page(self, context, organization_id, channel_type, q, offset):
+        '''
+        Returns a page of the channels of a type of an organization matching
+        q, with the parameters needed to ask for the pages around it.
+        '''
+        try:
+            offset = max(int(offset or 0), 0)
+        except ValueError:
+            toolkit.abort(400, toolkit._('Offset must be a natural number'))
+
+        limit = _page_size()
+        data_dict = {'organization_id': organization_id, 'q': q, 'limit': limit + 1, 'offset': offset}
+        channels = toolkit.get_action(_CHANNELS_SHOW[channel_type])(context, data_dict)
+
+        return {
+            'channels': channels[:limit],
+            'q': q or u'',
+            'offset': offset,
+            'limit': limit,
+            'more': len(channels) > limit,
+        }
+
     def organization_channels(self, id):
         context = self._get_context()
-        c.group_dict = toolkit.get_action('organization_show')(context, {'id': id})
-        slack_channels = toolkit.get_action(constants.SLACK_CHANNELS_SHOW)(context, {'organization_id': id})
-        email_channels = toolkit.get_action(constants.EMAIL_CHANNELS_SHOW)(context, {'organization_id': id})
+        organization_id = self._authorize_channels(context, id)
+        if self._not_modified(organization_id, request.query_string):
+            return ''
+
+        c.group_dict = self._group_dict(organization_id)
+        # Only the first page of each type is rendered, the others are loaded from organization_channels_list
+        slack_channels = self._channels_page(context, organization_id, constants.CHANNEL_TYPE_SLACK,
+                                             request.GET.get('slack_q'), request.GET.get('slack_offset'))
+        email_channels = self._channels_page(context, organization_id, constants.CHANNEL_TYPE_EMAIL,
+                                             request.GET.get('email_q'), request.GET.get('email_offset'))
+        settings = toolkit.get_action(constants.NOTIFY_SETTINGS_SHOW)(context, {'organization_id': organization_id})
         return toolkit.render('notify/channels.html',
-                              extra_vars={'slack_channels': slack_channels, 'email_channels': email_channels})
+                              extra_vars={'slack_channels': slack_channels, 'email_channels': email_channels,
+                                          'settings': settings})
 
-    def add_channel(self, id):
+    def organization_channels_list(self, id, channel_type):
         context = self._get_context()
-        c.group_dict = toolkit.get_action('organization_show')(context, {'id': id})
+        if channel_type not in _CHANNELS_SHOW:
+            toolkit.abort(400, toolkit._('Channel type {0} is not valid').format(channel_type))
+
+        organization_id = self._authorize_channels(context, id)
+        if self._not_modified(organization_id, channel_type, request.query_string):
+            return ''
+
+        page = self._channels_page(context, organization_id, channel_type,
+                                   request.GET.get('q'), request.GET.get('offset'))
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        return json.dumps({'success': True, 'result': page})
+
+    def add_channel(self, id):
+        c.group_dict = self._group_dict(id)
         return toolkit.render('notify/add_channel.html')
 
     def post_slack_form(self, action, context, **kwargs):
@@ -96,7 +195,7 @@ class DataRequestsNotifyUI(base.BaseController):
             toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, {'organization_id': organization_id})
             self.post_slack_form(constants.DATAREQUEST_REGISTER_SLACK, context)
 
-            c.group_dict = toolkit.get_action('organization_show')(context, {'id': organization_id})
+            c.group_dict = self._group_dict(organization_id)
             required_vars = \
                 {'data': c.slack_data, 'errors': c.errors, 'errors_summary': c.errors_summary, 'new_form': new_form}
             return toolkit.render('notify/register_slack.html', extra_vars=required_vars)
@@ -121,7 +220,7 @@ class DataRequestsNotifyUI(base.BaseController):
 
             self.post_slack_form(constants.SLACK_CHANNEL_UPDATE, context, id=id)
 
-            c.group_dict = toolkit.get_action('organization_show')(context, {'id': organization_id})
+            c.group_dict = self._group_dict(organization_id)
             required_vars = \
                 {'data': c.slack_data, 'errors': c.errors, 'errors_summary': c.errors_summary, 'new_form': new_form}
             return toolkit.render('notify/register_slack.html', extra_vars=required_vars)
@@ -193,7 +292,7 @@ class DataRequestsNotifyUI(base.BaseController):
             toolkit.check_access(constants.MANAGE_NOTIFICATIONS, context, {'organization_id': organization_id})
             self.post_email_form(constants.DATAREQUEST_REGISTER_EMAIL, context)
 
-            c.group_dict = toolkit.get_action('organization_show')(context, {'id': organization_id})
+            c.group_dict = self._group_dict(organization_id)
             required_vars = \
                 {'data': c.email_data, 'errors': c.errors, 'errors_summary': c.errors_summary, 'new_form': new_form}
             return toolkit.render('notify/register_email.html', extra_vars=required_vars)
@@ -218,7 +317,7 @@ class DataRequestsNotifyUI(base.BaseController):
 
             self.post_email_form(constants.EMAIL_CHANNEL_UPDATE, context, id=id)
 
-            c.group_dict = toolkit.get_action('organization_show')(context, {'id': organization_id})
+            c.group_dict = self._group_dict(organization_id)
             required_vars = \
                 {'data': c.email_data, 'errors': c.errors, 'errors_summary': c.errors_summary, 'new_form': new_form}
             return toolkit.render('notify/register_email.html', extra_vars=required_vars)
@@ -247,36 +346,97 @@ class DataRequestsNotifyUI(base.BaseController):
             log.warning(e)
             toolkit.abort(403, toolkit._('You are not authorized to delete the channel {0}'.format(id)))
 
+    def reenable_channel(self, channel_type, id, organization_id):
+        data_dict = {'id': id, 'channel_type': channel_type, 'organization_id': organization_id}
+        context = self._get_context()
+
+        try:
+            toolkit.get_action(constants.CHANNEL_REENABLE)(context, data_dict)
+            helpers.flash_success(toolkit._('The notification channel has been re-enabled'))
+            toolkit.redirect_to('organization_channels', id=organization_id)
+
+        except toolkit.ValidationError as e:
+            log.warning(e)
+            toolkit.abort(400, toolkit._('Channel type {0} is not valid').format(channel_type))
+        except toolkit.ObjectNotFound as e:
+            log.warning(e)
+            toolkit.abort(404, toolkit._('Channel {0} not found').format(id))
+        except toolkit.NotAuthorized as e:
+            log.warning(e)
+            toolkit.abort(403, toolkit._('You are not authorized to re-enable the channel {0}').format(id))
+
+    def update_notify_settings(self, organization_id):
+        data_dict = {
+            'organization_id': organization_id,
+            'email_bcc': request.POST.get('email_bcc', False),
+        }
+        context = self._get_context()
+
+        try:
+            toolkit.get_action(constants.NOTIFY_SETTINGS_UPDATE)(context, data_dict)
+            helpers.flash_success(toolkit._('The notification settings have been updated'))
+            toolkit.redirect_to('organization_channels', id=organization_id)
+
+        except toolkit.ValidationError as e:
+            log.warning(e)
+            # The action raises plain messages, which ValidationError stores under 'message'
+            errors = [error if isinstance(error, basestring) else u', '.join(error) for error in e.error_dict.values()]
+            helpers.flash_error(toolkit._('The notification settings could not be updated: {0}').format(
+                u' '.join(errors)))
+            toolkit.redirect_to('organization_channels', id=organization_id)
+        except toolkit.ObjectNotFound as e:
+            log.warning(e)
+            toolkit.abort(404, toolkit._('Organization {0} not found').format(organization_id))
+        except toolkit.NotAuthorized as e:
+            log.warning(e)
+            toolkit.abort(403, toolkit._('You are not authorized to update the notification settings'))
+
+    def export_channels(self, format):
+        context = self._get_context()
+        channel_type = request.GET.get('type') or None
+        organization_id = request.GET.get('organization_id') or None
+
+        try:
+            toolkit.check_access(constants.NOTIFY_ADMIN, context, {})
+        except toolkit.NotAuthorized as e:
+            log.warning(e)
+            toolkit.abort(403, toolkit._('Only sysadmins can export the notification channels'))
+
+        if format not in export.FORMATS:
+            toolkit.abort(404, toolkit._('Format {0} is not supported').format(format))
+        if channel_type not in (None, constants.CHANNEL_TYPE_SLACK, constants.CHANNEL_TYPE_EMAIL):
+            toolkit.abort(400, toolkit._('Channel type {0} is not valid').format(channel_type))
+
+        if organization_id:
+            organization_id = export.organization_id(organization_id)
+
+        # Streamed as the pages are read, the export is never held in memory
+        response.headers['Content-Type'] = export.CONTENT_TYPES[format]
+        response.headers['Content-Disposition'] = 'attachment; filename="channels.{0}"'.format(format)
+        return export.lines(format, export.channels(type=channel_type, organization_id=organization_id))
+
+    def _notify(self, template, result, channel_type):
+        context = self._get_context()
+        # The caller has already authorized the datarequest action being notified
+        context['ignore_auth'] = True
+        data_dict = {
+            'event': template,
+            'datarequest': result,
+            'channel_types': [channel_type],
+        }
+
+        toolkit.get_action(constants.NOTIFY_DATAREQUEST_EVENT)(context, data_dict)
+
     def send_slack_notification(self, template, result):
         '''
         This function is called from ckanext-datarequest after a DataRequest is
         created, commented on or closed. The organization selected during the
         DataRequest creation is sent a slack notification if an admin has
         added Slack as a notification channel.
+        New callers should call the notify_datarequest_event action, which
+        notifies every channel type at once.
         '''
-
-        context = self._get_context()
-        organization = result.get('organization', None)
-        data_dict = {
-            'organization_id': organization['name'] if organization else '',
-            'success': True,
-        }
-
-        channels = toolkit.get_action(constants.SLACK_CHANNELS_SHOW)(context, data_dict)
-        if channels:
-            extra_vars = {
-                            'site_title': config.get('ckan.site_title'),
-                            'datarequest_url': result['datarequest_url'],
-                            'datarequest_title': result['title'],
-                            'datarequest_description': result['description'],
-                        }
-            slack_message = {'text': base.render_jinja2('notify/slack/{}.txt'.format(template), extra_vars)}
-
-            for channel in channels:
-                requests.post(
-                    channel['webhook_url'], data=json.dumps(slack_message),
-                    headers={'Content-type': 'application/json'}
-                )
+        self._notify(template, result, constants.CHANNEL_TYPE_SLACK)
 
     def send_email_notification(self, template, result):
         '''
@@ -284,27 +444,7 @@ class DataRequestsNotifyUI(base.BaseController):
          created, commented on or closed. The organization selected during the
          DataRequest creation is sent an email notification if an admin has
          added an email address for notification.
+         New callers should call the notify_datarequest_event action, which
+         notifies every channel type at once.
          '''
-        context = self._get_context()
-        data_dict = {
-            'organization_id': result['organization'].get('name'),
-            'success': True,
-        }
-
-        channels = toolkit.get_action(constants.EMAIL_CHANNELS_SHOW)(context, data_dict)
-        if channels:
-            extra_vars = {
-                            'site_url': config.get('ckan.site_url'),
-                            'site_title': config.get('ckan.site_title'),
-                            'datarequest_url': result['datarequest_url'],
-                            'datarequest_title': result['title'],
-                            'datarequest_description': result['description'],
-                            'action_type': template,
-                        }
-
-            email_subject = base.render_jinja2('notify/email/{}.txt'.format('subject'), extra_vars)
-            email_body = base.render_jinja2('notify/email/{}.txt'.format(template), extra_vars)
-
-            for channel in channels:
-                channel = dotdict(channel)              
-                mailer.mail_user(channel, email_subject, email_body)
+        self._notify(template, result, constants.CHANNEL_TYPE_EMAIL)
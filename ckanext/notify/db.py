@@ -1,44 +1,177 @@
+import collections
+import datetime
 import sqlalchemy as sa
 import uuid
 
 Channel = None
-Org_Slack_Details = None
-Org_Email_Details = None
+Org_Notify_Settings = None
+Notify_Dead_Letter = None
+Notify_Delivery = None
+Notify_Channel_Health = None
+Notify_Channel_Version = None
+
+# Tables of the extension, in creation order
+tables = []
+
+
+class ChannelRecord(collections.namedtuple('ChannelRecord',
+                                           ['id', 'organization_id', 'type', 'address', 'slack_channel'])):
+    '''
+    Read only channel, as loaded by Channel.records. The address is the
+    webhook URL of slack channels and the email of email channels.
+    '''
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, channel_type, data):
+        # Dead letters stored before the records were introduced hold the dicts of the show actions
+        address = data.get('address') or data.get('webhook_url') or data.get('email')
+        return cls(data['id'], data.get('organization_id'), channel_type, address, data.get('slack_channel') or u'')
 
 
 def uuid4():
     return str(uuid.uuid4())
 
 
+def create_tables():
+    '''Creates the tables of the extension which do not exist yet.'''
+    for table in tables:
+        table.create(checkfirst=True)
+
+
 def init_db(model):
+    '''
+    Defines the tables of the extension and maps their classes. It does not
+    touch the database and does nothing once done, so it is called once when
+    the plugin is configured; create_tables creates the tables.
+    '''
 
     global Channel
-    global Org_Slack_Details
-    global Org_Email_Details
+    global Org_Notify_Settings
+    global Notify_Dead_Letter
+    global Notify_Delivery
+    global Notify_Channel_Health
+    global Notify_Channel_Version
 
     if Channel is None:
-            class _Channel(model.DomainObject):
+        class _Channel(model.DomainObject):
 
-                @classmethod
-                def get(cls, **kw):
-                    '''Finds all the instances required.'''
-                    query = model.Session.query(cls).autoflush(False)
-                    return query.filter_by(**kw).all()
+            @classmethod
+            def get(cls, **kw):
+                '''Finds all the instances required.'''
+                query = model.Session.query(cls).autoflush(False)
+                return query.filter_by(**kw).all()
 
-            Channel = _Channel
+            @classmethod
+            def exists(cls, type, address, slack_channel=u''):
+                '''Returns true if there is a channel of the type with the same address and slack channel'''
+                query = model.Session.query(cls.id).autoflush(False)
+                return query.filter(cls.type == type).filter(cls.address == address)\
+                    .filter(cls.slack_channel == slack_channel).first() is not None
 
-            channels_table = sa.Table('channels', model.meta.metadata,
-                sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
-                sa.Column('channel', sa.types.UnicodeText, primary_key=False, default=u'')
-            )
+            @classmethod
+            def records(cls, organization_id):
+                '''
+                Returns the channels of an organization as ChannelRecords,
+                selecting only their columns, without loading ORM instances.
+                '''
+                table = channels_table
+                rows = model.meta.engine.execute(sa.select([table.c.id, table.c.organization_id, table.c.type,
+                                                            table.c.address, table.c.slack_channel])
+                                                 .where(table.c.organization_id == organization_id)
+                                                 .order_by(table.c.created))
+                return [ChannelRecord(*row) for row in rows]
 
-            # Create the table only if it does not exist
-            channels_table.create(checkfirst=True)
+            @classmethod
+            def search(cls, organization_id, type, q=None, limit=None, offset=0):
+                '''
+                Returns the ChannelRecords of a type of an organization whose
+                address or slack channel contains q, ignoring case, skipping
+                the first offset and returning up to limit of them.
+                '''
+                table = channels_table
+                query = sa.select([table.c.id, table.c.organization_id, table.c.type,
+                                   table.c.address, table.c.slack_channel])\
+                    .where(table.c.organization_id == organization_id)\
+                    .where(table.c.type == type)
+                if q:
+                    # Wildcards typed by users are matched literally
+                    pattern = u'%{0}%'.format(q.replace(u'\\', u'\\\\').replace(u'%', u'\\%').replace(u'_', u'\\_'))
+                    query = query.where(sa.or_(table.c.address.ilike(pattern, escape=u'\\'),
+                                               table.c.slack_channel.ilike(pattern, escape=u'\\')))
+                query = query.order_by(table.c.created, table.c.id).offset(offset)
+                if limit is not None:
+                    query = query.limit(limit)
+                return [ChannelRecord(*row) for row in model.meta.engine.execute(query)]
 
-            model.meta.mapper(Channel, channels_table,)
+            @classmethod
+            def page(cls, after=None, limit=1000, type=None, organization_id=None):
+                '''
+                Returns up to limit ChannelRecords, ordered by id, whose id is
+                greater than after. Passing the id of the last record of a
+                page as after returns the next page, which costs the same
+                whatever the number of pages before it.
+                '''
+                table = channels_table
+                query = sa.select([table.c.id, table.c.organization_id, table.c.type,
+                                   table.c.address, table.c.slack_channel])
+                if after:
+                    query = query.where(table.c.id > after)
+                if type:
+                    query = query.where(table.c.type == type)
+                if organization_id:
+                    query = query.where(table.c.organization_id == organization_id)
+                rows = model.meta.engine.execute(query.order_by(table.c.id).limit(limit))
+                return [ChannelRecord(*row) for row in rows]
 
-    if Org_Slack_Details is None:
-        class _Org_Slack_Details(model.DomainObject):
+            @classmethod
+            def existing(cls, type, addresses, chunk_size=500):
+                '''
+                Returns the (address, slack_channel) pairs of the channels of
+                the type registered for any of the addresses given, with one
+                query per chunk of addresses instead of one per channel.
+                '''
+                table = channels_table
+                addresses = list(set(addresses))
+                found = set()
+                for start in range(0, len(addresses), chunk_size):
+                    rows = model.meta.engine.execute(sa.select([table.c.address, table.c.slack_channel])
+                                                     .where(table.c.type == type)
+                                                     .where(table.c.address.in_(addresses[start:start + chunk_size])))
+                    found.update((row[0], row[1]) for row in rows)
+                return found
+
+            @classmethod
+            def insert_many(cls, session, rows):
+                '''
+                Inserts the channel rows given with a single executemany,
+                within the transaction of session.
+                '''
+                if rows:
+                    session.execute(channels_table.insert(), rows)
+
+        Channel = _Channel
+
+        # Slack channels store their webhook url as address, email channels their email
+        channels_table = sa.Table('notify_channels', model.meta.metadata,
+            sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
+            sa.Column('organization_id', sa.types.UnicodeText, primary_key=False, nullable=False),
+            sa.Column('type', sa.types.Unicode(16), primary_key=False, nullable=False),
+            sa.Column('address', sa.types.UnicodeText, primary_key=False, nullable=False),
+            sa.Column('slack_channel', sa.types.UnicodeText, primary_key=False, nullable=False, default=u''),
+            sa.Column('created', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+            sa.Index('idx_notify_channels_organization_id_type', 'organization_id', 'type'),
+            sa.Index('idx_notify_channels_type_address_slack_channel', 'type', 'address', 'slack_channel',
+                     unique=True),
+        )
+
+        tables.append(channels_table)
+
+        model.meta.mapper(Channel, channels_table,)
+
+    if Org_Notify_Settings is None:
+        class _Org_Notify_Settings(model.DomainObject):
 
             @classmethod
             def get(cls, **kw):
@@ -46,32 +179,20 @@ def init_db(model):
                 query = model.Session.query(cls).autoflush(False)
                 return query.filter_by(**kw).all()
 
-            @classmethod
-            def slack_channel_exists(cls, webhook_url, slack_channel):
-                '''Returns true if there is a channel with the same webhook url and slack channel'''
-                query = model.Session.query(cls).autoflush(False)
-                if query.filter(cls.webhook_url == webhook_url).first() is None:
-                    return False
-                else:
-                    return query.filter(cls.webhook_url == webhook_url)\
-                        .filter(cls.slack_channel == slack_channel).first()
-
-        Org_Slack_Details = _Org_Slack_Details
+        Org_Notify_Settings = _Org_Notify_Settings
 
-        org_slack_details_table = sa.Table('org_slack_details', model.meta.metadata,
+        org_notify_settings_table = sa.Table('org_notify_settings', model.meta.metadata,
             sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('organization_id', sa.types.UnicodeText, primary_key=False, default=None),
-            sa.Column('webhook_url', sa.types.UnicodeText, primary_key=False, default=u''),
-            sa.Column('slack_channel', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('email_bcc', sa.types.Boolean, primary_key=False, default=False),
         )
 
-        # Creates the table only if it doesn't exist
-        org_slack_details_table.create(checkfirst=True)
+        tables.append(org_notify_settings_table)
 
-        model.meta.mapper(Org_Slack_Details, org_slack_details_table,)
+        model.meta.mapper(Org_Notify_Settings, org_notify_settings_table,)
 
-    if Org_Email_Details is None:
-        class _Org_Email_Details(model.DomainObject):
+    if Notify_Dead_Letter is None:
+        class _Notify_Dead_Letter(model.DomainObject):
 
             @classmethod
             def get(cls, **kw):
@@ -80,20 +201,234 @@ def init_db(model):
                 return query.filter_by(**kw).all()
 
             @classmethod
-            def email_channel_exists(cls, email):
-                '''Returns true if there is a email channel with the same webhook url'''
+            def latest(cls, limit, **kw):
+                '''Finds the most recent instances, newest first.'''
                 query = model.Session.query(cls).autoflush(False)
-                return query.filter(cls.email == email).first() is not None
+                return query.filter_by(**kw).order_by(cls.created.desc()).limit(limit).all()
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''
+                Stores the dead letters given, as dicts of column values, in a
+                transaction of their own, leaving the session of the request
+                untouched.
+                '''
+                with model.meta.engine.begin() as connection:
+                    connection.execute(notify_dead_letters_table.insert(), rows)
 
-        Org_Email_Details = _Org_Email_Details
+        Notify_Dead_Letter = _Notify_Dead_Letter
 
-        org_email_details_table = sa.Table('org_email_details', model.meta.metadata,
+        notify_dead_letters_table = sa.Table('notify_dead_letters', model.meta.metadata,
             sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('organization_id', sa.types.UnicodeText, primary_key=False, default=None),
-            sa.Column('email', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('channel_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('channel_id', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('channel', sa.types.UnicodeText, primary_key=False, default=u'{}'),
+            sa.Column('payload', sa.types.UnicodeText, primary_key=False, default=u'{}'),
+            sa.Column('attempts', sa.types.Integer, primary_key=False, default=0),
+            sa.Column('last_error', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('created', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+        )
+
+        tables.append(notify_dead_letters_table)
+
+        model.meta.mapper(Notify_Dead_Letter, notify_dead_letters_table,)
+
+    if Notify_Delivery is None:
+        class _Notify_Delivery(model.DomainObject):
+
+            @classmethod
+            def claim(cls, key, now, cutoff):
+                '''
+                Records the delivery identified by key. Returns False if it
+                was already recorded after cutoff, in which case it must not
+                be sent again. Each statement commits on its own, so two
+                processes can never both claim the same key.
+                '''
+                connection = model.meta.engine.connect()
+                try:
+                    try:
+                        connection.execute(notify_deliveries_table.insert(), key=key, created=now)
+                        return True
+                    except sa.exc.IntegrityError:
+                        # Recorded before, it can be claimed again once expired
+                        result = connection.execute(notify_deliveries_table.update()
+                                                    .where(notify_deliveries_table.c.key == key)
+                                                    .where(notify_deliveries_table.c.created < cutoff)
+                                                    .values(created=now))
+                        return result.rowcount == 1
+                finally:
+                    connection.close()
+
+            @classmethod
+            def purge(cls, cutoff):
+                '''Deletes the deliveries recorded before cutoff.'''
+                model.meta.engine.execute(notify_deliveries_table.delete()
+                                          .where(notify_deliveries_table.c.created < cutoff))
+
+        Notify_Delivery = _Notify_Delivery
+
+        notify_deliveries_table = sa.Table('notify_deliveries', model.meta.metadata,
+            sa.Column('key', sa.types.Unicode(32), primary_key=True),
+            sa.Column('created', sa.types.DateTime, primary_key=False, index=True),
+        )
+
+        tables.append(notify_deliveries_table)
+
+        model.meta.mapper(Notify_Delivery, notify_deliveries_table,)
+
+    if Notify_Channel_Health is None:
+        class _Notify_Channel_Health(model.DomainObject):
+
+            @classmethod
+            def states(cls, channel_ids):
+                '''Returns the health rows of the channels given, by channel id.'''
+                if not channel_ids:
+                    return {}
+                table = notify_channel_health_table
+                rows = model.meta.engine.execute(table.select().where(table.c.channel_id.in_(list(channel_ids))))
+                return dict((row['channel_id'], row) for row in rows)
+
+            @classmethod
+            def try_half_open(cls, channel_id, now, cutoff):
+                '''
+                Moves an open channel, opened before cutoff, to half open.
+                Returns True for the only caller allowed to run the trial.
+                '''
+                table = notify_channel_health_table
+                result = model.meta.engine.execute(table.update()
+                                                   .where(table.c.channel_id == channel_id)
+                                                   .where(table.c.state.in_([u'open', u'half_open']))
+                                                   .where(table.c.opened_at < cutoff)
+                                                   .values(state=u'half_open', opened_at=now))
+                return result.rowcount == 1
+
+            @classmethod
+            def record_failure(cls, channel_id, channel_type, state_for, error, now):
+                '''
+                Increments the failures of a channel and moves it to the state
+                returned by state_for(previous_state, failures). Returns
+                whether the state changed.
+                '''
+                table = notify_channel_health_table
+                connection = model.meta.engine.connect()
+                try:
+                    with connection.begin():
+                        row = connection.execute(table.select().where(table.c.channel_id == channel_id)).first()
+                        failures = row['failures'] + 1 if row else 1
+                        previous = row['state'] if row else u'closed'
+                        state = state_for(previous, failures)
+                        values = {'state': state, 'failures': failures, 'last_error': error, 'updated': now}
+                        if state != previous:
+                            values['opened_at'] = now
+                        if row:
+                            connection.execute(table.update().where(table.c.channel_id == channel_id).values(**values))
+                        else:
+                            connection.execute(table.insert().values(channel_id=channel_id, channel_type=channel_type,
+                                                                     **values))
+                finally:
+                    connection.close()
+
+                return state != previous
+
+            @classmethod
+            def reset(cls, channel_ids):
+                '''Closes the circuit of the channels given.'''
+                if channel_ids:
+                    table = notify_channel_health_table
+                    model.meta.engine.execute(table.delete().where(table.c.channel_id.in_(list(channel_ids))))
+
+        Notify_Channel_Health = _Notify_Channel_Health
+
+        notify_channel_health_table = sa.Table('notify_channel_health', model.meta.metadata,
+            sa.Column('channel_id', sa.types.UnicodeText, primary_key=True),
+            sa.Column('channel_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('state', sa.types.UnicodeText, primary_key=False, default=u'closed'),
+            sa.Column('failures', sa.types.Integer, primary_key=False, default=0),
+            sa.Column('last_error', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('opened_at', sa.types.DateTime, primary_key=False, default=None),
+            sa.Column('updated', sa.types.DateTime, primary_key=False, default=None),
+        )
+
+        tables.append(notify_channel_health_table)
+
+        model.meta.mapper(Notify_Channel_Health, notify_channel_health_table,)
+
+    if Notify_Channel_Version is None:
+        class _Notify_Channel_Version(model.DomainObject):
+
+            @classmethod
+            def version(cls, organization_id):
+                '''
+                Returns the version of the channels of an organization, 0 if
+                they never changed.
+                '''
+                table = notify_channel_versions_table
+                version = model.meta.engine.execute(sa.select([table.c.version])
+                                                    .where(table.c.organization_id == organization_id)).scalar()
+                return version or 0
+
+            @classmethod
+            def state(cls, organization_id):
+                '''
+                Returns the version of the channels of an organization and
+                when it was last incremented, (0, None) if they never changed.
+                '''
+                table = notify_channel_versions_table
+                row = model.meta.engine.execute(sa.select([table.c.version, table.c.updated])
+                                                .where(table.c.organization_id == organization_id)).first()
+                return (row[0], row[1]) if row else (0, None)
+
+            @classmethod
+            def touch(cls, organization_ids):
+                '''
+                Increments the version of the organizations given right away,
+                for changes which are not part of a session transaction.
+                '''
+                connection = model.meta.engine.connect()
+                try:
+                    with connection.begin():
+                        cls.bump(connection, organization_ids)
+                finally:
+                    connection.close()
+
+            @classmethod
+            def bump(cls, session, organization_ids):
+                '''
+                Increments the version of the channels of the organizations
+                given within the transaction of session, so the new version is
+                visible exactly when the changes of the channels are, and not
+                at all if they are rolled back.
+                '''
+                organization_ids = set(organization_id for organization_id in organization_ids if organization_id)
+                if not organization_ids:
+                    return
+
+                table = notify_channel_versions_table
+                rows = session.execute(sa.select([table.c.organization_id])
+                                       .where(table.c.organization_id.in_(list(organization_ids))))
+                existing = set(row[0] for row in rows)
+
+                # Two first writers must not make each other fail, the one losing the race only undoes its savepoint
+                for organization_id in organization_ids - existing:
+                    try:
+                        with session.begin_nested():
+                            session.execute(table.insert().values(organization_id=organization_id, version=0))
+                    except sa.exc.IntegrityError:
+                        pass
+
+                session.execute(table.update()
+                                .where(table.c.organization_id.in_(list(organization_ids)))
+                                .values(version=table.c.version + 1, updated=datetime.datetime.utcnow()))
+
+        Notify_Channel_Version = _Notify_Channel_Version
+
+        notify_channel_versions_table = sa.Table('notify_channel_versions', model.meta.metadata,
+            sa.Column('organization_id', sa.types.UnicodeText, primary_key=True),
+            sa.Column('version', sa.types.Integer, primary_key=False, nullable=False, default=0),
+            sa.Column('updated', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
         )
 
-        # Creates the table only if it doesn't exist
-        org_email_details_table.create(checkfirst=True)
+        tables.append(notify_channel_versions_table)
 
-        model.meta.mapper(Org_Email_Details, org_email_details_table,)
+        model.meta.mapper(Notify_Channel_Version, notify_channel_versions_table,)
@@ -0,0 +1,191 @@
+import json
+import logging
+import requests
+import smtplib
+import socket
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.breaker as breaker
+import ckanext.notify.constants as constants
+import ckanext.notify.db as db
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.idempotency as idempotency
+import ckanext.notify.ratelimit as ratelimit
+import ckanext.notify.retry as retry
+import ckanext.notify.smtp as smtp
+import ckanext.notify.transport as transport
+
+from ckan.common import config
+from ckan.lib.mailer import MailerException
+
+
+log = logging.getLogger(__name__)
+
+
+def _log_failures(channel_type, results):
+    for result in results:
+        if not result.success:
+            log.warning('Unable to deliver %s notification to channel %s: %s',
+                        channel_type, result.item.id, result.error)
+
+
+def _post_slack(channel, slack_message):
+    ratelimit.acquire(channel.address)
+
+    try:
+        response = transport.post_json(channel.address, slack_message)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise retry.RetryableError(e)
+
+    # Deleted apps, revoked tokens and archived channels answer with these forever
+    if response.status_code in (403, 404, 410):
+        raise breaker.EndpointGone('{0} {1}'.format(response.status_code, response.reason))
+
+    # Slack answers 429 with a Retry-After header when a webhook is rate limited
+    if response.status_code == 429 or response.status_code >= 500:
+        raise retry.RetryableError('{0} {1}'.format(response.status_code, response.reason),
+                                   retry.parse_retry_after(response.headers.get('Retry-After')))
+
+    response.raise_for_status()
+    return response.status_code
+
+
+def _targets(channel_type, channels, attempt, event_key):
+    channels = idempotency.unique(channel_type, channels)
+
+    # Retries were claimed by the first attempt
+    if attempt == 1:
+        channels = idempotency.claim(channel_type, channels, event_key)
+
+    return breaker.allow(channel_type, channels)
+
+
+def _skipped(channels):
+    # Channels with an open circuit end up as dead letters, to be requeued once they work again
+    return [dispatcher.Result(channel, False, None, breaker.CircuitOpen('Circuit open')) for channel in channels]
+
+
+def send_slack(channels, slack_message, attempt=1, event_key=None):
+    '''
+    Posts an already rendered slack message to every webhook concurrently.
+    Channels are db.ChannelRecords; a webhook registered more than once, or
+    which already received the event identified by `event_key`, is posted to
+    only once. Failed deliveries are retried or stored as dead letters.
+    Returns one dispatcher.Result per channel notified.
+    '''
+    channels, skipped, tracked = _targets(constants.CHANNEL_TYPE_SLACK, channels, attempt, event_key)
+
+    results = dispatcher.fan_out(_post_slack, channels, slack_message)
+    breaker.record(constants.CHANNEL_TYPE_SLACK, results, tracked, attempt)
+    results.extend(_skipped(skipped))
+
+    _log_failures(constants.CHANNEL_TYPE_SLACK, results)
+    retry.handle_failures(constants.CHANNEL_TYPE_SLACK, results, attempt, send_slack, slack_message,
+                          event_key=event_key)
+    return results
+
+
+def _smtp_error(error):
+    '''
+    Wraps the SMTP errors which are worth retrying in a RetryableError. Only
+    the refusal of a single recipient shows that its mailbox does not exist
+    and is wrapped in an EndpointGone: a refused sender or message, or a
+    failing relay, is not the fault of the channels of the batch.
+    '''
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and len(error.recipients) == 1:
+        code = list(error.recipients.values())[0][0]
+        if code in (550, 551, 553):
+            return breaker.EndpointGone(error)
+    else:
+        code = getattr(error, 'smtp_code', None)
+
+    if isinstance(error, (socket.error, smtplib.SMTPServerDisconnected, MailerException)) or \
+            (code is not None and 400 <= code < 500):
+        return retry.RetryableError(error)
+
+    return error
+
+
+def _send_email_bcc(session, channels, email_subject, email_body):
+    max_recipients = toolkit.asint(config.get('ckanext.notify.smtp.max_recipients', 50))
+    results = []
+
+    # Relays limit the number of recipients of a message, so big lists are sent in chunks
+    for start in range(0, len(channels), max_recipients):
+        chunk = channels[start:start + max_recipients]
+        try:
+            refused = session.send_bcc([channel.address for channel in chunk], email_subject, email_body)
+        except smtplib.SMTPRecipientsRefused as e:
+            # Every recipient of the chunk was refused, each one for its own reason
+            refused = e.recipients
+        except Exception as e:
+            results.extend(dispatcher.Result(channel, False, None, _smtp_error(e)) for channel in chunk)
+            continue
+
+        for channel in chunk:
+            if channel.address in refused:
+                error = smtplib.SMTPRecipientsRefused({channel.address: refused[channel.address]})
+                results.append(dispatcher.Result(channel, False, None, _smtp_error(error)))
+            else:
+                results.append(dispatcher.Result(channel, True, None, None))
+
+    return results
+
+
+def _mail(channel, email_subject, email_body):
+    with smtp.session() as session:
+        try:
+            session.send(channel.address, email_subject, email_body)
+        except Exception as e:
+            raise _smtp_error(e)
+
+
+def send_email(channels, email_subject, email_body, bcc=False, attempt=1, event_key=None):
+    '''
+    Mails an already rendered subject and body to every channel concurrently,
+    over the pooled SMTP sessions of the process, so the connection, STARTTLS
+    and login are only paid when no idle session is left. With `bcc`, one
+    message per chunk of recipients is sent over a single session instead of
+    one per channel. Channels are db.ChannelRecords; duplicated addresses and
+    addresses which already received the event identified by `event_key` are
+    skipped. Failed deliveries are retried or stored as dead letters. Returns
+    one dispatcher.Result per channel notified.
+    '''
+    channels, skipped, tracked = _targets(constants.CHANNEL_TYPE_EMAIL, channels, attempt, event_key)
+
+    if bcc:
+        with smtp.session() as session:
+            results = _send_email_bcc(session, list(channels), email_subject, email_body)
+    else:
+        # Each thread of the fan-out borrows a session, more threads would only open more connections
+        results = dispatcher.fan_out(_mail, channels, email_subject, email_body, concurrency=smtp.pool_size())
+
+    breaker.record(constants.CHANNEL_TYPE_EMAIL, results, tracked, attempt)
+    results.extend(_skipped(skipped))
+
+    _log_failures(constants.CHANNEL_TYPE_EMAIL, results)
+    retry.handle_failures(constants.CHANNEL_TYPE_EMAIL, results, attempt, send_email,
+                          email_subject, email_body, bcc=bcc, event_key=event_key)
+    return results
+
+
+_senders = {
+    constants.CHANNEL_TYPE_SLACK: send_slack,
+    constants.CHANNEL_TYPE_EMAIL: send_email,
+}
+
+
+def requeue(dead_letter):
+    '''
+    Dispatches again the delivery stored in a dead letter, starting over with
+    the first attempt.
+    '''
+    payload = json.loads(dead_letter.payload)
+    channel = db.ChannelRecord.from_dict(dead_letter.channel_type, json.loads(dead_letter.channel))
+    sender = _senders[dead_letter.channel_type]
+
+    kwargs = dict((str(key), value) for key, value in payload.get('kwargs', {}).items())
+
+    # A requeue is explicit, it must not be skipped as a duplicate of the original delivery
+    kwargs.pop('event_key', None)
+    dispatcher.dispatch(sender, [channel], *payload.get('args', []), **kwargs)
@@ -0,0 +1,332 @@
+import atexit
+import collections
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import Queue
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Seconds a scheduled job waits again when the queue of the workers is full
+_POSTPONE_DELAY = 1
+
+_dispatcher = None
+_scheduler = None
+_stopping = False
+_lock = threading.Lock()
+_local = threading.local()
+
+# Outcome of a fan-out call for a single item: the value returned, or the exception raised
+Result = collections.namedtuple('Result', ['item', 'success', 'value', 'error'])
+
+
+class Dispatcher(object):
+    '''
+    Bounded pool of daemon worker threads which run notification deliveries
+    outside of the request thread. Jobs are plain callables; when the queue is
+    full, `submit` refuses the job instead of blocking the caller.
+    '''
+
+    def __init__(self, workers, queue_size, shutdown_timeout):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.shutdown_timeout = shutdown_timeout
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.pid = os.getpid()
+        self._threads = []
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name='notify-dispatch-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+            return True
+        except Queue.Full:
+            return False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is _STOP:
+                    return
+
+                func, args, kwargs = job
+                _run(func, args, kwargs)
+            finally:
+                self.queue.task_done()
+
+    def shutdown(self, timeout=None):
+        '''
+        Lets the workers finish the jobs already queued and stops them. Gives
+        up after `timeout` seconds so a stuck delivery cannot hang the process.
+        '''
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        deadline = time.time() + timeout
+
+        for thread in self._threads:
+            try:
+                self.queue.put(_STOP, timeout=max(deadline - time.time(), 0))
+            except Queue.Full:
+                break
+
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0))
+
+        pending = self.depth()
+        if pending:
+            log.warning('Notification dispatcher stopped with %d jobs still queued', pending)
+
+
+class Scheduler(object):
+    '''
+    Single timer thread which hands jobs over to the worker pool once their
+    delay has elapsed. Used to retry failed deliveries without keeping a
+    worker busy while it waits. Jobs never run on the timer thread itself, so
+    a slow delivery cannot hold back the ones due after it.
+    '''
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._work, name='notify-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, delay, func, args, kwargs, on_abandon):
+        with self._condition:
+            if self._stopped:
+                # Scheduled while the process exits, e.g. by another abandoned job
+                if on_abandon is not None:
+                    on_abandon()
+                return
+            heapq.heappush(self._heap, (time.time() + delay, next(self._counter), func, args, kwargs, on_abandon))
+            self._condition.notify()
+
+    def pending(self):
+        return len(self._heap)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+
+                if self._stopped:
+                    return
+                _, _, func, args, kwargs, on_abandon = heapq.heappop(self._heap)
+
+            # Workers are started for retries even when deliveries are made inline
+            if not get_dispatcher().submit(func, *args, **kwargs):
+                log.warning('Notification queue is full, postponing a scheduled job')
+                self.schedule(_POSTPONE_DELAY, func, args, kwargs, on_abandon)
+
+    def shutdown(self):
+        '''
+        Stops the timer thread. Jobs which were still waiting are handed to
+        their `on_abandon` callback so they can be stored instead of lost.
+        '''
+        with self._condition:
+            self._stopped = True
+            jobs, self._heap = self._heap, []
+            self._condition.notify()
+
+        for job in jobs:
+            on_abandon = job[5]
+            if on_abandon is not None:
+                try:
+                    on_abandon()
+                except Exception:
+                    log.exception('Unable to store an abandoned notification job')
+
+
+def _run(func, args, kwargs):
+    _local.background = True
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        log.exception('Notification job %s failed', getattr(func, '__name__', func))
+    finally:
+        _local.background = False
+        # Jobs run outside of any request, nobody else will close their session
+        model.Session.remove()
+
+
+def in_background():
+    '''Returns whether the current thread runs a job of the dispatcher or the scheduler, not a request.'''
+    return getattr(_local, 'background', False)
+
+
+def is_enabled():
+    return toolkit.asbool(config.get('ckanext.notify.async_dispatch', False))
+
+
+def get_dispatcher():
+    '''
+    Returns the dispatcher of the current process, creating it on first use.
+    A dispatcher inherited through fork has no running threads, so a new one
+    is created when the process id changes.
+    '''
+    global _dispatcher
+
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                workers = toolkit.asint(config.get('ckanext.notify.dispatch_workers', 4))
+                queue_size = toolkit.asint(config.get('ckanext.notify.dispatch_queue_size', 1000))
+                shutdown_timeout = toolkit.asint(config.get('ckanext.notify.dispatch_shutdown_timeout', 30))
+                _dispatcher = Dispatcher(workers, queue_size, shutdown_timeout)
+
+    return _dispatcher
+
+
+def dispatch(func, *args, **kwargs):
+    '''
+    Runs `func` on the background workers when asynchronous dispatch is
+    enabled, inline otherwise. If the queue is full the job is run inline, so
+    a backlog slows requests down rather than losing notifications.
+    '''
+    if is_enabled():
+        if get_dispatcher().submit(func, *args, **kwargs):
+            return
+        log.warning('Notification queue is full, delivering inline')
+
+    func(*args, **kwargs)
+
+
+def get_scheduler():
+    global _scheduler
+
+    if _scheduler is None or _scheduler.pid != os.getpid():
+        with _lock:
+            if _scheduler is None or _scheduler.pid != os.getpid():
+                _scheduler = Scheduler()
+
+    return _scheduler
+
+
+def dispatch_later(delay, func, args=(), kwargs=None, on_abandon=None):
+    '''
+    Dispatches `func` after `delay` seconds. If the process exits before,
+    `on_abandon` is called instead.
+    '''
+    if _stopping:
+        # A delivery drained by the stopping dispatcher failed, no scheduler will run it any more
+        if on_abandon is not None:
+            on_abandon()
+        return
+
+    get_scheduler().schedule(delay, func, args, kwargs or {}, on_abandon)
+
+
+def _call(func, item, args):
+    try:
+        return Result(item, True, func(item, *args), None)
+    except Exception as e:
+        return Result(item, False, None, e)
+
+
+def fan_out(func, items, *args, **kwargs):
+    '''
+    Calls `func(item, *args)` for every item, running at most `concurrency`
+    calls at the same time, and returns one Result per item in the original
+    order. An exception raised for one item is recorded in its Result and does
+    not stop or delay the other calls.
+    '''
+    items = list(items)
+    concurrency = kwargs.get('concurrency')
+    if concurrency is None:
+        concurrency = toolkit.asint(config.get('ckanext.notify.fanout_concurrency', 8))
+    concurrency = min(concurrency, len(items))
+
+    if concurrency <= 1:
+        return [_call(func, item, args) for item in items]
+
+    results = [None] * len(items)
+    background = in_background()
+    pending = Queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def work():
+        _local.background = background
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except Queue.Empty:
+                return
+            results[index] = _call(func, item, args)
+
+    threads = [threading.Thread(target=work, name='notify-fanout-{0}'.format(i)) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def status():
+    enabled = is_enabled()
+    dispatcher = _dispatcher if _dispatcher is not None and _dispatcher.pid == os.getpid() else None
+    scheduler = _scheduler if _scheduler is not None and _scheduler.pid == os.getpid() else None
+
+    return {
+        'enabled': enabled,
+        'workers': dispatcher.workers if dispatcher else 0,
+        'queue_size': dispatcher.queue_size if dispatcher else 0,
+        'queue_depth': dispatcher.depth() if dispatcher else 0,
+        'scheduled': scheduler.pending() if scheduler else 0,
+    }
+
+
+def shutdown(timeout=None):
+    global _dispatcher, _scheduler, _stopping
+
+    # Retries scheduled from now on, while the queue drains, are abandoned at once instead of starting a new scheduler
+    _stopping = True
+
+    scheduler = _scheduler
+    if scheduler is not None and scheduler.pid == os.getpid():
+        scheduler.shutdown()
+        _scheduler = None
+
+    dispatcher = _dispatcher
+    if dispatcher is None or dispatcher.pid != os.getpid():
+        return
+
+    dispatcher.shutdown(timeout)
+    _dispatcher = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,94 @@
+import csv
+import json
+import StringIO
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.constants as constants
+import ckanext.notify.db as db
+import ckanext.notify.organizations as organizations
+
+from ckan.common import config
+
+
+FORMATS = ['jsonl', 'csv']
+
+# The columns read by the import, so an export can be imported elsewhere
+FIELDS = ['id', 'type', 'organization_id', 'webhook_url', 'slack_channel', 'email']
+
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def page_size():
+    return toolkit.asint(config.get('ckanext.notify.export.page_size', 1000))
+
+
+def dictize(channel):
+    '''Returns the export row of a ChannelRecord, with every field of FIELDS.'''
+    slack = channel.type == constants.CHANNEL_TYPE_SLACK
+    return {
+        'id': channel.id,
+        'type': channel.type,
+        'organization_id': channel.organization_id,
+        'webhook_url': channel.address if slack else u'',
+        'slack_channel': channel.slack_channel if slack else u'',
+        'email': u'' if slack else channel.address,
+    }
+
+
+def organization_id(name_or_id):
+    '''
+    Returns the id of the organization with the name or id given. Deleted
+    organizations are not resolved, their channels are still listed by id.
+    '''
+    return organizations.resolve(name_or_id) or name_or_id
+
+
+def channels(type=None, organization_id=None, after=None):
+    '''
+    Yields every channel, as ChannelRecords ordered by id, loading a page of
+    ckanext.notify.export.page_size channels at a time, so memory does not
+    grow with the number of channels. The organization_id must already be
+    resolved with organization_id(): the pages are read through the engine
+    while the response is streamed, after the session of the request has
+    been removed.
+    '''
+    size = page_size()
+    while True:
+        records = db.Channel.page(after, size, type=type, organization_id=organization_id)
+        for record in records:
+            yield record
+        if len(records) < size:
+            return
+        after = records[-1].id
+
+
+def _jsonl(records):
+    for record in records:
+        yield json.dumps(dictize(record)) + '\n'
+
+
+def _csv_line(values):
+    buffer = StringIO.StringIO()
+    csv.writer(buffer).writerow([value.encode('utf-8') if isinstance(value, unicode) else value
+                                 for value in values])
+    return buffer.getvalue()
+
+
+def _csv(records):
+    yield _csv_line(FIELDS)
+    for record in records:
+        row = dictize(record)
+        yield _csv_line([row[field] for field in FIELDS])
+
+
+def lines(format, records):
+    '''Yields the records given as encoded JSON lines or CSV rows, with a header row.'''
+    if format not in FORMATS:
+        raise toolkit.ValidationError(toolkit._('Format must be one of {0}').format(', '.join(FORMATS)))
+
+    if format == 'jsonl':
+        return _jsonl(records)
+    return _csv(records)
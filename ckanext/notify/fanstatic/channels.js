@@ -0,0 +1,117 @@
+/* Loads the pages and search results of a channels table from organization_channels_list,
+ * one page at a time, instead of reloading the whole channels page.
+ *
+ * type   - The type of the channels of the table, slack or email.
+ * fields - The fields of a channel shown in its first columns.
+ * url    - The JSON list of the channels of the type.
+ * urls   - The edit, delete and reenable links of a channel, with __id__ in place of its id.
+ * i18n   - The labels of the statuses and buttons.
+ */
+this.ckan.module('notify-channels', function ($) {
+  return {
+    options: {
+      type: null,
+      fields: [],
+      url: null,
+      urls: {},
+      i18n: {}
+    },
+
+    initialize: function () {
+      $.proxyAll(this, /_on/);
+
+      this.q = this.el.find('.channels-search input[type=search]').val() || '';
+      this.el.on('submit', '.channels-search', this._onSearch);
+      this.el.on('click', '.channels-pager a', this._onPage);
+    },
+
+    load: function (q, offset) {
+      var module = this;
+
+      $.getJSON(this.options.url, {q: q, offset: offset})
+        .done(function (data) {
+          module.q = q;
+          module.render(data.result);
+        })
+        .fail(function () {
+          module.el.find('.channels-error').text(module.i18n('error')).removeClass('hidden');
+        });
+    },
+
+    render: function (page) {
+      var tbody = this.el.find('tbody').empty();
+      var columns = this.el.find('thead th').length;
+
+      this.el.find('.channels-error').addClass('hidden');
+
+      if (page.channels.length) {
+        $.each(page.channels, $.proxy(function (index, channel) {
+          tbody.append(this._row(channel));
+        }, this));
+      } else {
+        tbody.append($('<tr class="channels-empty">').append($('<td>').attr('colspan', columns).text(this.i18n('empty'))));
+      }
+
+      // Confirmations of the delete buttons
+      tbody.find('[data-module]').each(function () {
+        ckan.module.initializeElement(this);
+      });
+
+      var pager = this.el.find('.channels-pager');
+      pager.find('.previous').toggleClass('hidden', !page.offset)
+        .find('a').data('offset', Math.max(page.offset - page.limit, 0));
+      pager.find('.next').toggleClass('hidden', !page.more)
+        .find('a').data('offset', page.offset + page.limit);
+    },
+
+    _url: function (name, channel) {
+      return this.options.urls[name].replace('__id__', encodeURIComponent(channel.id));
+    },
+
+    _status: function (channel) {
+      var cell = $('<td>');
+
+      if (channel.status && channel.status !== 'closed') {
+        var important = channel.status === 'suspended';
+        cell.append($('<span class="label">').addClass(important ? 'label-important' : 'label-warning')
+          .text(this.i18n(channel.status)));
+        cell.append(' ');
+        cell.append($('<form class="channel-reenable" method="post">').attr('action', this._url('reenable', channel))
+          .append($('<button class="btn btn-mini" type="submit">').text(this.i18n('reenable'))));
+      } else {
+        cell.append($('<span class="label label-success">').text(this.i18n('active')));
+      }
+
+      return cell;
+    },
+
+    _row: function (channel) {
+      var row = $('<tr>');
+
+      $.each(this.options.fields, function (index, field) {
+        row.append($('<td>').text(channel[field]));
+      });
+      row.append(this._status(channel));
+
+      var buttons = $('<div class="btn-group pull-right">')
+        .append($('<a class="btn btn-small"><i class="icon-wrench"></i></a>')
+          .attr({href: this._url('edit', channel), title: this.i18n('edit')}))
+        .append($('<a class="btn btn-danger btn-small" data-module="confirm-action"><i class="icon-remove"></i></a>')
+          .attr({href: this._url('delete', channel), title: this.i18n('delete'),
+                 'data-module-i18n': JSON.stringify({content: this.i18n('confirm')})}));
+      row.append($('<td>').append(buttons));
+
+      return row;
+    },
+
+    _onSearch: function (event) {
+      event.preventDefault();
+      this.load($(event.currentTarget).find('input[type=search]').val(), 0);
+    },
+
+    _onPage: function (event) {
+      event.preventDefault();
+      this.load(this.q, $(event.currentTarget).data('offset'));
+    }
+  };
+});
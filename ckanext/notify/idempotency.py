@@ -0,0 +1,117 @@
+import datetime
+import hashlib
+import logging
+import threading
+
+import ckanext.notify.constants as constants
+import ckanext.notify.db as db
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+_purge_lock = threading.Lock()
+_last_purge = [datetime.datetime.min]
+
+
+def _digest(*parts):
+    # 128 bits are plenty to tell deliveries apart and keep the index small
+    return hashlib.sha1(u'\x00'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def event_key(template, result):
+    '''
+    Returns the key identifying a datarequest event, or None if the event
+    cannot be told apart from other events. A datarequest is created and
+    closed once, so those events are identified by the datarequest alone.
+    Comments are only identified when the caller provides the comment id.
+    '''
+    if result.get('idempotency_key'):
+        return _digest(template, result['idempotency_key'])
+
+    datarequest_id = result.get('id') or result.get('datarequest_url')
+    if not datarequest_id:
+        return None
+
+    if template == 'datarequest_comment':
+        comment = result.get('comment') or {}
+        comment_id = result.get('comment_id') or (comment.get('id') if isinstance(comment, dict) else None)
+        if not comment_id:
+            return None
+        return _digest(template, datarequest_id, comment_id)
+
+    return _digest(template, datarequest_id)
+
+
+def combine(keys):
+    '''Returns the key of a message made of several events.'''
+    if not keys or None in keys:
+        return None
+    return _digest(*sorted(keys))
+
+
+def endpoint(channel_type, channel):
+    '''
+    Returns the physical endpoint of a channel. Modern Slack webhooks ignore
+    the channel override, so several slack_channel values registered for a
+    webhook all end up in the same place.
+    '''
+    if channel_type == constants.CHANNEL_TYPE_SLACK:
+        return channel.address.strip()
+    return channel.address.strip().lower()
+
+
+def unique(channel_type, channels):
+    '''Keeps the first channel of every physical endpoint.'''
+    seen = set()
+    result = []
+
+    for channel in channels:
+        target = endpoint(channel_type, channel)
+        if target not in seen:
+            seen.add(target)
+            result.append(channel)
+
+    return result
+
+
+def _retention():
+    return int(config.get('ckanext.notify.dedup_retention', 86400))
+
+
+def _purge(now, cutoff):
+    # At most one purge per retention period and process, old keys can be claimed again anyway
+    with _purge_lock:
+        if now - _last_purge[0] < datetime.timedelta(seconds=_retention()):
+            return
+        _last_purge[0] = now
+
+    try:
+        db.Notify_Delivery.purge(cutoff)
+    except Exception:
+        log.exception('Unable to purge the delivered notifications index')
+
+
+def claim(channel_type, channels, key):
+    '''
+    Returns the channels to which the event identified by `key` has not been
+    delivered within ckanext.notify.dedup_retention seconds, and records the
+    delivery to them.
+    '''
+    retention = _retention()
+    if not key or retention <= 0:
+        return list(channels)
+
+    now = datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(seconds=retention)
+    _purge(now, cutoff)
+
+    claimed = []
+    for channel in channels:
+        if db.Notify_Delivery.claim(_digest(key, channel_type, endpoint(channel_type, channel)), now, cutoff):
+            claimed.append(channel)
+        else:
+            log.info('Skipping %s notification %s already delivered to channel %s', channel_type, key, channel.id)
+
+    return claimed
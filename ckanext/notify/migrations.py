@@ -0,0 +1,239 @@
+import datetime
+import logging
+import sqlalchemy as sa
+
+from sqlalchemy.engine import reflection
+
+
+log = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock taken while migrating
+_LOCK_KEY = 0x6e6f74696679
+
+# Set by the notify command, which must start on an outdated schema to migrate it
+skip_startup_check = False
+
+
+def _has_table(connection, name):
+    return name in reflection.Inspector.from_engine(connection).get_table_names()
+
+
+def _table(connection, name):
+    return sa.Table(name, sa.MetaData(), autoload=True, autoload_with=connection)
+
+
+def _create_index(connection, table_name, name, columns, unique=False):
+    '''Creates an index, unless a previous run or a fresh install already did.'''
+    inspector = reflection.Inspector.from_engine(connection)
+    if name in [index['name'] for index in inspector.get_indexes(table_name)]:
+        return
+
+    table = _table(connection, table_name)
+    sa.Index(name, *[table.c[column] for column in columns], unique=unique).create(connection)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _delete_duplicates(connection, table_name, columns):
+    '''
+    Keeps a single row for every combination of the columns given within an
+    organization. Rows which clash with those of another organization are
+    not chosen between: the migration stops and lists them.
+    '''
+    table = _table(connection, table_name)
+    keys = [table.c[column] for column in columns]
+    scope = [table.c.organization_id] + [key for key in keys if key.name != 'organization_id']
+
+    keep = sa.select([sa.func.min(table.c.id)]).group_by(*scope)
+    result = connection.execute(table.delete().where(~table.c.id.in_(keep)))
+    if result.rowcount:
+        log.warning('Deleted %d duplicated rows from %s', result.rowcount, table_name)
+
+    conflicts = connection.execute(sa.select(keys).group_by(*keys).having(sa.func.count() > 1)).fetchall()
+    if conflicts:
+        raise MigrationError(u'Several organizations have the same {0} in {1}, delete all but one of them and migrate '
+                             u'again: {2}'.format(u', '.join(columns), table_name, u'; '.join(
+                                 u', '.join(value or u'' for value in conflict) for conflict in conflicts)))
+
+
+def _channel_indexes(connection):
+    # The validator rejects these duplicates, but with a racy check-then-insert
+    _delete_duplicates(connection, 'org_notify_settings', ['organization_id'])
+
+    # Installs created after the channels were merged into notify_channels have no per type tables
+    if _has_table(connection, 'org_slack_details'):
+        _delete_duplicates(connection, 'org_slack_details', ['webhook_url', 'slack_channel'])
+        _create_index(connection, 'org_slack_details', 'idx_org_slack_details_organization_id', ['organization_id'])
+        _create_index(connection, 'org_slack_details', 'idx_org_slack_details_webhook_url_slack_channel',
+                      ['webhook_url', 'slack_channel'], unique=True)
+
+    if _has_table(connection, 'org_email_details'):
+        _delete_duplicates(connection, 'org_email_details', ['email'])
+        _create_index(connection, 'org_email_details', 'idx_org_email_details_organization_id', ['organization_id'])
+        _create_index(connection, 'org_email_details', 'idx_org_email_details_email', ['email'], unique=True)
+
+    _create_index(connection, 'org_notify_settings', 'idx_org_notify_settings_organization_id',
+                  ['organization_id'], unique=True)
+    _create_index(connection, 'notify_dead_letters', 'idx_notify_dead_letters_created', ['created'])
+
+
+def _orphan_health(connection):
+    # Deleting a channel used to leave its circuit state behind. This runs before the merge, while the channels are
+    # still in the per type tables, which fresh installs do not have
+    names = [name for name in ('org_slack_details', 'org_email_details') if _has_table(connection, name)]
+    if not names:
+        return
+
+    health = _table(connection, 'notify_channel_health')
+    channels = sa.union(*[sa.select([_table(connection, name).c.id]) for name in names])
+    result = connection.execute(health.delete().where(~health.c.channel_id.in_(channels)))
+    if result.rowcount:
+        log.info('Deleted the health of %d channels which no longer exist', result.rowcount)
+
+
+def _copy_channels(connection, table_name, channel_type, address, slack_channel=None):
+    '''
+    Copies the channels of a per type table into notify_channels, keeping
+    their ids so the health of the channels and their dead letters still
+    refer to them. Channels copied by a previous run are skipped.
+    '''
+    if not _has_table(connection, table_name):
+        return
+
+    source = _table(connection, table_name)
+    channels = _table(connection, 'notify_channels')
+
+    columns = [
+        source.c.id,
+        source.c.organization_id,
+        sa.literal(channel_type),
+        source.c[address],
+        # Legacy rows may have no slack channel, notify_channels stores an empty one
+        sa.func.coalesce(source.c[slack_channel], u'') if slack_channel else sa.literal(u''),
+        sa.literal(datetime.datetime.utcnow()),
+    ]
+    copied = sa.select([channels.c.id]).where(channels.c.id == source.c.id)
+    select = sa.select(columns).where(source.c.organization_id != None).where(~sa.exists(copied))
+
+    result = connection.execute(channels.insert().from_select(
+        ['id', 'organization_id', 'type', 'address', 'slack_channel', 'created'], select))
+    log.info('Copied %d channels from %s', result.rowcount, table_name)
+
+
+def _merge_channels(connection):
+    # The per type tables are left in place, so the previous version can still be run
+    _copy_channels(connection, 'org_slack_details', u'slack', 'webhook_url', 'slack_channel')
+    _copy_channels(connection, 'org_email_details', u'email', 'email')
+
+
+def _organization_ids(connection):
+    # Channels, settings and dead letters were stored against the name of their organization. Fresh installs have none
+    # to convert, and may create the notify tables before "paster db init" creates the organizations of CKAN
+    tables = [_table(connection, name) for name in ('notify_channels', 'org_notify_settings', 'notify_dead_letters')]
+    channels, settings = tables[:2]
+    if not any(connection.execute(sa.select([table.c.organization_id]).limit(1)).first() for table in tables):
+        return
+
+    groups = _table(connection, 'group')
+    names = sa.select([groups.c.name]).where(groups.c.is_organization == True)
+
+    converted = [row[0] for row in connection.execute(
+        sa.select([groups.c.id]).distinct()
+        .where(groups.c.name == channels.c.organization_id)
+        .where(groups.c.is_organization == True))]
+
+    # Settings saved by id before the migration win over the ones saved by name
+    by_id = sa.select([groups.c.name]).where(groups.c.id.in_(sa.select([settings.c.organization_id])))
+    connection.execute(settings.delete().where(settings.c.organization_id.in_(by_id)))
+
+    for table in tables:
+        organization_id = sa.select([groups.c.id]).where(groups.c.name == table.c.organization_id)\
+            .where(groups.c.is_organization == True).limit(1).as_scalar()
+        result = connection.execute(table.update()
+                                    .where(table.c.organization_id.in_(names))
+                                    .values(organization_id=organization_id))
+        log.info('Stored %d rows of %s by organization id', result.rowcount, table.name)
+
+    # The channel caches are keyed by id, those of the organizations converted must be reloaded
+    versions = _table(connection, 'notify_channel_versions')
+    for organization_id in converted:
+        result = connection.execute(versions.update()
+                                    .where(versions.c.organization_id == organization_id)
+                                    .values(version=versions.c.version + 1))
+        if not result.rowcount:
+            connection.execute(versions.insert().values(organization_id=organization_id, version=1))
+    connection.execute(versions.delete().where(versions.c.organization_id.in_(names)))
+
+
+# Ordered list of (version, description, function). Functions receive a
+# connection inside the transaction of their migration and must not fail if
+# their changes are already present.
+MIGRATIONS = [
+    (1, 'Indexes and unique constraints on the channel tables', _channel_indexes),
+    (2, 'Delete the health of deleted channels', _orphan_health),
+    (3, 'Merge the slack and email channels into notify_channels', _merge_channels),
+    (4, 'Store the channels by organization id instead of name', _organization_ids),
+]
+
+
+def _versions_table(metadata):
+    return sa.Table('notify_migrations', metadata,
+        sa.Column('version', sa.types.Integer, primary_key=True, autoincrement=False),
+        sa.Column('description', sa.types.UnicodeText, primary_key=False, default=u''),
+        sa.Column('applied', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+    )
+
+
+def has_core_schema(engine):
+    '''Returns whether "paster db init" has created the tables of CKAN.'''
+    return _has_table(engine, 'group')
+
+
+def current_version(engine):
+    # Read without creating anything, the database user of the web application may not be allowed to
+    if not _has_table(engine, 'notify_migrations'):
+        return 0
+    versions = _versions_table(sa.MetaData())
+    return engine.execute(sa.select([sa.func.max(versions.c.version)])).scalar() or 0
+
+
+def pending(engine):
+    version = current_version(engine)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def upgrade(engine):
+    '''
+    Applies the migrations newer than the schema version of the database,
+    each one in its own transaction. Returns the versions applied. On
+    PostgreSQL, processes starting at the same time migrate one after the
+    other, and the later ones find nothing left to apply.
+    '''
+    versions = _versions_table(sa.MetaData())
+    applied = []
+    locked = engine.dialect.name == 'postgresql'
+
+    lock = engine.connect()
+    try:
+        if locked:
+            lock.execute(sa.select([sa.func.pg_advisory_lock(_LOCK_KEY)]))
+
+        versions.create(bind=engine, checkfirst=True)
+        for version, description, migrate in pending(engine):
+            log.info('Applying notify migration %d: %s', version, description)
+            connection = engine.connect()
+            try:
+                with connection.begin():
+                    migrate(connection)
+                    connection.execute(versions.insert().values(version=version, description=description))
+            finally:
+                connection.close()
+            applied.append(version)
+    finally:
+        if locked:
+            lock.execute(sa.select([sa.func.pg_advisory_unlock(_LOCK_KEY)]))
+        lock.close()
+
+    return applied
@@ -0,0 +1,47 @@
+import ckanext.notify.coalesce as coalesce
+import ckanext.notify.constants as constants
+import ckanext.notify.delivery as delivery
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.idempotency as idempotency
+import ckanext.notify.renderer as renderer
+
+
+def notify(event, datarequest, organization_id, channels, email_bcc=False):
+    '''
+    Renders a datarequest event once and hands it over to the dispatcher for
+    every type of channel. `channels` maps a channel type to the list of
+    db.ChannelRecords of the organization. Returns the idempotency key of the
+    event.
+    '''
+    slack_channels = channels.get(constants.CHANNEL_TYPE_SLACK)
+    email_channels = channels.get(constants.CHANNEL_TYPE_EMAIL)
+
+    extra_vars = renderer.base_vars()
+    extra_vars.update({
+        'datarequest_url': datarequest['datarequest_url'],
+        'datarequest_title': datarequest['title'],
+        'datarequest_description': datarequest['description'],
+        'action_type': event,
+    })
+    event_key = idempotency.event_key(event, datarequest)
+
+    if coalesce.is_enabled():
+        if slack_channels:
+            coalesce.add(constants.CHANNEL_TYPE_SLACK, organization_id, slack_channels, event, extra_vars,
+                         event_key=event_key)
+        if email_channels:
+            coalesce.add(constants.CHANNEL_TYPE_EMAIL, organization_id, email_channels, event, extra_vars,
+                         event_key=event_key, bcc=email_bcc)
+        return event_key
+
+    # Messages are rendered here, the slow part is left to the dispatcher
+    if slack_channels:
+        slack_message = renderer.slack_message(event, extra_vars)
+        dispatcher.dispatch(delivery.send_slack, slack_channels, slack_message, event_key=event_key)
+
+    if email_channels:
+        email_subject, email_body = renderer.email_message(event, extra_vars)
+        dispatcher.dispatch(delivery.send_email, email_channels, email_subject, email_body, bcc=email_bcc,
+                            event_key=event_key)
+
+    return event_key
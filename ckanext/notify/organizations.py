@@ -0,0 +1,145 @@
+import os
+import threading
+
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.cache as cache
+
+from ckan.common import config
+
+
+_ids = None
+_summaries = None
+_lock = threading.Lock()
+
+
+def _caches():
+    '''
+    Returns the caches of the current process, mapping the names and ids of
+    organizations to their id, and their ids to their summary.
+    '''
+    global _ids, _summaries
+
+    if _ids is None or _ids.pid != os.getpid():
+        with _lock:
+            if _ids is None or _ids.pid != os.getpid():
+                size = toolkit.asint(config.get('ckanext.notify.organizations.cache_size', 1000))
+                ttl = toolkit.asint(config.get('ckanext.notify.organizations.cache_ttl', 300))
+                _summaries = cache.LRUCache(size, ttl)
+                _ids = cache.LRUCache(size, ttl)
+
+    return _ids, _summaries
+
+
+def _query():
+    return model.Session.query(model.Group).autoflush(False)\
+        .filter(model.Group.is_organization == True)\
+        .filter(model.Group.state == 'active')
+
+
+def _image_display_url(image_url):
+    # Mirrors group_dictize, uploaded images are served by CKAN
+    if image_url and not image_url.startswith('http'):
+        return '{0}/uploads/group/{1}'.format(config.get('ckan.site_url', '').rstrip('/'), image_url)
+    return image_url
+
+
+def resolve_many(names_or_ids):
+    '''
+    Returns a dict mapping the names or ids given to the ids of the active
+    organizations they identify. Those which are not cached are resolved with
+    a single query on the indexed id and name columns; unknown ones are left
+    out.
+    '''
+    ids, _ = _caches()
+    resolved = {}
+    missing = set()
+
+    for name_or_id in set(names_or_ids):
+        if not name_or_id:
+            continue
+        organization_id = ids.get(name_or_id)
+        if organization_id is None:
+            missing.add(name_or_id)
+        else:
+            resolved[name_or_id] = organization_id
+
+    if missing:
+        query = model.Session.query(model.Group.id, model.Group.name).autoflush(False)\
+            .filter(model.Group.is_organization == True)\
+            .filter(model.Group.state == 'active')\
+            .filter(sa.or_(model.Group.id.in_(list(missing)), model.Group.name.in_(list(missing))))
+        for organization_id, name in query:
+            for key in (organization_id, name):
+                ids.set(key, organization_id)
+                if key in missing:
+                    resolved[key] = organization_id
+
+    return resolved
+
+
+def resolve(name_or_id):
+    '''Returns the id of the active organization with the name or id given, or None.'''
+    return resolve_many([name_or_id]).get(name_or_id)
+
+
+def summary(name_or_id):
+    '''
+    Returns the fields of an organization used by the notify pages, or None
+    if there is no such active organization. Unlike organization_show, it
+    neither counts datasets nor loads members, extras or followers. A
+    cached summary is checked against the version of the organization, which
+    costs a primary key lookup.
+    '''
+    organization_id = resolve(name_or_id)
+    if organization_id is None:
+        return None
+
+    # Read before loading, an edit made meanwhile leaves the entry outdated rather than wrong
+    _, summaries = _caches()
+    current = cache.version(organization_id)
+    entry = summaries.get(organization_id)
+    if entry is not None and entry[0] != current:
+        summaries.record_stale()
+        entry = None
+
+    if entry is None:
+        group = _query().filter(model.Group.id == organization_id).first()
+        if group is None:
+            return None
+        entry = (current, {
+            'id': group.id,
+            'name': group.name,
+            'title': group.title,
+            'display_name': group.display_name,
+            'description': group.description,
+            'image_url': group.image_url,
+            'image_display_url': _image_display_url(group.image_url),
+            'type': group.type,
+            'is_organization': group.is_organization,
+            'state': group.state,
+            'approval_status': group.approval_status,
+        })
+        summaries.set(organization_id, entry)
+
+    # The cached summary is shared, templates get their own copy
+    return dict(entry[1])
+
+
+def invalidate(organization_id):
+    '''
+    Forgets the summary of an organization and the names resolved so far,
+    since one of them may be its previous name. The other processes notice
+    the change of the summary through the version of the organization.
+    '''
+    ids, summaries = _caches()
+    summaries.delete(organization_id)
+    ids.clear()
+
+
+def stats():
+    '''Returns the counters of the organization caches of the current process.'''
+    ids, summaries = _caches()
+    return {'ids': ids.stats(), 'summaries': summaries.stats()}
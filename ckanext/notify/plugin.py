@@ -1,17 +1,28 @@
+import logging
+import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
+import sqlalchemy as sa
 import constants
 import actions
 import auth
+import db
+import migrations
+import organizations
+
+
+log = logging.getLogger(__name__)
 
 
 class NotifyPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IAuthFunctions)
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IRoutes, inherit=True)
     plugins.implements(plugins.IPackageController, inherit=True)
     plugins.implements(plugins.IMapper)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
 
     # IConfigurer
 
@@ -20,6 +31,27 @@ class NotifyPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, 'public')
         toolkit.add_resource('fanstatic', 'notify')
 
+    # IConfigurable
+
+    def configure(self, config_):
+        # Tables are mapped once per process, not by every action
+        db.init_db(model)
+
+        if toolkit.asbool(config_.get('ckanext.notify.create_tables', True)):
+            try:
+                db.create_tables()
+                migrations.upgrade(model.meta.engine)
+            except (sa.exc.SQLAlchemyError, migrations.MigrationError):
+                log.exception('Unable to create or migrate the notify tables, run "paster notify migrate"')
+
+        # The channels of older installs are only moved to notify_channels, and keyed by organization id, by the
+        # migrations: running before them would silently stop every notification. A database without the tables of CKAN
+        # has no channels to move, and "paster db init" must still be able to start
+        if not migrations.skip_startup_check and migrations.has_core_schema(model.meta.engine) and \
+                migrations.pending(model.meta.engine):
+            raise RuntimeError('The notify schema is outdated, run '
+                               '"paster --plugin=ckanext-notify notify migrate -c <CONFIG>" before starting CKAN')
+
     # IActions
 
     def get_actions(self):
@@ -34,6 +66,16 @@ class NotifyPlugin(plugins.SingletonPlugin):
             constants.EMAIL_CHANNEL_SHOW: actions.email_channel_show,
             constants.EMAIL_CHANNEL_UPDATE: actions.email_channel_update,
             constants.EMAIL_CHANNEL_DELETE: actions.email_channel_delete,
+            constants.CHANNEL_REENABLE: actions.channel_reenable,
+            constants.CHANNELS_BULK_REGISTER: actions.channels_bulk_register,
+            constants.CHANNELS_IMPORT: actions.channels_import,
+            constants.CHANNELS_EXPORT: actions.channels_export,
+            constants.NOTIFY_DATAREQUEST_EVENT: actions.notify_datarequest_event,
+            constants.NOTIFY_SETTINGS_SHOW: actions.notify_settings_show,
+            constants.NOTIFY_SETTINGS_UPDATE: actions.notify_settings_update,
+            constants.NOTIFY_DISPATCH_STATUS: actions.notify_dispatch_status,
+            constants.NOTIFY_DEAD_LETTERS_SHOW: actions.notify_dead_letters_show,
+            constants.NOTIFY_DEAD_LETTER_REQUEUE: actions.notify_dead_letter_requeue,
         }
 
         return additional_actions
@@ -43,6 +85,7 @@ class NotifyPlugin(plugins.SingletonPlugin):
     def get_auth_functions(self):
         auth_functions = {
             constants.MANAGE_NOTIFICATIONS: auth.manage_notifications,
+            constants.NOTIFY_ADMIN: auth.notify_admin,
         }
 
         return auth_functions
@@ -56,6 +99,11 @@ class NotifyPlugin(plugins.SingletonPlugin):
                     controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
                     action='organization_channels', conditions=dict(method=['GET']), ckan_icon='bell')
 
+        # Channels of a type as JSON
+        map.connect('organization_channels_list', '/notify/channels/{id}/{channel_type}.json',
+                    controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
+                    action='organization_channels_list', conditions=dict(method=['GET']))
+
         # Add Channels
         map.connect('add_channel', '/organization/channels/add/{id}',
                     controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
@@ -91,4 +139,34 @@ class NotifyPlugin(plugins.SingletonPlugin):
                     controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
                     action='delete_email_details', conditions=dict(method=['POST']))
 
+        # Re-enable a suspended Channel
+        map.connect('reenable_channel', '/organization/channels/reenable/{channel_type}/{id}/{organization_id}',
+                    controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
+                    action='reenable_channel', conditions=dict(method=['POST']))
+
+        # Update Notification Settings
+        map.connect('update_notify_settings', '/organization/channels/settings/{organization_id}',
+                    controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
+                    action='update_notify_settings', conditions=dict(method=['POST']))
+
+        # Export the Channels of every Organization
+        map.connect('export_channels', '/notify/channels/export.{format}',
+                    controller='ckanext.notify.controllers.ui_controller:DataRequestsNotifyUI',
+                    action='export_channels', conditions=dict(method=['GET']))
+
         return map
+
+    # IOrganizationController
+
+    def _organization_changed(self, entity):
+        # IPackageController calls hooks with the same names for datasets
+        if isinstance(entity, model.Group):
+            organizations.invalidate(entity.id)
+            # The channels page shows the organization, its ETag must change when the edit is committed
+            db.Notify_Channel_Version.bump(model.Session, [entity.id])
+
+    def edit(self, entity):
+        self._organization_changed(entity)
+
+    def delete(self, entity):
+        self._organization_changed(entity)
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.retry as retry
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'acquired': 0, 'waited': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'deferred': 0}
+
+
+def _get_connection():
+    '''
+    Returns the connection of the current process to the node-wide bucket
+    store, which must be used while holding _lock. SQLite serializes the
+    writers of every process using the file, so all the CKAN processes of a
+    node share the same buckets.
+    '''
+    global _connection, _connection_pid
+
+    # Fan-out threads are short lived, a connection per thread would be opened for almost every post
+    if _connection is None or _connection_pid != os.getpid():
+        path = config.get('ckanext.notify.ratelimit.path',
+                          os.path.join(tempfile.gettempdir(), 'ckanext-notify-ratelimit.sqlite'))
+        _connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        _connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        _connection_pid = os.getpid()
+
+    return _connection
+
+
+def _reserve(key, rate, burst, max_wait):
+    '''
+    Takes a token from the bucket of `key`, refilled at `rate` tokens per
+    second up to `burst`. When the bucket is empty the token is borrowed from
+    the future and the seconds to wait for it are returned, so concurrent
+    callers are paced one after the other instead of polling. When the wait
+    would exceed `max_wait` nothing is taken. Returns whether the token was
+    taken and the seconds to wait.
+    '''
+    with _lock:
+        connection = _get_connection()
+        now = time.time()
+
+        # IMMEDIATE takes the write lock before reading, no other process can interleave
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if wait > max_wait:
+                connection.execute('ROLLBACK')
+                return False, wait
+
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens - 1, now))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    return True, wait
+
+
+def _record(taken, wait):
+    with _stats_lock:
+        if not taken:
+            _stats['deferred'] += 1
+            return
+        _stats['acquired'] += 1
+        if wait > 0:
+            _stats['waited'] += 1
+            _stats['wait_seconds'] += wait
+            _stats['max_wait_seconds'] = max(_stats['max_wait_seconds'], wait)
+
+
+def acquire(webhook_url):
+    '''
+    Blocks until the webhook may be called again and returns the seconds
+    waited. If the webhook is so busy that the wait would be longer than
+    ckanext.notify.ratelimit.max_wait, a retry.Deferred is raised instead so
+    the delivery is rescheduled without holding a worker nor using one of its
+    attempts. Deliveries made by a request thread never wait, they are
+    rescheduled as soon as the webhook is busy.
+    '''
+    if not toolkit.asbool(config.get('ckanext.notify.ratelimit.enabled', True)):
+        return 0.0
+
+    rate = float(config.get('ckanext.notify.ratelimit.rate', 1))
+    burst = float(config.get('ckanext.notify.ratelimit.burst', 1))
+    max_wait = float(config.get('ckanext.notify.ratelimit.max_wait', 10)) if dispatcher.in_background() else 0.0
+
+    # Webhook URLs are secrets, only their digest is written to disk
+    key = hashlib.sha1(webhook_url.encode('utf-8')).hexdigest()
+    taken, wait = _reserve(key, rate, burst, max_wait)
+    _record(taken, wait)
+
+    if not taken:
+        raise retry.Deferred('Webhook rate limit exceeded', retry_after=wait)
+
+    if wait > 0:
+        log.debug('Waiting %.2f seconds for the rate limit of webhook %s', wait, key[:8])
+        time.sleep(wait)
+
+    return wait
+
+
+def stats():
+    '''Returns the rate limiter counters of the current process.'''
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,108 @@
+import logging
+import threading
+
+import ckan.lib.i18n as i18n
+import ckan.plugins.toolkit as toolkit
+
+from ckan.common import config
+
+
+log = logging.getLogger(__name__)
+
+# Every template used to build a notification
+TEMPLATES = [
+    'notify/slack/datarequest_create.txt',
+    'notify/slack/datarequest_comment.txt',
+    'notify/slack/datarequest_close.txt',
+    'notify/slack/digest.txt',
+    'notify/email/subject.txt',
+    'notify/email/datarequest_create.txt',
+    'notify/email/datarequest_comment.txt',
+    'notify/email/datarequest_close.txt',
+    'notify/email/digest.txt',
+]
+
+_templates = {}
+_base_vars = {}
+_lock = threading.Lock()
+
+
+def _environment():
+    # The environment of CKAN, so notify templates keep its filters and extensions
+    return config['pylons.app_globals'].jinja_env
+
+
+def _locale():
+    try:
+        return i18n.get_lang()
+    except Exception:
+        # Outside of a request, e.g. in a dispatcher thread
+        return config.get('ckan.locale_default', 'en')
+
+
+def _is_debug():
+    return toolkit.asbool(config.get('debug', False))
+
+
+def _compile(locale):
+    environment = _environment()
+    templates = {}
+    for name in TEMPLATES:
+        templates[(name, locale)] = environment.get_template(name)
+    return templates
+
+
+def get_template(name):
+    '''
+    Returns the compiled template, loaded once per process and locale. All
+    the notify templates of a locale are compiled together on first use. In
+    debug mode nothing is cached, so template changes show up immediately.
+    '''
+    if _is_debug():
+        return _environment().get_template(name)
+
+    locale = _locale()
+    template = _templates.get((name, locale))
+    if template is None:
+        with _lock:
+            if (name, locale) not in _templates:
+                _templates.update(_compile(locale))
+                if (name, locale) not in _templates:
+                    _templates[(name, locale)] = _environment().get_template(name)
+            template = _templates[(name, locale)]
+
+    return template
+
+
+def clear():
+    '''Drops the compiled templates, they are compiled again on next use.'''
+    with _lock:
+        _templates.clear()
+        _base_vars.clear()
+
+
+def render(name, extra_vars):
+    return get_template(name).render(**extra_vars)
+
+
+def base_vars():
+    '''
+    Returns a new dict with the variables shared by every notification, which
+    are read from the configuration once per process.
+    '''
+    if not _base_vars or _is_debug():
+        _base_vars.update({
+            'site_url': config.get('ckan.site_url'),
+            'site_title': config.get('ckan.site_title'),
+        })
+
+    return dict(_base_vars)
+
+
+def slack_message(template, extra_vars):
+    return {'text': render('notify/slack/{}.txt'.format(template), extra_vars)}
+
+
+def email_message(template, extra_vars):
+    return (render('notify/email/subject.txt', extra_vars),
+            render('notify/email/{}.txt'.format(template), extra_vars))
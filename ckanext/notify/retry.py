@@ -0,0 +1,128 @@
+import json
+import logging
+import random
+import time
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.db as db
+import ckanext.notify.dispatcher as dispatcher
+
+from ckan.common import config
+from email import utils
+
+
+log = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    '''
+    A delivery failure that may succeed later, such as a timeout, a 5xx or a
+    429 answer. `retry_after` holds the delay asked for by the server, if any.
+    '''
+
+    def __init__(self, message, retry_after=None):
+        super(RetryableError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class Deferred(RetryableError):
+    '''
+    A delivery which was not attempted because a rate limit paces it. It is
+    run again once `retry_after` seconds have passed, without using one of
+    its attempts.
+    '''
+
+
+def max_attempts():
+    return toolkit.asint(config.get('ckanext.notify.retry.max_attempts', 5))
+
+
+def parse_retry_after(value):
+    '''Returns the seconds requested by a Retry-After header, or None.'''
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    parsed = utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+
+    return max(utils.mktime_tz(parsed) - time.time(), 0)
+
+
+def backoff_delay(attempt, retry_after=None):
+    '''
+    Exponential backoff with full jitter for the given attempt number, so
+    channels failing together do not retry together. A delay requested by the
+    server is always honoured.
+    '''
+    base_delay = float(config.get('ckanext.notify.retry.base_delay', 1))
+    max_delay = float(config.get('ckanext.notify.retry.max_delay', 300))
+
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base_delay))
+
+    return delay
+
+
+def _store_dead_letters(channel_type, failures, attempts, args, kwargs):
+    payload = json.dumps({'args': args, 'kwargs': kwargs})
+
+    # Inline deliveries run within the request of the caller, whose session must be neither committed nor rolled back
+    try:
+        db.Notify_Dead_Letter.insert_many([{
+            'organization_id': result.item.organization_id,
+            'channel_type': channel_type,
+            'channel_id': result.item.id,
+            'channel': json.dumps(result.item._asdict()),
+            'payload': payload,
+            'attempts': attempts,
+            'last_error': unicode(result.error),
+        } for result in failures])
+    except Exception:
+        log.exception('Unable to store %d undelivered %s notifications', len(failures), channel_type)
+
+
+def _schedule(channel_type, results, attempt, next_attempt, delay, func, args, kwargs):
+    channels = [result.item for result in results]
+    retry_kwargs = dict(kwargs, attempt=next_attempt)
+    abandon = lambda: _store_dead_letters(channel_type, results, attempt, args, kwargs)
+    dispatcher.dispatch_later(delay, func, (channels,) + args, retry_kwargs, on_abandon=abandon)
+    return channels
+
+
+def handle_failures(channel_type, results, attempt, func, *args, **kwargs):
+    '''
+    Schedules a new call of `func` for the channels whose delivery failed with
+    a RetryableError, using a single delay for all of them. Channels which
+    failed permanently, or which used their last attempt, are stored in the
+    dead letters table from where they can be requeued. Deferred deliveries
+    are called again with the same attempt once the rate limit allows it.
+    '''
+    deferred = [result for result in results if not result.success and isinstance(result.error, Deferred)]
+    failures = [result for result in results if not result.success and not isinstance(result.error, Deferred)]
+    if attempt >= max_attempts():
+        retryable, exhausted = [], failures
+    else:
+        retryable = [result for result in failures if isinstance(result.error, RetryableError)]
+        exhausted = [result for result in failures if not isinstance(result.error, RetryableError)]
+
+    if exhausted:
+        _store_dead_letters(channel_type, exhausted, attempt, args, kwargs)
+
+    if retryable:
+        retry_after = [result.error.retry_after for result in retryable if result.error.retry_after is not None]
+        delay = backoff_delay(attempt, max(retry_after) if retry_after else None)
+        channels = _schedule(channel_type, retryable, attempt, attempt + 1, delay, func, args, kwargs)
+        log.info('Retrying %d %s notifications in %.1f seconds', len(channels), channel_type, delay)
+
+    if deferred:
+        # The event was claimed by the deferred call, the new one must not skip it as a duplicate
+        delay = backoff_delay(1, max(result.error.retry_after or 0 for result in deferred))
+        channels = _schedule(channel_type, deferred, attempt, attempt, delay, func, args, dict(kwargs, event_key=None))
+        log.info('Deferring %d %s notifications for %.1f seconds', len(channels), channel_type, delay)
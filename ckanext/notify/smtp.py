@@ -0,0 +1,246 @@
+import atexit
+import contextlib
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+
+import ckan
+import ckan.plugins.toolkit as toolkit
+
+from ckan.common import config
+from ckan.lib.mailer import MailerException
+from email import utils
+from email.header import Header
+from email.mime.text import MIMEText
+
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_lock = threading.Lock()
+
+
+class SMTPSession(object):
+    '''
+    An SMTP connection which is opened, secured and authenticated once and
+    then used for as many messages as needed. If the relay drops the
+    connection, the session reconnects and sends the message again once.
+    '''
+
+    def __init__(self):
+        self.connection = None
+        self.last_used = 0
+
+    def _connect(self):
+        test_server = config.get('smtp.test_server')
+        if test_server:
+            # Mirrors ckan.lib.mailer, the test server needs no TLS nor login
+            connection = smtplib.SMTP(test_server)
+            connection.ehlo()
+            return connection
+
+        smtp_server = config.get('smtp.server', 'localhost')
+        smtp_starttls = toolkit.asbool(config.get('smtp.starttls'))
+        smtp_user = config.get('smtp.user')
+        smtp_password = config.get('smtp.password')
+
+        try:
+            connection = smtplib.SMTP(smtp_server)
+        except (socket.error, smtplib.SMTPException) as e:
+            raise MailerException('SMTP server could not be connected to: "%s" %s' % (smtp_server, e))
+
+        connection.ehlo()
+
+        if smtp_starttls:
+            if not connection.has_extn('STARTTLS'):
+                raise MailerException('SMTP server does not support STARTTLS')
+            connection.starttls()
+            # Re-identify ourselves over the TLS connection
+            connection.ehlo()
+
+        if smtp_user:
+            if not smtp_password:
+                raise MailerException('SMTP user is set but the password is missing')
+            connection.login(smtp_user, smtp_password)
+
+        return connection
+
+    def _build_message(self, to, subject, body):
+        mail_from = config.get('smtp.mail_from')
+
+        msg = MIMEText(body.encode('utf-8'), 'plain', 'utf-8')
+        msg['Subject'] = Header(subject, 'utf-8')
+        msg['From'] = '%s <%s>' % (config.get('ckan.site_title'), mail_from)
+        msg['To'] = Header(to, 'utf-8')
+        msg['Date'] = utils.formatdate(time.time())
+        msg['X-Mailer'] = 'CKAN %s' % ckan.__version__
+
+        return mail_from, msg.as_string()
+
+    def _sendmail(self, mail_from, recipients, message):
+        try:
+            if self.connection is None:
+                self.connection = self._connect()
+            refused = self.connection.sendmail(mail_from, recipients, message)
+        except (smtplib.SMTPServerDisconnected, socket.error):
+            log.info('SMTP connection lost, reconnecting')
+            self.close()
+            self.connection = self._connect()
+            refused = self.connection.sendmail(mail_from, recipients, message)
+
+        self.last_used = time.time()
+        return refused
+
+    def send(self, recipient_email, subject, body):
+        if not recipient_email:
+            raise MailerException('No recipient email address available!')
+
+        mail_from, message = self._build_message(recipient_email, subject, body)
+        self._sendmail(mail_from, [recipient_email], message)
+
+    def send_bcc(self, recipient_emails, subject, body):
+        '''
+        Sends a single message to all the recipients without disclosing them
+        to each other. Returns the dict of the recipients refused by the relay,
+        as smtplib does; the message is delivered to the others.
+        '''
+        if not recipient_emails:
+            raise MailerException('No recipient email address available!')
+
+        mail_from, message = self._build_message('undisclosed-recipients:;', subject, body)
+        return self._sendmail(mail_from, list(recipient_emails), message)
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self.connection = None
+
+
+class SessionPool(object):
+    '''
+    Idle SMTP sessions shared by the threads of the process, each one used by
+    a single thread at a time. At most `size` sessions are kept, and a timer
+    closes the ones idle for longer than `keepalive` seconds, so a request
+    thread which sent a notification does not hold a connection afterwards.
+    '''
+
+    def __init__(self, size, keepalive):
+        self.size = size
+        self.keepalive = keepalive
+        self.pid = os.getpid()
+        # Most recently used last, so the others age out when the load drops
+        self._idle = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def acquire(self):
+        expired = []
+        session = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if time.time() - candidate.last_used <= self.keepalive:
+                    session = candidate
+                    break
+                expired.append(candidate)
+
+        for candidate in expired:
+            candidate.close()
+
+        return session or SMTPSession()
+
+    def release(self, session):
+        if session.connection is None:
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(session)
+                self._schedule()
+                return
+
+        session.close()
+
+    def _schedule(self):
+        # Called with the lock held, wakes up when the oldest idle session expires
+        if self._timer is not None or not self._idle:
+            return
+
+        delay = max(min(session.last_used for session in self._idle) + self.keepalive - time.time(), 0)
+        self._timer = threading.Timer(delay, self._reap)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _reap(self):
+        now = time.time()
+        with self._lock:
+            self._timer = None
+            expired = [session for session in self._idle if now - session.last_used >= self.keepalive]
+            self._idle = [session for session in self._idle if now - session.last_used < self.keepalive]
+            self._schedule()
+
+        for session in expired:
+            session.close()
+
+    def idle(self):
+        return len(self._idle)
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        for session in sessions:
+            session.close()
+
+
+def pool_size():
+    return toolkit.asint(config.get('ckanext.notify.smtp.pool_size', 4))
+
+
+def get_pool():
+    '''
+    Returns the SMTP session pool of the current process, creating it on
+    first use. Connections are never shared with a forked child process.
+    '''
+    global _pool
+
+    if _pool is None or _pool.pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool.pid != os.getpid():
+                keepalive = toolkit.asint(config.get('ckanext.notify.smtp.keepalive', 60))
+                _pool = SessionPool(pool_size(), keepalive)
+
+    return _pool
+
+
+@contextlib.contextmanager
+def session():
+    '''
+    Lends an SMTP session of the pool to the current thread. The session is
+    opened, secured and authenticated on its first message only, and given
+    back to the pool once the block ends.
+    '''
+    pool = get_pool()
+    smtp_session = pool.acquire()
+    try:
+        yield smtp_session
+    finally:
+        pool.release(smtp_session)
+
+
+def shutdown():
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        pool.close()
+
+
+atexit.register(shutdown)
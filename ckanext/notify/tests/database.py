@@ -0,0 +1,38 @@
+"""SQLite databases holding the notify tables, for the tests of the modules which query them."""
+import contextlib
+
+import mock
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckanext.notify.db as db
+
+
+def create_engine(url='sqlite://'):
+    '''
+    Returns an engine on a SQLite database with the notify tables. In memory
+    databases share a single connection, so every thread sees the same data.
+    '''
+    db.init_db(model)
+    if url == 'sqlite://':
+        engine = sa.create_engine(url, poolclass=sa.pool.StaticPool, connect_args={'check_same_thread': False})
+    else:
+        engine = sa.create_engine(url)
+    for table in db.tables:
+        table.create(bind=engine, checkfirst=True)
+    return engine
+
+
+def table(name):
+    return [table for table in db.tables if table.name == name][0]
+
+
+@contextlib.contextmanager
+def engine(url='sqlite://'):
+    '''Runs the notify queries made through model.meta.engine on a SQLite database.'''
+    sqlite = create_engine(url)
+    try:
+        with mock.patch.object(model.meta, 'engine', sqlite):
+            yield sqlite
+    finally:
+        sqlite.dispose()
@@ -0,0 +1,220 @@
+"""Tests for actions.py."""
+import datetime
+
+import mock
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.actions as actions
+import ckanext.notify.constants as constants
+import ckanext.notify.db as db
+
+from ckanext.notify.tests import database
+
+
+ORGANIZATION_ID = u'org-id'
+
+DATAREQUEST = {
+    'organization': {'id': ORGANIZATION_ID, 'name': u'org'},
+    'title': u'Air quality',
+    'description': u'Hourly measures',
+    'datarequest_url': u'http://ckan.example.org/datarequest/1',
+}
+
+SLACK = db.ChannelRecord(u'slack', ORGANIZATION_ID, u'slack', u'https://hooks.slack.com/services/T/B/X', u'general')
+EMAIL = db.ChannelRecord(u'email', ORGANIZATION_ID, u'email', u'a@example.org', u'')
+
+
+def _channels(organization_id, channel_type):
+    return {constants.CHANNEL_TYPE_SLACK: (SLACK,), constants.CHANNEL_TYPE_EMAIL: (EMAIL,)}[channel_type]
+
+
+class TestNotifyDatarequestEvent(object):
+
+    def setup(self):
+        self.patches = [
+            mock.patch.object(actions.toolkit, 'check_access'),
+            mock.patch.object(actions.organizations, 'resolve', return_value=ORGANIZATION_ID),
+            mock.patch.object(actions, '_organization_channels', side_effect=_channels),
+            mock.patch.object(actions.db, 'Org_Notify_Settings'),
+            mock.patch.object(actions.notifier, 'notify', return_value=u'event-key'),
+        ]
+        self.check_access, _, _, settings, self.notify = [patch.start() for patch in self.patches]
+        settings.get.return_value = []
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def _call(self, **data_dict):
+        data_dict.setdefault('event', u'datarequest_create')
+        data_dict.setdefault('datarequest', dict(DATAREQUEST))
+        return actions.notify_datarequest_event({}, data_dict)
+
+    def test_notifies_every_channel_type(self):
+        result = self._call()
+
+        nt.assert_equal(result, {'event_key': u'event-key', u'slack': 1, u'email': 1})
+        self.check_access.assert_called_once_with(constants.NOTIFY_ADMIN, {}, mock.ANY)
+        _, _, organization_id, channels = self.notify.call_args[0]
+        nt.assert_equal(organization_id, ORGANIZATION_ID)
+        nt.assert_equal(channels, {u'slack': [SLACK], u'email': [EMAIL]})
+        nt.assert_false(self.notify.call_args[1]['email_bcc'])
+
+    def test_notifies_the_channel_types_given(self):
+        result = self._call(channel_types=[constants.CHANNEL_TYPE_EMAIL])
+
+        nt.assert_equal(result[constants.CHANNEL_TYPE_SLACK], 0)
+        nt.assert_equal(self.notify.call_args[0][3], {u'email': [EMAIL]})
+
+    def test_unknown_event_is_rejected(self):
+        nt.assert_raises(toolkit.ValidationError, self._call, event=u'datarequest_delete')
+        nt.assert_false(self.notify.called)
+
+    def test_required_fields_are_validated(self):
+        for field in ('datarequest_url', 'title', 'description'):
+            datarequest = dict(DATAREQUEST)
+            del datarequest[field]
+            nt.assert_raises(toolkit.ValidationError, self._call, datarequest=datarequest)
+
+        nt.assert_raises(toolkit.ValidationError, self._call, datarequest=dict(DATAREQUEST, title=u''))
+        nt.assert_false(self.notify.called)
+
+    def test_empty_description_is_accepted(self):
+        self._call(datarequest=dict(DATAREQUEST, description=u''))
+        nt.assert_true(self.notify.called)
+
+    def test_unknown_organization_notifies_nobody(self):
+        actions.organizations.resolve.return_value = None
+
+        nt.assert_equal(self._call()['event_key'], None)
+        nt.assert_false(self.notify.called)
+
+
+class TestAccess(object):
+    '''The listings used to skip their access check when called with success set.'''
+
+    def setup(self):
+        self.patch = mock.patch.object(actions.toolkit, 'check_access', side_effect=toolkit.NotAuthorized)
+        self.patch.start()
+
+    def teardown(self):
+        self.patch.stop()
+
+    def test_success_does_not_skip_the_access_check(self):
+        for action in (actions.slack_channels_show, actions.email_channels_show, actions.notify_settings_show):
+            nt.assert_raises(toolkit.NotAuthorized, action, {}, {'organization_id': ORGANIZATION_ID, 'success': True})
+
+
+class TestNotifySettings(object):
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+        self.session = sa.orm.sessionmaker(bind=self.engine)()
+        self.patches = [
+            mock.patch.object(actions.toolkit, 'check_access'),
+            mock.patch.object(actions.organizations, 'resolve',
+                              side_effect=lambda name_or_id: ORGANIZATION_ID if name_or_id in (u'org', ORGANIZATION_ID)
+                              else None),
+            mock.patch.object(model, 'Session', self.session),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.session.close()
+        self.database.__exit__(None, None, None)
+
+    def _show(self, organization_id=u'org'):
+        return actions.notify_settings_show({'session': self.session}, {'organization_id': organization_id})
+
+    def _update(self, email_bcc, organization_id=u'org'):
+        return actions.notify_settings_update({'session': self.session},
+                                              {'organization_id': organization_id, 'email_bcc': email_bcc})
+
+    def test_defaults_without_saved_settings(self):
+        nt.assert_equal(self._show(), {'organization_id': ORGANIZATION_ID, 'email_bcc': False})
+
+    def test_update_saves_a_single_row_by_id(self):
+        nt.assert_equal(self._update(u'true'), {'organization_id': ORGANIZATION_ID, 'email_bcc': True})
+        nt.assert_equal(self._update(u'false', organization_id=ORGANIZATION_ID)['email_bcc'], False)
+
+        rows = self.engine.execute(sa.select([database.table('org_notify_settings').c.organization_id])).fetchall()
+        nt.assert_equal([row[0] for row in rows], [ORGANIZATION_ID])
+        nt.assert_equal(self._show()['email_bcc'], False)
+
+    def test_update_bumps_the_version(self):
+        self._update(u'true')
+        self._update(u'true')
+        nt.assert_equal(db.Notify_Channel_Version.version(ORGANIZATION_ID), 2)
+
+    def test_unknown_organization(self):
+        nt.assert_raises(toolkit.ObjectNotFound, self._show, u'unknown')
+        nt.assert_raises(toolkit.ObjectNotFound, self._update, u'true', u'unknown')
+
+    def test_organization_is_required(self):
+        nt.assert_raises(toolkit.ValidationError, self._show, u'')
+        nt.assert_raises(toolkit.ValidationError, self._update, u'true', u'')
+
+
+class TestSearchChannels(object):
+
+    ADDRESSES = [u'ops@example.org', u'100%_done@example.org', u'100x_done@example.org', u'team@example.org']
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+
+        created = datetime.datetime(2017, 3, 1)
+        self.engine.execute(database.table('notify_channels').insert(), [
+            {'id': u'e{0}'.format(i), 'organization_id': ORGANIZATION_ID, 'type': u'email', 'address': address,
+             'created': created + datetime.timedelta(minutes=i)}
+            for i, address in enumerate(self.ADDRESSES)
+        ] + [{'id': u's0', 'organization_id': ORGANIZATION_ID, 'type': u'slack', 'address': SLACK.address,
+              'slack_channel': u'ops'},
+             {'id': u'o0', 'organization_id': u'other-id', 'type': u'email', 'address': u'ops@example.org'}])
+
+        self.cached = mock.patch.object(actions, '_organization_channels', return_value=(EMAIL,))
+        self.cached.start()
+
+    def teardown(self):
+        self.cached.stop()
+        self.database.__exit__(None, None, None)
+
+    def _search(self, **data_dict):
+        return [channel.address for channel in
+                actions._search_channels(ORGANIZATION_ID, constants.CHANNEL_TYPE_EMAIL, data_dict)]
+
+    def test_whole_list_comes_from_the_cache(self):
+        nt.assert_equal(self._search(), [EMAIL.address])
+        nt.assert_equal(self._search(q=u'  ', limit=u''), [EMAIL.address])
+
+    def test_pages_are_ordered_by_creation(self):
+        nt.assert_equal(self._search(limit=2), self.ADDRESSES[:2])
+        nt.assert_equal(self._search(limit=2, offset=2), self.ADDRESSES[2:])
+        nt.assert_equal(self._search(offset=3), self.ADDRESSES[3:])
+        nt.assert_equal(self._search(limit=2, offset=4), [])
+
+    def test_search_ignores_case(self):
+        nt.assert_equal(self._search(q=u'OPS'), [u'ops@example.org'])
+
+    def test_wildcards_are_matched_literally(self):
+        nt.assert_equal(self._search(q=u'%_'), [u'100%_done@example.org'])
+        nt.assert_equal(self._search(q=u'x_'), [u'100x_done@example.org'])
+        nt.assert_equal(self._search(q=u'%'), [u'100%_done@example.org'])
+        nt.assert_equal(self._search(q=u'0_'), [])
+
+    def test_limit_is_capped(self):
+        with mock.patch.object(actions.db.Channel, 'search', return_value=[]) as search:
+            self._search(limit=constants.CHANNELS_LIMIT + 1)
+
+        nt.assert_equal(search.call_args[0][3], constants.CHANNELS_LIMIT)
+
+    def test_invalid_limit_and_offset(self):
+        for data_dict in ({'limit': u'0'}, {'limit': u'ten'}, {'offset': u'-1'}, {'offset': u'first'}):
+            nt.assert_raises(toolkit.ValidationError, self._search, **data_dict)
@@ -0,0 +1,106 @@
+"""Tests for auth.py."""
+import mock
+import nose.tools as nt
+
+import ckan.model as model
+import ckanext.notify.auth as auth
+
+
+ORGANIZATION_ID = u'org-id'
+
+
+def _user(id=u'user-id', sysadmin=False):
+    return mock.Mock(id=id, sysadmin=sysadmin)
+
+
+class TestManageNotifications(object):
+
+    def setup(self):
+        # The memberships of (user id, organization id) which can manage the organization
+        self.members = set([(u'user-id', ORGANIZATION_ID)])
+        self.queries = []
+
+        def query(*args):
+            filters = []
+            chain = mock.MagicMock()
+            chain.autoflush.return_value = chain
+            chain.filter.side_effect = lambda criterion: filters.append(criterion) or chain
+            chain.first.side_effect = lambda: self._first(filters)
+            self.queries.append(filters)
+            return chain
+
+        self.user_id = None
+        self.patches = [
+            mock.patch.object(model.Session, 'query', side_effect=query),
+            mock.patch.object(auth.organizations, 'resolve',
+                              side_effect=lambda name: {u'org': ORGANIZATION_ID, u'other': u'other-id'}.get(name)),
+            mock.patch.object(auth.authz, 'get_roles_with_permission', return_value=['admin']),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def _first(self, filters):
+        # The organization and the user are compared through the criteria built by the query
+        values = [criterion.right.value for criterion in filters[:3]]
+        if (values[2], values[0]) in self.members:
+            return (u'member-id',)
+        return None
+
+    def _check(self, context, organization_id=u'org'):
+        return auth.manage_notifications(context, {'organization_id': organization_id})['success']
+
+    def test_members_who_manage_the_organization(self):
+        nt.assert_true(self._check({'auth_user_obj': _user()}))
+        nt.assert_false(self._check({'auth_user_obj': _user(u'someone-else')}))
+        nt.assert_false(self._check({'auth_user_obj': _user()}, u'other'))
+
+    def test_unknown_organization_is_not_looked_up(self):
+        nt.assert_false(self._check({'auth_user_obj': _user()}, u'unknown'))
+        nt.assert_equal(self.queries, [])
+
+    def test_sysadmins_are_not_looked_up(self):
+        nt.assert_true(self._check({'auth_user_obj': _user(sysadmin=True)}, u'other'))
+        nt.assert_equal(self.queries, [])
+
+    def test_anonymous_users(self):
+        nt.assert_false(self._check({'user': u''}))
+
+    def test_decisions_are_memoized_for_the_request(self):
+        context = {'auth_user_obj': _user()}
+
+        for i in range(3):
+            nt.assert_true(self._check(context))
+            # Looked up by name or by id, it is the same organization
+            nt.assert_true(self._check(context, ORGANIZATION_ID))
+        nt.assert_false(self._check(context, u'other'))
+
+        nt.assert_equal(len(self.queries), 2)
+
+    def test_decisions_are_not_shared_between_requests(self):
+        self._check({'auth_user_obj': _user()})
+        self.members.clear()
+
+        nt.assert_false(self._check({'auth_user_obj': _user()}))
+        nt.assert_equal(len(self.queries), 2)
+
+    def test_decisions_are_not_shared_between_users(self):
+        context = {'auth_user_obj': _user()}
+        self._check(context)
+
+        context['auth_user_obj'] = _user(u'someone-else')
+
+        nt.assert_false(self._check(context))
+
+    def test_user_is_kept_in_the_context(self):
+        context = {'user': u'name'}
+
+        with mock.patch.object(model.User, 'get', return_value=_user()) as get:
+            self._check(context)
+            self._check(context)
+
+        get.assert_called_once_with(u'name')
+        nt.assert_equal(context['auth_user_obj'].id, u'user-id')
@@ -0,0 +1,118 @@
+"""Tests for breaker.py."""
+import datetime
+
+import nose.tools as nt
+
+import ckanext.notify.breaker as breaker
+import ckanext.notify.db as db
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.retry as retry
+
+from ckanext.notify.tests import database
+
+
+CHANNEL = db.ChannelRecord(u'channel', u'org', u'slack', u'https://hooks.slack.com/services/T/B/X', u'')
+
+
+def _fail(error, attempt=1):
+    _, _, tracked = breaker.allow(u'slack', [CHANNEL])
+    breaker.record(u'slack', [dispatcher.Result(CHANNEL, False, None, error)], tracked, attempt)
+
+
+def _succeed():
+    allowed, _, tracked = breaker.allow(u'slack', [CHANNEL])
+    breaker.record(u'slack', [dispatcher.Result(channel, True, 200, None) for channel in allowed], tracked)
+
+
+def _status():
+    return breaker.statuses([CHANNEL.id])[CHANNEL.id]
+
+
+class TestBreaker(object):
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+
+    def teardown(self):
+        self.database.__exit__(None, None, None)
+
+    def _cool_down(self):
+        # As if the circuit had been opened before the cooldown
+        opened_at = datetime.datetime.utcnow() - breaker._cooldown() - datetime.timedelta(seconds=1)
+        self.engine.execute(database.table('notify_channel_health').update().values(opened_at=opened_at))
+
+    def test_opens_after_the_threshold(self):
+        for i in range(breaker._threshold() - 1):
+            _fail(ValueError('400'))
+            nt.assert_equal(_status(), breaker.CLOSED)
+
+        _fail(ValueError('400'))
+        nt.assert_equal(_status(), breaker.OPEN)
+
+        allowed, skipped, _ = breaker.allow(u'slack', [CHANNEL])
+        nt.assert_equal((allowed, skipped), ([], [CHANNEL]))
+
+    def test_successful_trial_closes(self):
+        for i in range(breaker._threshold()):
+            _fail(ValueError('400'))
+        self._cool_down()
+
+        allowed, skipped, tracked = breaker.allow(u'slack', [CHANNEL])
+        nt.assert_equal(allowed, [CHANNEL])
+        nt.assert_equal(tracked[CHANNEL.id], breaker.HALF_OPEN)
+        nt.assert_equal(_status(), breaker.HALF_OPEN)
+
+        # A single trial is let through
+        nt.assert_equal(breaker.allow(u'slack', [CHANNEL])[1], [CHANNEL])
+
+        breaker.record(u'slack', [dispatcher.Result(CHANNEL, True, 200, None)], tracked)
+        nt.assert_equal(_status(), breaker.CLOSED)
+        nt.assert_equal(breaker.allow(u'slack', [CHANNEL])[0], [CHANNEL])
+
+    def test_failed_trial_opens_again(self):
+        for i in range(breaker._threshold()):
+            _fail(ValueError('400'))
+        self._cool_down()
+
+        # Even a failure which is going to be retried
+        _fail(retry.RetryableError('503'))
+        nt.assert_equal(_status(), breaker.OPEN)
+
+    def test_success_resets_the_failures(self):
+        for i in range(breaker._threshold() - 1):
+            _fail(ValueError('400'))
+        _succeed()
+        _fail(ValueError('400'))
+
+        nt.assert_equal(_status(), breaker.CLOSED)
+
+    def test_gone_endpoints_are_suspended(self):
+        _fail(breaker.EndpointGone('404 no_team'))
+        nt.assert_equal(_status(), breaker.SUSPENDED)
+
+        # The cooldown does not bring them back
+        self._cool_down()
+        allowed, skipped, _ = breaker.allow(u'slack', [CHANNEL])
+        nt.assert_equal((allowed, skipped), ([], []))
+
+        breaker.reenable([CHANNEL.id])
+        nt.assert_equal(_status(), breaker.CLOSED)
+
+    def test_retried_failures_count_on_the_last_attempt(self):
+        for attempt in range(1, retry.max_attempts()):
+            _fail(retry.RetryableError('503'), attempt)
+        nt.assert_equal(db.Notify_Channel_Health.states([CHANNEL.id]), {})
+
+        _fail(retry.RetryableError('503'), retry.max_attempts())
+        nt.assert_equal(db.Notify_Channel_Health.states([CHANNEL.id])[CHANNEL.id]['failures'], 1)
+
+    def test_deferred_deliveries_never_count(self):
+        for i in range(breaker._threshold()):
+            _fail(retry.Deferred('Paced', retry_after=1), retry.max_attempts())
+        nt.assert_equal(db.Notify_Channel_Health.states([CHANNEL.id]), {})
+
+    def test_state_changes_bump_the_version(self):
+        before = db.Notify_Channel_Version.version(CHANNEL.organization_id)
+        _fail(breaker.EndpointGone('410'))
+        nt.assert_equal(db.Notify_Channel_Version.version(CHANNEL.organization_id), before + 1)
@@ -0,0 +1,148 @@
+"""Tests for bulk.py and the bulk registration actions, on SQLite."""
+import json
+
+import mock
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckan.plugins.toolkit as toolkit
+import ckanext.notify.actions as actions
+import ckanext.notify.bulk as bulk
+
+from ckanext.notify.tests import database
+
+
+WEBHOOK = u'https://hooks.slack.com/services/T00/B00/XXX'
+
+ORGANIZATIONS = {u'org': u'org-id', u'org-id': u'org-id', u'other': u'other-id', u'other-id': u'other-id'}
+
+
+def _slack(organization_id=u'org', webhook_url=WEBHOOK, slack_channel=u'general'):
+    return {'type': u'slack', 'organization_id': organization_id, 'webhook_url': webhook_url,
+            'slack_channel': slack_channel}
+
+
+def _email(organization_id=u'org', email=u'a@example.org'):
+    return {'type': u'email', 'organization_id': organization_id, 'email': email}
+
+
+def _resolve_many(names_or_ids):
+    return dict((name_or_id, ORGANIZATIONS[name_or_id]) for name_or_id in names_or_ids if name_or_id in ORGANIZATIONS)
+
+
+class TestParse(object):
+
+    def test_json_list(self):
+        nt.assert_equal(bulk.parse(json.dumps([_email()]), 'json'), [_email()])
+
+    def test_json_object(self):
+        nt.assert_equal(bulk.parse(json.dumps({'channels': [_email()]}), 'json'), [_email()])
+
+    def test_csv(self):
+        data = u'type,organization_id,webhook_url,slack_channel,email\n' \
+               u'slack,org,{0},general,\nemail,org,,,a@example.org\n'.format(WEBHOOK)
+
+        rows = bulk.parse(data, 'csv')
+
+        nt.assert_equal([row['type'] for row in rows], ['slack', 'email'])
+        nt.assert_equal(rows[0]['webhook_url'], WEBHOOK)
+        nt.assert_equal(rows[1]['email'], 'a@example.org')
+
+    def test_invalid(self):
+        for data, format in ((u'[', 'json'), (u'{"channels": 1}', 'json'), (u'"text"', 'json'), (u'[]', 'xml')):
+            nt.assert_raises(toolkit.ValidationError, bulk.parse, data, format)
+
+
+class TestBulkRegister(object):
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+        self.session = sa.orm.sessionmaker(bind=self.engine)()
+
+        def check_access(name, context, data_dict):
+            if data_dict['organization_id'] == u'other':
+                raise toolkit.NotAuthorized()
+
+        self.patches = [
+            mock.patch.object(actions.toolkit, 'check_access', side_effect=check_access),
+            mock.patch.object(bulk.organizations, 'resolve_many', side_effect=_resolve_many),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.session.close()
+        self.database.__exit__(None, None, None)
+
+    def _register(self, channels):
+        return actions.channels_bulk_register({'session': self.session}, {'channels': channels})
+
+    def _stored(self):
+        table = database.table('notify_channels')
+        rows = self.engine.execute(sa.select([table.c.organization_id, table.c.type, table.c.address,
+                                              table.c.slack_channel]).order_by(table.c.address))
+        return [tuple(row) for row in rows]
+
+    def test_valid_channels_are_registered_by_organization_id(self):
+        result = self._register([_slack(slack_channel=u'General'), _email()])
+
+        nt.assert_equal(result['errors'], [])
+        nt.assert_equal(len(result['channels']), 2)
+        nt.assert_equal(self._stored(), [
+            (u'org-id', u'email', u'a@example.org', u''),
+            # Lowercase, as the form stores them
+            (u'org-id', u'slack', WEBHOOK, u'general'),
+        ])
+
+    def test_row_errors(self):
+        result = self._register([
+            _email(),
+            u'not an object',
+            dict(_email(email=u'b@example.org'), type=u'sms'),
+            _email(organization_id=u'', email=u'c@example.org'),
+            _email(organization_id=u'other', email=u'd@example.org'),
+            _slack(webhook_url=u'http://example.org'),
+            _email(email=u'not an email'),
+            # Duplicate of the first row
+            _email(),
+        ])
+
+        nt.assert_equal([error['row'] for error in result['errors']], [2, 3, 4, 5, 6, 7, 8])
+        # The valid row is registered anyway
+        nt.assert_equal(self._stored(), [(u'org-id', u'email', u'a@example.org', u'')])
+
+    def test_unknown_organization(self):
+        with mock.patch.object(actions.toolkit, 'check_access'):
+            result = self._register([_email(organization_id=u'unknown')])
+
+        nt.assert_equal(result['errors'][0]['row'], 1)
+        nt.assert_equal(self._stored(), [])
+
+    def test_registered_channels_are_rejected(self):
+        self._register([_slack(slack_channel=u'general')])
+
+        result = self._register([_slack(slack_channel=u'GENERAL'), _slack(slack_channel=u'random')])
+
+        nt.assert_equal([error['row'] for error in result['errors']], [1])
+        nt.assert_equal(len(self._stored()), 2)
+
+    def test_batch_size_is_limited(self):
+        with mock.patch.object(bulk, 'max_rows', return_value=1):
+            nt.assert_raises(toolkit.ValidationError, self._register, [_email(), _email(email=u'b@example.org')])
+
+    def test_empty_batch(self):
+        nt.assert_raises(toolkit.ValidationError, self._register, [])
+
+    def test_import_csv(self):
+        data = u'type,organization_id,email\nemail,org,a@example.org\nemail,org,invalid\n'
+
+        result = actions.channels_import({'session': self.session}, {'data': data, 'format': 'csv'})
+
+        nt.assert_equal([error['row'] for error in result['errors']], [2])
+        nt.assert_equal(self._stored(), [(u'org-id', u'email', u'a@example.org', u'')])
+
+    def test_import_requires_data(self):
+        nt.assert_raises(toolkit.ValidationError, actions.channels_import, {'session': self.session}, {})
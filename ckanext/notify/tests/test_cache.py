@@ -0,0 +1,122 @@
+"""Tests for cache.py."""
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckan.tests.helpers as helpers
+import ckanext.notify.cache as cache
+import ckanext.notify.db as db
+
+from ckanext.notify.tests import database
+
+
+class TestLRUCache(object):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        lru = cache.LRUCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        nt.assert_equal((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        nt.assert_equal(lru.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        lru = cache.LRUCache(2, 60)
+        lru.set('a', 1)
+
+        with mock.patch.object(cache.time, 'time', return_value=time.time() + 61):
+            nt.assert_is_none(lru.get('a'))
+
+
+class TestCoherence(object):
+    '''
+    Two processes sharing a database: the writer changes the channels of an
+    organization in a transaction, the reader has them cached.
+    '''
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        url = 'sqlite:///' + os.path.join(self.directory, 'notify.sqlite')
+        self.writer = database.create_engine(url)
+        self.reader = sa.create_engine(url)
+        self.reader_cache = cache.LRUCache(10, 3600)
+        self.loads = []
+
+    def teardown(self):
+        self.writer.dispose()
+        self.reader.dispose()
+        shutil.rmtree(self.directory)
+
+    def _load(self, organization_id):
+        self.loads.append(organization_id)
+        return {u'slack': (len(self.loads),)}
+
+    def _read(self):
+        with mock.patch.object(model.meta, 'engine', self.reader), \
+                mock.patch.object(cache, '_cache', self.reader_cache):
+            return cache.get_channels(u'org', self._load)
+
+    def test_reader_reloads_once_the_change_is_committed(self):
+        nt.assert_equal(self._read(), {u'slack': (1,)})
+        nt.assert_equal(self._read(), {u'slack': (1,)})
+        nt.assert_equal(len(self.loads), 1)
+
+        session = sa.orm.sessionmaker(bind=self.writer)()
+        try:
+            with mock.patch.object(model.meta, 'engine', self.writer):
+                db.Notify_Channel_Version.bump(session, [u'org'])
+
+            # Not committed yet, the cached channels are still current
+            nt.assert_equal(self._read(), {u'slack': (1,)})
+            nt.assert_equal(len(self.loads), 1)
+
+            session.commit()
+        finally:
+            session.close()
+
+        nt.assert_equal(self._read(), {u'slack': (2,)})
+        nt.assert_equal(self._read(), {u'slack': (2,)})
+        nt.assert_equal(len(self.loads), 2)
+        nt.assert_equal(self.reader_cache.stats()['stale'], 1)
+
+    def test_rolled_back_changes_keep_the_cache(self):
+        self._read()
+
+        session = sa.orm.sessionmaker(bind=self.writer)()
+        try:
+            with mock.patch.object(model.meta, 'engine', self.writer):
+                db.Notify_Channel_Version.bump(session, [u'org'])
+            session.rollback()
+        finally:
+            session.close()
+
+        self._read()
+        nt.assert_equal(len(self.loads), 1)
+
+    @helpers.change_config('ckanext.notify.cache.check_interval', '60')
+    def test_check_interval_trusts_the_cache(self):
+        self._read()
+
+        session = sa.orm.sessionmaker(bind=self.writer)()
+        try:
+            with mock.patch.object(model.meta, 'engine', self.writer):
+                db.Notify_Channel_Version.bump(session, [u'org'])
+            session.commit()
+        finally:
+            session.close()
+
+        self._read()
+        nt.assert_equal(len(self.loads), 1)
+
+        # Seen once the interval has passed
+        with mock.patch.object(cache.time, 'time', return_value=time.time() + 61):
+            self._read()
+        nt.assert_equal(len(self.loads), 2)
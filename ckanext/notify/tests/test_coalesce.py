@@ -0,0 +1,80 @@
+"""Tests for coalesce.py."""
+import mock
+import nose.tools as nt
+
+import ckanext.notify.coalesce as coalesce
+import ckanext.notify.db as db
+import ckanext.notify.delivery as delivery
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.renderer as renderer
+
+
+CHANNELS = [db.ChannelRecord(u'1', u'org', u'slack', u'https://hooks.slack.com/services/T/B/X', u'')]
+
+
+def _event(title):
+    return {'datarequest_title': title, 'datarequest_description': title + ' description',
+            'datarequest_url': 'http://example.org/datarequest/' + title}
+
+
+class TestCoalesce(object):
+
+    def setup(self):
+        self.patches = [
+            mock.patch.object(dispatcher, 'dispatch_later'),
+            mock.patch.object(delivery, 'send_slack'),
+            mock.patch.object(renderer, 'slack_message', side_effect=lambda template, extra_vars: (template, extra_vars)),
+            mock.patch.dict(coalesce._pending, clear=True),
+        ]
+        self.dispatch_later, self.send_slack, self.slack_message, _ = [patch.start() for patch in self.patches]
+        self.key = (u'slack', u'org')
+
+    def teardown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_events_are_sent_together(self):
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_create', _event('first'), event_key='1')
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_close', _event('second'), event_key='2')
+
+        # A single flush is scheduled, for the first event
+        nt.assert_equal(self.dispatch_later.call_count, 1)
+        args, kwargs = self.dispatch_later.call_args
+        nt.assert_equal(args[1:], (coalesce.flush, (self.key,)))
+        nt.assert_false(self.send_slack.called)
+
+        coalesce.flush(self.key)
+
+        nt.assert_equal(self.send_slack.call_count, 1)
+        args, kwargs = self.send_slack.call_args
+        template, extra_vars = args[1]
+        nt.assert_equal(template, 'digest')
+        nt.assert_equal([event['template'] for event in extra_vars['events']], ['datarequest_create', 'datarequest_close'])
+        nt.assert_equal(extra_vars['events'][1]['datarequest_description'], 'second description')
+        nt.assert_equal(kwargs['event_key'], coalesce.idempotency.combine(['1', '2']))
+
+        # Nothing is left to send
+        coalesce.flush(self.key)
+        nt.assert_equal(self.send_slack.call_count, 1)
+
+    def test_duplicated_events_are_ignored(self):
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_create', _event('first'), event_key='1')
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_create', _event('first'), event_key='1')
+        coalesce.flush(self.key)
+
+        args, kwargs = self.send_slack.call_args
+        template, extra_vars = args[1]
+        # A single event keeps its own template
+        nt.assert_equal(template, 'datarequest_create')
+
+    def test_abandoned_batches_are_sent(self):
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_create', _event('first'))
+        self.dispatch_later.call_args[1]['on_abandon']()
+
+        nt.assert_equal(self.send_slack.call_count, 1)
+
+    def test_organizations_are_batched_apart(self):
+        coalesce.add(u'slack', u'org', CHANNELS, 'datarequest_create', _event('first'))
+        coalesce.add(u'slack', u'other', CHANNELS, 'datarequest_create', _event('second'))
+
+        nt.assert_equal(self.dispatch_later.call_count, 2)
@@ -0,0 +1,63 @@
+"""Tests for the channel records of db.py."""
+import datetime
+
+import nose.tools as nt
+
+import ckanext.notify.db as db
+
+from ckanext.notify.tests import database
+
+
+WEBHOOK = u'https://hooks.slack.com/services/T00/B00/XXX'
+
+
+class TestChannelRecord(object):
+
+    def test_from_dict_of_a_record(self):
+        record = db.ChannelRecord(u'id', u'org-id', u'slack', WEBHOOK, u'general')
+
+        nt.assert_equal(db.ChannelRecord.from_dict(u'slack', record._asdict()), record)
+
+    def test_from_dict_of_the_show_actions(self):
+        # Stored in dead letters before the records were introduced
+        slack = db.ChannelRecord.from_dict(u'slack', {'id': u'1', 'organization_id': u'org-id',
+                                                      'webhook_url': WEBHOOK, 'slack_channel': u'general'})
+        email = db.ChannelRecord.from_dict(u'email', {'id': u'2', 'organization_id': u'org-id',
+                                                      'email': u'a@example.org', 'slack_channel': None})
+
+        nt.assert_equal(slack, (u'1', u'org-id', u'slack', WEBHOOK, u'general'))
+        nt.assert_equal(email, (u'2', u'org-id', u'email', u'a@example.org', u''))
+
+    def test_records_are_immutable(self):
+        record = db.ChannelRecord(u'id', u'org-id', u'email', u'a@example.org', u'')
+
+        nt.assert_raises(AttributeError, setattr, record, 'address', u'b@example.org')
+
+
+class TestRecords(object):
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+
+        created = datetime.datetime(2017, 3, 1)
+        self.engine.execute(database.table('notify_channels').insert(), [
+            {'id': u'b', 'organization_id': u'org-id', 'type': u'email', 'address': u'a@example.org',
+             'created': created + datetime.timedelta(minutes=1)},
+            {'id': u'a', 'organization_id': u'org-id', 'type': u'slack', 'address': WEBHOOK,
+             'slack_channel': u'general', 'created': created + datetime.timedelta(minutes=2)},
+            {'id': u'c', 'organization_id': u'other-id', 'type': u'email', 'address': u'b@example.org',
+             'created': created},
+        ])
+
+    def teardown(self):
+        self.database.__exit__(None, None, None)
+
+    def test_records_of_an_organization_in_creation_order(self):
+        nt.assert_equal(db.Channel.records(u'org-id'), [
+            db.ChannelRecord(u'b', u'org-id', u'email', u'a@example.org', u''),
+            db.ChannelRecord(u'a', u'org-id', u'slack', WEBHOOK, u'general'),
+        ])
+
+    def test_organization_without_channels(self):
+        nt.assert_equal(db.Channel.records(u'unknown'), [])
@@ -0,0 +1,105 @@
+"""Tests for delivery.py."""
+import smtplib
+import socket
+
+import mock
+import nose.tools as nt
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.breaker as breaker
+import ckanext.notify.db as db
+import ckanext.notify.delivery as delivery
+import ckanext.notify.retry as retry
+
+
+def _channels(count):
+    return [db.ChannelRecord(u'email-{0}'.format(i), u'org', u'email', u'{0}@example.org'.format(i), u'')
+            for i in range(count)]
+
+
+class TestSMTPError(object):
+
+    def test_unknown_recipient_is_gone(self):
+        for code in (550, 551, 553):
+            error = smtplib.SMTPRecipientsRefused({'a@example.org': (code, 'No such user')})
+            nt.assert_is_instance(delivery._smtp_error(error), breaker.EndpointGone)
+
+    def test_temporary_recipient_refusal_is_retried(self):
+        error = smtplib.SMTPRecipientsRefused({'a@example.org': (452, 'Mailbox full')})
+        nt.assert_is_instance(delivery._smtp_error(error), retry.RetryableError)
+
+    def test_refused_sender_is_not_gone(self):
+        error = smtplib.SMTPSenderRefused(550, 'Sender rejected', 'ckan@example.org')
+        nt.assert_is(delivery._smtp_error(error), error)
+
+    def test_refused_message_is_not_gone(self):
+        error = smtplib.SMTPDataError(553, 'Message rejected')
+        nt.assert_is(delivery._smtp_error(error), error)
+
+    def test_relay_error_is_not_gone(self):
+        error = smtplib.SMTPResponseException(550, 'Relaying denied')
+        nt.assert_is(delivery._smtp_error(error), error)
+
+    def test_refusal_of_several_recipients_is_not_gone(self):
+        error = smtplib.SMTPRecipientsRefused({'a@example.org': (550, 'No such user'),
+                                               'b@example.org': (550, 'No such user')})
+        nt.assert_is(delivery._smtp_error(error), error)
+
+    def test_temporary_errors_are_retried(self):
+        for error in (smtplib.SMTPSenderRefused(451, 'Try later', 'ckan@example.org'),
+                      smtplib.SMTPDataError(421, 'Try later'),
+                      smtplib.SMTPServerDisconnected('Connection lost'),
+                      socket.error('Connection refused')):
+            nt.assert_is_instance(delivery._smtp_error(error), retry.RetryableError)
+
+
+class TestSendEmailBcc(object):
+
+    def setup(self):
+        self.session = mock.Mock()
+        self.session.send_bcc.return_value = {}
+
+    def _recipients(self):
+        return [call[0][0] for call in self.session.send_bcc.call_args_list]
+
+    @helpers.change_config('ckanext.notify.smtp.max_recipients', '2')
+    def test_recipients_are_sent_in_chunks(self):
+        channels = _channels(5)
+        results = delivery._send_email_bcc(self.session, channels, u'Subject', u'Body')
+
+        nt.assert_equal(self._recipients(), [[u'0@example.org', u'1@example.org'],
+                                             [u'2@example.org', u'3@example.org'], [u'4@example.org']])
+        nt.assert_equal([result.item for result in results], channels)
+        nt.assert_true(all(result.success for result in results))
+
+    def test_refused_recipients_fail_alone(self):
+        self.session.send_bcc.return_value = {u'1@example.org': (550, 'No such user'),
+                                              u'2@example.org': (452, 'Mailbox full')}
+
+        results = delivery._send_email_bcc(self.session, _channels(3), u'Subject', u'Body')
+
+        nt.assert_equal([result.success for result in results], [True, False, False])
+        nt.assert_is_instance(results[1].error, breaker.EndpointGone)
+        nt.assert_is_instance(results[2].error, retry.RetryableError)
+
+    def test_every_recipient_refused_is_judged_alone(self):
+        self.session.send_bcc.side_effect = smtplib.SMTPRecipientsRefused({
+            u'0@example.org': (550, 'No such user'),
+            u'1@example.org': (452, 'Mailbox full'),
+        })
+
+        results = delivery._send_email_bcc(self.session, _channels(2), u'Subject', u'Body')
+
+        nt.assert_is_instance(results[0].error, breaker.EndpointGone)
+        nt.assert_is_instance(results[1].error, retry.RetryableError)
+
+    @helpers.change_config('ckanext.notify.smtp.max_recipients', '2')
+    def test_failed_chunk_does_not_stop_the_others(self):
+        self.session.send_bcc.side_effect = [smtplib.SMTPSenderRefused(550, 'Sender rejected', 'ckan@example.org'),
+                                             {}]
+
+        results = delivery._send_email_bcc(self.session, _channels(3), u'Subject', u'Body')
+
+        nt.assert_equal([result.success for result in results], [False, False, True])
+        # Not the fault of the recipients, none of them is suspended
+        nt.assert_false(any(isinstance(result.error, breaker.EndpointGone) for result in results))
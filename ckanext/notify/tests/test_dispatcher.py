@@ -0,0 +1,163 @@
+"""Tests for dispatcher.py."""
+import threading
+import time
+
+import mock
+import nose.tools as nt
+
+import ckanext.notify.dispatcher as dispatcher
+
+
+class TestFanOut(object):
+
+    def test_results_keep_the_order_of_the_items(self):
+        # The first items are the slowest, so they finish last
+        def slow(item):
+            time.sleep((5 - item) * 0.01)
+            return item * 10
+
+        results = dispatcher.fan_out(slow, range(5), concurrency=5)
+
+        nt.assert_equal([result.item for result in results], range(5))
+        nt.assert_equal([result.value for result in results], [0, 10, 20, 30, 40])
+        nt.assert_true(all(result.success for result in results))
+
+    def test_errors_are_reported_per_item(self):
+        def fail_odd(item):
+            if item % 2:
+                raise ValueError(item)
+            return item
+
+        for concurrency in (1, 4):
+            results = dispatcher.fan_out(fail_odd, range(4), concurrency=concurrency)
+
+            nt.assert_equal([result.success for result in results], [True, False, True, False])
+            nt.assert_equal([result.value for result in results], [0, None, 2, None])
+            nt.assert_is_instance(results[1].error, ValueError)
+            nt.assert_equal(results[3].error.args, (3,))
+
+    def test_extra_arguments_are_passed(self):
+        results = dispatcher.fan_out(lambda item, suffix: item + suffix, ['a', 'b'], '!', concurrency=2)
+        nt.assert_equal([result.value for result in results], ['a!', 'b!'])
+
+    def test_no_items(self):
+        nt.assert_equal(dispatcher.fan_out(lambda item: item, [], concurrency=4), [])
+
+
+class TestDispatcher(object):
+
+    def test_full_queue_refuses_jobs(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        pool = dispatcher.Dispatcher(workers=1, queue_size=1, shutdown_timeout=5)
+        try:
+            nt.assert_true(pool.submit(block))
+            nt.assert_true(started.wait(5))
+            # The worker is busy, the queue holds one more job
+            nt.assert_true(pool.submit(lambda: None))
+            nt.assert_false(pool.submit(lambda: None))
+            nt.assert_equal(pool.depth(), 1)
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_dispatch_runs_inline_when_the_queue_is_full(self):
+        pool = mock.Mock()
+        pool.submit.return_value = False
+        calls = []
+
+        with mock.patch.object(dispatcher, 'is_enabled', return_value=True), \
+                mock.patch.object(dispatcher, 'get_dispatcher', return_value=pool):
+            dispatcher.dispatch(lambda value: calls.append((value, threading.current_thread())), 'event')
+
+        nt.assert_equal(calls, [('event', threading.current_thread())])
+
+    def test_shutdown_drains_the_queue(self):
+        done = []
+        lock = threading.Lock()
+
+        def job(number):
+            time.sleep(0.01)
+            with lock:
+                done.append(number)
+
+        pool = dispatcher.Dispatcher(workers=2, queue_size=10, shutdown_timeout=5)
+        for number in range(6):
+            nt.assert_true(pool.submit(job, number))
+        pool.shutdown()
+
+        nt.assert_equal(sorted(done), range(6))
+        nt.assert_equal(pool.depth(), 0)
+
+    def test_jobs_run_in_background(self):
+        seen = []
+        pool = dispatcher.Dispatcher(workers=1, queue_size=10, shutdown_timeout=5)
+        pool.submit(lambda: seen.append(dispatcher.in_background()))
+        pool.shutdown()
+
+        nt.assert_equal(seen, [True])
+        nt.assert_false(dispatcher.in_background())
+
+
+class TestScheduler(object):
+
+    def test_shutdown_abandons_waiting_jobs(self):
+        abandoned = []
+        scheduler = dispatcher.Scheduler()
+        scheduler.schedule(60, lambda: None, (), {}, lambda: abandoned.append(1))
+        scheduler.schedule(60, lambda: None, (), {}, lambda: abandoned.append(2))
+
+        scheduler.shutdown()
+
+        nt.assert_equal(sorted(abandoned), [1, 2])
+        nt.assert_equal(scheduler.pending(), 0)
+
+    def test_jobs_are_handed_to_the_workers(self):
+        pool = dispatcher.Dispatcher(workers=1, queue_size=10, shutdown_timeout=5)
+        scheduler = dispatcher.Scheduler()
+        done = threading.Event()
+        seen = []
+
+        def job():
+            seen.append((threading.current_thread().name, dispatcher.in_background()))
+            done.set()
+
+        with mock.patch.object(dispatcher, 'get_dispatcher', return_value=pool):
+            scheduler.schedule(0, job, (), {}, None)
+            done.wait(5)
+
+        scheduler.shutdown()
+        pool.shutdown()
+        nt.assert_equal(seen, [('notify-dispatch-0', True)])
+
+    def test_jobs_are_postponed_while_the_queue_is_full(self):
+        pool = mock.Mock()
+        pool.submit.side_effect = [False, True]
+        scheduler = dispatcher.Scheduler()
+        job = mock.Mock()
+
+        with mock.patch.object(dispatcher, 'get_dispatcher', return_value=pool), \
+                mock.patch.object(dispatcher, '_POSTPONE_DELAY', 0.01):
+            scheduler.schedule(0, job, ('a',), {}, None)
+            time.sleep(0.2)
+
+        scheduler.shutdown()
+        nt.assert_equal(pool.submit.call_count, 2)
+        pool.submit.assert_called_with(job, 'a')
+        # The job itself never runs on the timer thread
+        nt.assert_false(job.called)
+
+    def test_retries_scheduled_while_stopping_are_abandoned(self):
+        abandoned = []
+
+        with mock.patch.object(dispatcher, '_stopping', True), \
+                mock.patch.object(dispatcher, 'get_scheduler') as get_scheduler:
+            dispatcher.dispatch_later(1, lambda: None, on_abandon=lambda: abandoned.append(True))
+
+        nt.assert_equal(abandoned, [True])
+        nt.assert_false(get_scheduler.called)
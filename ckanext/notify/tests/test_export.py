@@ -0,0 +1,168 @@
+"""Tests for export.py and the channel export action and route, on SQLite."""
+import csv
+import json
+import StringIO
+
+import mock
+import nose.tools as nt
+
+import ckan.plugins.toolkit as toolkit
+import ckan.tests.helpers as helpers
+import ckanext.notify.actions as actions
+import ckanext.notify.controllers.ui_controller as ui_controller
+import ckanext.notify.db as db
+import ckanext.notify.export as export
+
+from ckanext.notify.tests import database
+
+
+WEBHOOK = u'https://hooks.slack.com/services/T00/B00/XXX'
+
+
+class _Channels(object):
+    '''Five channels, ordered by id, of both types and two organizations.'''
+
+    def setup(self):
+        self.database = database.engine()
+        self.engine = self.database.__enter__()
+
+        table = database.table('notify_channels')
+        self.engine.execute(table.insert(), [
+            {'id': u'c0', 'organization_id': u'org-id', 'type': u'slack', 'address': WEBHOOK,
+             'slack_channel': u'general'},
+            {'id': u'c1', 'organization_id': u'org-id', 'type': u'email', 'address': u'a@example.org'},
+            {'id': u'c2', 'organization_id': u'other-id', 'type': u'slack', 'address': WEBHOOK,
+             'slack_channel': u'random'},
+            {'id': u'c3', 'organization_id': u'other-id', 'type': u'email', 'address': u'b@example.org'},
+            {'id': u'c4', 'organization_id': u'org-id', 'type': u'email', 'address': u'c@example.org'},
+        ])
+
+        self.page = mock.patch.object(db.Channel, 'page', wraps=db.Channel.page)
+        self.pages = self.page.start()
+
+    def teardown(self):
+        self.page.stop()
+        self.database.__exit__(None, None, None)
+
+
+class TestExport(_Channels):
+
+    @helpers.change_config('ckanext.notify.export.page_size', '2')
+    def test_channels_are_read_a_page_at_a_time(self):
+        channels = export.channels()
+
+        nt.assert_equal([channel.id for channel in channels], [u'c0', u'c1', u'c2', u'c3', u'c4'])
+        # Each page starts after the last id of the previous one
+        nt.assert_equal([call[0][0] for call in self.pages.call_args_list], [None, u'c1', u'c3'])
+
+    @helpers.change_config('ckanext.notify.export.page_size', '2')
+    def test_channels_are_filtered(self):
+        nt.assert_equal([channel.id for channel in export.channels(type=u'email')], [u'c1', u'c3', u'c4'])
+        nt.assert_equal([channel.id for channel in export.channels(organization_id=u'org-id')],
+                        [u'c0', u'c1', u'c4'])
+
+    def test_csv_lines_can_be_imported(self):
+        lines = export.lines('csv', export.channels(type=u'slack'))
+
+        rows = list(csv.DictReader(StringIO.StringIO(''.join(lines))))
+
+        nt.assert_equal([row['id'] for row in rows], ['c0', 'c2'])
+        nt.assert_equal(rows[0]['webhook_url'], WEBHOOK)
+        nt.assert_equal(rows[0]['slack_channel'], 'general')
+        nt.assert_equal(rows[0]['email'], '')
+
+    def test_jsonl_lines(self):
+        lines = list(export.lines('jsonl', export.channels(type=u'email', organization_id=u'other-id')))
+
+        nt.assert_equal([json.loads(line) for line in lines], [{
+            'id': u'c3', 'type': u'email', 'organization_id': u'other-id', 'webhook_url': u'',
+            'slack_channel': u'', 'email': u'b@example.org'}])
+
+    def test_unknown_format(self):
+        nt.assert_raises(toolkit.ValidationError, export.lines, 'xml', [])
+
+
+class TestChannelsExport(_Channels):
+
+    def setup(self):
+        super(TestChannelsExport, self).setup()
+        self.check_access = mock.patch.object(actions.toolkit, 'check_access')
+        self.check_access.start()
+
+    def teardown(self):
+        self.check_access.stop()
+        super(TestChannelsExport, self).teardown()
+
+    def _export(self, **data_dict):
+        return actions.channels_export({}, data_dict)
+
+    def test_pages_are_followed_with_next(self):
+        first = self._export(limit=2)
+        second = self._export(limit=2, after=first['next'])
+        last = self._export(limit=2, after=second['next'])
+
+        nt.assert_equal([[channel['id'] for channel in page['channels']] for page in (first, second, last)],
+                        [[u'c0', u'c1'], [u'c2', u'c3'], [u'c4']])
+        nt.assert_equal([page['next'] for page in (first, second, last)], [u'c1', u'c3', None])
+
+    @helpers.change_config('ckanext.notify.export.page_size', '2')
+    def test_limit_is_capped_by_the_page_size(self):
+        nt.assert_equal(len(self._export(limit=100)['channels']), 2)
+
+    def test_organization_is_resolved(self):
+        with mock.patch.object(export.organizations, 'resolve', return_value=u'other-id'):
+            page = self._export(organization_id=u'other')
+
+        nt.assert_equal([channel['id'] for channel in page['channels']], [u'c2', u'c3'])
+
+    def test_invalid_parameters(self):
+        for data_dict in ({'type': u'sms'}, {'limit': u'many'}, {'limit': u'-1'}):
+            nt.assert_raises(toolkit.ValidationError, self._export, **data_dict)
+
+
+class TestExportRoute(_Channels):
+
+    def setup(self):
+        super(TestExportRoute, self).setup()
+        self.request = mock.Mock(GET={})
+        self.response = mock.Mock(headers={})
+        self.patches = [
+            mock.patch.object(ui_controller, 'request', self.request),
+            mock.patch.object(ui_controller, 'response', self.response),
+            mock.patch.object(ui_controller, 'c'),
+            mock.patch.object(ui_controller.toolkit, 'check_access'),
+        ]
+        self.check_access = [patch.start() for patch in self.patches][-1]
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        super(TestExportRoute, self).teardown()
+
+    @helpers.change_config('ckanext.notify.export.page_size', '2')
+    def test_export_is_streamed(self):
+        lines = ui_controller.DataRequestsNotifyUI().export_channels('jsonl')
+
+        nt.assert_equal(self.response.headers['Content-Type'], export.CONTENT_TYPES['jsonl'])
+        # Nothing is read before the response is iterated
+        nt.assert_false(self.pages.called)
+
+        nt.assert_equal(next(lines), json.dumps(export.dictize(db.Channel.page(None, 1)[0])) + '\n')
+        nt.assert_equal(len(list(lines)), 4)
+
+    def test_export_is_filtered(self):
+        self.request.GET.update({'type': u'slack', 'organization_id': u'org-id'})
+
+        with mock.patch.object(export.organizations, 'resolve', return_value=u'org-id'):
+            lines = list(ui_controller.DataRequestsNotifyUI().export_channels('csv'))
+
+        nt.assert_equal(len(lines), 2)
+        nt.assert_in('c0', lines[1])
+
+    def test_only_sysadmins_export(self):
+        self.check_access.side_effect = toolkit.NotAuthorized()
+
+        with mock.patch.object(ui_controller.toolkit, 'abort', side_effect=Exception) as abort:
+            nt.assert_raises(Exception, ui_controller.DataRequestsNotifyUI().export_channels, 'csv')
+
+        nt.assert_equal(abort.call_args[0][0], 403)
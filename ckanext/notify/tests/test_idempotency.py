@@ -0,0 +1,77 @@
+"""Tests for idempotency.py."""
+import datetime
+
+import nose.tools as nt
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.db as db
+import ckanext.notify.idempotency as idempotency
+
+from ckanext.notify.tests import database
+
+
+def _channel(id, address, type=u'email'):
+    return db.ChannelRecord(id, u'org', type, address, u'')
+
+
+class TestClaim(object):
+
+    def setup(self):
+        self.database = database.engine()
+        self.database.__enter__()
+
+    def teardown(self):
+        self.database.__exit__(None, None, None)
+
+    def test_an_event_is_delivered_once_per_endpoint(self):
+        channels = [_channel(u'1', u'a@example.org'), _channel(u'2', u'b@example.org')]
+
+        nt.assert_equal(idempotency.claim(u'email', channels, 'key'), channels)
+        nt.assert_equal(idempotency.claim(u'email', channels, 'key'), [])
+        # Addresses are compared regardless of case
+        nt.assert_equal(idempotency.claim(u'email', [_channel(u'3', u'A@Example.org')], 'key'), [])
+        # Other events are delivered
+        nt.assert_equal(idempotency.claim(u'email', channels, 'other'), channels)
+
+    def test_events_without_key_are_always_delivered(self):
+        channels = [_channel(u'1', u'a@example.org')]
+
+        nt.assert_equal(idempotency.claim(u'email', channels, None), channels)
+        nt.assert_equal(idempotency.claim(u'email', channels, None), channels)
+
+    @helpers.change_config('ckanext.notify.dedup_retention', '0')
+    def test_disabled(self):
+        channels = [_channel(u'1', u'a@example.org')]
+
+        nt.assert_equal(idempotency.claim(u'email', channels, 'key'), channels)
+        nt.assert_equal(idempotency.claim(u'email', channels, 'key'), channels)
+
+    def test_claims_expire(self):
+        retention = datetime.timedelta(seconds=60)
+        start = datetime.datetime(2020, 1, 1)
+
+        nt.assert_true(db.Notify_Delivery.claim(u'key', start, start - retention))
+        # Within the retention the key is taken
+        later = start + datetime.timedelta(seconds=30)
+        nt.assert_false(db.Notify_Delivery.claim(u'key', later, later - retention))
+        # Once expired it can be claimed again, once
+        expired = start + datetime.timedelta(seconds=61)
+        nt.assert_true(db.Notify_Delivery.claim(u'key', expired, expired - retention))
+        nt.assert_false(db.Notify_Delivery.claim(u'key', expired, expired - retention))
+
+
+class TestEventKey(object):
+
+    def test_created_and_closed_are_identified_by_the_datarequest(self):
+        key = idempotency.event_key('datarequest_create', {'id': 'dr'})
+        nt.assert_equal(key, idempotency.event_key('datarequest_create', {'id': 'dr', 'title': 'changed'}))
+        nt.assert_not_equal(key, idempotency.event_key('datarequest_close', {'id': 'dr'}))
+
+    def test_comments_need_their_id(self):
+        nt.assert_is_none(idempotency.event_key('datarequest_comment', {'id': 'dr'}))
+        nt.assert_not_equal(idempotency.event_key('datarequest_comment', {'id': 'dr', 'comment_id': '1'}),
+                            idempotency.event_key('datarequest_comment', {'id': 'dr', 'comment_id': '2'}))
+
+    def test_combine(self):
+        nt.assert_equal(idempotency.combine(['a', 'b']), idempotency.combine(['b', 'a']))
+        nt.assert_is_none(idempotency.combine(['a', None]))
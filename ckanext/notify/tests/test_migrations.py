@@ -0,0 +1,134 @@
+"""Tests for migrations.py, on SQLite."""
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckanext.notify.migrations as migrations
+
+from ckanext.notify.tests import database
+
+
+def _old_tables(engine, per_type=True):
+    # The organizations of CKAN and the per type channel tables of the first versions
+    metadata = sa.MetaData()
+    groups = sa.Table('group', metadata,
+        sa.Column('id', sa.types.UnicodeText, primary_key=True),
+        sa.Column('name', sa.types.UnicodeText),
+        sa.Column('is_organization', sa.types.Boolean),
+    )
+    slack = sa.Table('org_slack_details', metadata,
+        sa.Column('id', sa.types.UnicodeText, primary_key=True),
+        sa.Column('organization_id', sa.types.UnicodeText),
+        sa.Column('webhook_url', sa.types.UnicodeText),
+        sa.Column('slack_channel', sa.types.UnicodeText),
+    )
+    email = sa.Table('org_email_details', metadata,
+        sa.Column('id', sa.types.UnicodeText, primary_key=True),
+        sa.Column('organization_id', sa.types.UnicodeText),
+        sa.Column('email', sa.types.UnicodeText),
+    )
+    metadata.create_all(engine, tables=[groups, slack, email] if per_type else [groups])
+    return groups, slack, email
+
+
+class TestUpgrade(object):
+
+    def setup(self):
+        self.engine = database.create_engine()
+
+    def teardown(self):
+        self.engine.dispose()
+
+    def test_fresh_install(self):
+        _old_tables(self.engine, per_type=False)
+
+        nt.assert_equal(migrations.current_version(self.engine), 0)
+        applied = migrations.upgrade(self.engine)
+
+        nt.assert_equal(applied, [version for version, _, _ in migrations.MIGRATIONS])
+        nt.assert_equal(migrations.current_version(self.engine), migrations.MIGRATIONS[-1][0])
+        nt.assert_equal(migrations.pending(self.engine), [])
+
+        # Nothing left to apply
+        nt.assert_equal(migrations.upgrade(self.engine), [])
+
+    def test_fresh_install_before_the_ckan_tables(self):
+        # The plugin is loaded by "paster db init", before the organizations of CKAN exist
+        nt.assert_false(migrations.has_core_schema(self.engine))
+
+        applied = migrations.upgrade(self.engine)
+
+        nt.assert_equal(applied, [version for version, _, _ in migrations.MIGRATIONS])
+        nt.assert_equal(migrations.pending(self.engine), [])
+
+    def test_upgrade_from_per_type_tables(self):
+        groups, slack, email = _old_tables(self.engine)
+        self.engine.execute(groups.insert(), [
+            {'id': u'org-1-id', 'name': u'org-1', 'is_organization': True},
+            {'id': u'org-2-id', 'name': u'org-2', 'is_organization': True},
+        ])
+        self.engine.execute(slack.insert(), [
+            {'id': u's1', 'organization_id': u'org-1', 'webhook_url': u'https://hooks.slack.com/services/1',
+             'slack_channel': u'general'},
+            # Duplicates of the racy validator are merged
+            {'id': u's2', 'organization_id': u'org-1', 'webhook_url': u'https://hooks.slack.com/services/1',
+             'slack_channel': u'general'},
+            # Registered without a slack channel by the first versions
+            {'id': u's3', 'organization_id': u'org-1', 'webhook_url': u'https://hooks.slack.com/services/3',
+             'slack_channel': None},
+        ])
+        self.engine.execute(email.insert(), [{'id': u'e1', 'organization_id': u'org-2', 'email': u'a@example.org'}])
+
+        settings = database.table('org_notify_settings')
+        self.engine.execute(settings.insert(), [
+            {'id': u'1', 'organization_id': u'org-1', 'email_bcc': True},
+            # Saved by id, wins over the one saved by name
+            {'id': u'2', 'organization_id': u'org-2-id', 'email_bcc': True},
+            {'id': u'3', 'organization_id': u'org-2', 'email_bcc': False},
+        ])
+        health = database.table('notify_channel_health')
+        self.engine.execute(health.insert(), [{'channel_id': u's1'}, {'channel_id': u'deleted'}])
+
+        migrations.upgrade(self.engine)
+
+        channels = database.table('notify_channels')
+        rows = self.engine.execute(sa.select([channels.c.id, channels.c.organization_id, channels.c.type,
+                                              channels.c.address, channels.c.slack_channel])
+                                   .order_by(channels.c.id)).fetchall()
+        nt.assert_equal([tuple(row) for row in rows], [
+            (u'e1', u'org-2-id', u'email', u'a@example.org', u''),
+            (u's1', u'org-1-id', u'slack', u'https://hooks.slack.com/services/1', u'general'),
+            (u's3', u'org-1-id', u'slack', u'https://hooks.slack.com/services/3', u''),
+        ])
+
+        rows = self.engine.execute(sa.select([settings.c.organization_id, settings.c.email_bcc])
+                                   .order_by(settings.c.organization_id)).fetchall()
+        nt.assert_equal([tuple(row) for row in rows], [(u'org-1-id', True), (u'org-2-id', True)])
+
+        # The caches of the converted organizations are reloaded
+        versions = database.table('notify_channel_versions')
+        rows = self.engine.execute(sa.select([versions.c.organization_id, versions.c.version])
+                                   .order_by(versions.c.organization_id)).fetchall()
+        nt.assert_equal([tuple(row) for row in rows], [(u'org-1-id', 1), (u'org-2-id', 1)])
+
+        nt.assert_equal([row[0] for row in self.engine.execute(sa.select([health.c.channel_id]))], [u's1'])
+
+        # The old tables are kept, to roll back to the previous version
+        nt.assert_equal(self.engine.execute(sa.select([sa.func.count()]).select_from(email)).scalar(), 1)
+
+    def test_duplicates_of_other_organizations_are_not_deleted(self):
+        groups, slack, email = _old_tables(self.engine)
+        self.engine.execute(email.insert(), [
+            {'id': u'e1', 'organization_id': u'org-1', 'email': u'a@example.org'},
+            {'id': u'e2', 'organization_id': u'org-2', 'email': u'a@example.org'},
+        ])
+
+        with nt.assert_raises(migrations.MigrationError) as cm:
+            migrations.upgrade(self.engine)
+
+        nt.assert_in(u'a@example.org', cm.exception.args[0])
+        nt.assert_equal(migrations.current_version(self.engine), 0)
+        nt.assert_equal(self.engine.execute(sa.select([sa.func.count()]).select_from(email)).scalar(), 2)
+
+    def test_reading_the_version_creates_nothing(self):
+        migrations.pending(self.engine)
+        nt.assert_false(migrations._has_table(self.engine, 'notify_migrations'))
@@ -0,0 +1,138 @@
+"""Tests for organizations.py."""
+import os
+import shutil
+import tempfile
+
+import mock
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckanext.notify.organizations as organizations
+import ckanext.notify.plugin as plugin
+
+from ckanext.notify.tests import database
+
+
+ORGANIZATION_ID = u'org-id'
+
+
+def _group(title):
+    group = model.Group(name=u'org', title=title, type=u'organization', is_organization=True)
+    group.id = ORGANIZATION_ID
+    group.state = u'active'
+    return group
+
+
+class TestResolve(object):
+
+    def setup(self):
+        # Active organizations, by id and name
+        self.groups = [(ORGANIZATION_ID, u'org'), (u'other-id', u'other')]
+        self.queries = 0
+
+        def rows(*args):
+            self.queries += 1
+            return iter(self.groups)
+
+        session = mock.MagicMock()
+        query = session.query.return_value.autoflush.return_value
+        query.filter.return_value = query
+        query.__iter__.side_effect = rows
+        self.patch = mock.patch.object(model, 'Session', session)
+        self.patch.start()
+
+        organizations._ids = None
+
+    def teardown(self):
+        self.patch.stop()
+
+    def test_names_and_ids_are_resolved_in_one_query(self):
+        resolved = organizations.resolve_many([u'org', u'other-id', u'unknown', u''])
+
+        nt.assert_equal(resolved, {u'org': ORGANIZATION_ID, u'other-id': u'other-id'})
+        nt.assert_equal(self.queries, 1)
+
+    def test_resolved_organizations_are_cached(self):
+        organizations.resolve_many([u'org', u'other'])
+
+        nt.assert_equal(organizations.resolve(u'org'), ORGANIZATION_ID)
+        nt.assert_equal(organizations.resolve(ORGANIZATION_ID), ORGANIZATION_ID)
+        nt.assert_equal(organizations.resolve(u'other-id'), u'other-id')
+        nt.assert_equal(self.queries, 1)
+
+    def test_rename(self):
+        nt.assert_equal(organizations.resolve(u'org'), ORGANIZATION_ID)
+
+        # The edit hook forgets the names resolved, the previous one no longer identifies the organization
+        self.groups[0] = (ORGANIZATION_ID, u'renamed')
+        with mock.patch.object(plugin.db, 'Notify_Channel_Version'):
+            plugin.NotifyPlugin()._organization_changed(_group(u'Renamed'))
+
+        nt.assert_is_none(organizations.resolve(u'org'))
+        # Channels are stored by id, which does not change
+        nt.assert_equal(organizations.resolve(u'renamed'), ORGANIZATION_ID)
+        nt.assert_equal(organizations.resolve(ORGANIZATION_ID), ORGANIZATION_ID)
+
+
+class TestSummary(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = database.engine('sqlite:///' + os.path.join(self.directory, 'notify.sqlite'))
+        self.engine = self.database.__enter__()
+        self.group = _group(u'Before')
+
+        query = mock.patch.object(organizations, '_query')
+        query.start().return_value.filter.return_value.first.side_effect = lambda: self.group
+        resolve = mock.patch.object(organizations, 'resolve', side_effect=lambda name_or_id: ORGANIZATION_ID)
+        resolve.start()
+        self.patches = [query, resolve]
+
+        # A cache of its own for every test
+        organizations._ids = None
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.database.__exit__(None, None, None)
+        shutil.rmtree(self.directory)
+
+    def test_summary_is_cached(self):
+        nt.assert_equal(organizations.summary(u'org')['title'], u'Before')
+        self.group.title = u'After'
+        nt.assert_equal(organizations.summary(u'org')['title'], u'Before')
+
+    def test_edit_in_another_process_reloads_the_summary(self):
+        nt.assert_equal(organizations.summary(u'org')['title'], u'Before')
+        self.group.title = u'After'
+
+        session = sa.orm.sessionmaker(bind=self.engine)()
+        try:
+            # Edited by another process, whose cache is the one the hook clears
+            with mock.patch.object(model, 'Session', session), mock.patch.object(organizations, 'invalidate'):
+                plugin.NotifyPlugin()._organization_changed(self.group)
+
+            # Not committed yet, the cached summary is still current
+            nt.assert_equal(organizations.summary(u'org')['title'], u'Before')
+
+            session.commit()
+        finally:
+            session.close()
+
+        nt.assert_equal(organizations.summary(u'org')['title'], u'After')
+        nt.assert_equal(organizations.stats()['summaries']['stale'], 1)
+
+    def test_rolled_back_edit_keeps_the_summary(self):
+        organizations.summary(u'org')
+
+        session = sa.orm.sessionmaker(bind=self.engine)()
+        try:
+            with mock.patch.object(model, 'Session', session), mock.patch.object(organizations, 'invalidate'):
+                plugin.NotifyPlugin()._organization_changed(self.group)
+            session.rollback()
+        finally:
+            session.close()
+
+        organizations.summary(u'org')
+        nt.assert_equal(organizations.stats()['summaries']['stale'], 0)
@@ -1,5 +1,57 @@
 """Tests for plugin.py."""
+import mock
+import nose.tools as nt
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckanext.notify.db as db
 import ckanext.notify.plugin as plugin
 
 def test_plugin():
-    pass
\ No newline at end of file
+    pass
+
+
+class TestConfigure(object):
+
+    def setup(self):
+        self.patches = [
+            mock.patch.object(plugin.db, 'create_tables'),
+            mock.patch.object(plugin.migrations, 'upgrade'),
+            mock.patch.object(plugin.migrations, 'has_core_schema', return_value=True),
+            mock.patch.object(plugin.migrations, 'pending', return_value=[]),
+        ]
+        self.create_tables, self.upgrade, _, self.pending = [patch.start() for patch in self.patches]
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_schema_is_set_up_once_at_startup(self):
+        plugin.NotifyPlugin().configure({})
+
+        self.create_tables.assert_called_once_with()
+        self.upgrade.assert_called_once_with(model.meta.engine)
+
+    def test_tables_are_mapped_once(self):
+        db.init_db(model)
+        channel = db.Channel
+
+        plugin.NotifyPlugin().configure({})
+
+        nt.assert_is(db.Channel, channel)
+
+    def test_table_creation_can_be_turned_off(self):
+        plugin.NotifyPlugin().configure({'ckanext.notify.create_tables': 'false'})
+
+        nt.assert_false(self.create_tables.called)
+        nt.assert_false(self.upgrade.called)
+
+    def test_database_errors_do_not_stop_startup(self):
+        self.create_tables.side_effect = sa.exc.OperationalError('CREATE TABLE', {}, Exception('read only'))
+
+        plugin.NotifyPlugin().configure({})
+
+    def test_pending_migrations_stop_startup(self):
+        self.pending.return_value = [plugin.migrations.MIGRATIONS[-1]]
+
+        nt.assert_raises(RuntimeError, plugin.NotifyPlugin().configure, {})
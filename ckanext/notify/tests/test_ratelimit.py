@@ -0,0 +1,78 @@
+"""Tests for ratelimit.py."""
+import os
+import shutil
+import tempfile
+
+import mock
+import nose.tools as nt
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.ratelimit as ratelimit
+import ckanext.notify.retry as retry
+
+
+class TestRateLimit(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ratelimit.sqlite')
+        self.config = helpers.changed_config('ckanext.notify.ratelimit.path', self.path)
+        self.config.__enter__()
+        # Every test starts with buckets of its own
+        ratelimit._connection = None
+
+    def teardown(self):
+        ratelimit._connection = None
+        self.config.__exit__(None, None, None)
+        shutil.rmtree(self.directory)
+
+    def test_burst_then_paced(self):
+        waits = [ratelimit._reserve('key', 1.0, 2.0, 10)[1] for i in range(4)]
+
+        nt.assert_equal(waits[:2], [0.0, 0.0])
+        # Empty bucket: every caller is given the next free slot, one second after the previous one
+        nt.assert_almost_equal(waits[2], 1.0, delta=0.1)
+        nt.assert_almost_equal(waits[3], 2.0, delta=0.1)
+
+    def test_buckets_are_per_key(self):
+        nt.assert_equal(ratelimit._reserve('first', 1.0, 1.0, 10), (True, 0.0))
+        nt.assert_equal(ratelimit._reserve('second', 1.0, 1.0, 10), (True, 0.0))
+
+    def test_too_long_waits_take_nothing(self):
+        nt.assert_equal(ratelimit._reserve('key', 1.0, 1.0, 0.5), (True, 0.0))
+
+        taken, wait = ratelimit._reserve('key', 1.0, 1.0, 0.5)
+        nt.assert_false(taken)
+        nt.assert_almost_equal(wait, 1.0, delta=0.1)
+
+        # The refused call did not borrow a token
+        taken, wait = ratelimit._reserve('key', 1.0, 1.0, 0.5)
+        nt.assert_false(taken)
+        nt.assert_almost_equal(wait, 1.0, delta=0.1)
+
+    def test_connection_is_shared_by_threads(self):
+        connection = ratelimit._get_connection()
+        results = dispatcher.fan_out(lambda item: ratelimit._get_connection(), range(4), concurrency=4)
+        nt.assert_true(all(result.value is connection for result in results))
+
+    @mock.patch.object(ratelimit.time, 'sleep')
+    def test_request_threads_never_wait(self, sleep):
+        ratelimit.acquire(u'https://hooks.slack.com/services/T/B/X')
+
+        with mock.patch.object(dispatcher, 'in_background', return_value=False):
+            with nt.assert_raises(retry.RetryableError) as raised:
+                ratelimit.acquire(u'https://hooks.slack.com/services/T/B/X')
+
+        nt.assert_true(raised.exception.retry_after > 0)
+        nt.assert_false(sleep.called)
+
+    @mock.patch.object(ratelimit.time, 'sleep')
+    def test_background_threads_wait(self, sleep):
+        ratelimit.acquire(u'https://hooks.slack.com/services/T/B/X')
+
+        with mock.patch.object(dispatcher, 'in_background', return_value=True):
+            wait = ratelimit.acquire(u'https://hooks.slack.com/services/T/B/X')
+
+        nt.assert_true(wait > 0)
+        sleep.assert_called_once_with(wait)
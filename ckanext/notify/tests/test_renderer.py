@@ -0,0 +1,85 @@
+"""Tests for renderer.py."""
+import os
+
+import jinja2
+import mock
+import nose.tools as nt
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.renderer as renderer
+
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+
+EVENT = {
+    'site_title': u'CKAN',
+    'site_url': u'http://ckan.example.org',
+    'action_type': u'New data request',
+    'datarequest_title': u'Air quality',
+    'datarequest_description': u'Hourly measures',
+    'datarequest_url': u'http://ckan.example.org/datarequest/1',
+}
+
+
+class TestRenderer(object):
+
+    def setup(self):
+        self.environment = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES))
+        self.locale = 'en'
+        self.patches = [
+            mock.patch.object(renderer, '_environment', return_value=self.environment),
+            mock.patch.object(renderer, '_locale', side_effect=lambda: self.locale),
+            mock.patch.object(self.environment, 'get_template', wraps=self.environment.get_template),
+        ]
+        self.get_template = [patch.start() for patch in self.patches][-1]
+        renderer.clear()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        renderer.clear()
+
+    def test_templates_are_compiled_once(self):
+        for i in range(3):
+            renderer.slack_message('datarequest_create', EVENT)
+            renderer.email_message('datarequest_close', EVENT)
+
+        # All of them on first use, none afterwards
+        nt.assert_equal(self.get_template.call_count, len(renderer.TEMPLATES))
+
+    def test_templates_are_compiled_per_locale(self):
+        renderer.get_template('notify/slack/digest.txt')
+        self.locale = 'es'
+        renderer.get_template('notify/slack/digest.txt')
+        renderer.get_template('notify/email/digest.txt')
+
+        nt.assert_equal(self.get_template.call_count, 2 * len(renderer.TEMPLATES))
+
+    def test_clear(self):
+        renderer.get_template('notify/slack/digest.txt')
+        renderer.clear()
+        renderer.get_template('notify/slack/digest.txt')
+
+        nt.assert_equal(self.get_template.call_count, 2 * len(renderer.TEMPLATES))
+
+    @helpers.change_config('debug', 'true')
+    def test_nothing_is_cached_in_debug_mode(self):
+        renderer.get_template('notify/slack/digest.txt')
+        renderer.get_template('notify/slack/digest.txt')
+
+        nt.assert_equal(self.get_template.call_count, 2)
+
+    def test_messages(self):
+        nt.assert_in(u'Air quality', renderer.slack_message('datarequest_create', EVENT)['text'])
+
+        subject, body = renderer.email_message('datarequest_comment', EVENT)
+
+        nt.assert_equal(subject, u'[CKAN] New data request')
+        nt.assert_in(u'http://ckan.example.org/datarequest/1', body)
+
+    @helpers.change_config('ckan.site_title', u'Open data')
+    def test_base_vars_are_copies(self):
+        base_vars = renderer.base_vars()
+        base_vars['site_title'] = u'Changed'
+
+        nt.assert_equal(renderer.base_vars()['site_title'], u'Open data')
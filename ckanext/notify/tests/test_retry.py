@@ -0,0 +1,121 @@
+"""Tests for retry.py."""
+import time
+
+import mock
+import nose.tools as nt
+
+from email import utils
+
+import ckanext.notify.db as db
+import ckanext.notify.dispatcher as dispatcher
+import ckanext.notify.retry as retry
+
+
+def _channel(id):
+    return db.ChannelRecord(id, u'org', u'slack', u'https://hooks.slack.com/services/' + id, u'')
+
+
+class TestParseRetryAfter(object):
+
+    def test_seconds(self):
+        nt.assert_equal(retry.parse_retry_after('120'), 120)
+        nt.assert_equal(retry.parse_retry_after('1.5'), 1.5)
+        nt.assert_equal(retry.parse_retry_after('-5'), 0)
+
+    def test_http_date(self):
+        delay = retry.parse_retry_after(utils.formatdate(time.time() + 60, usegmt=True))
+        nt.assert_true(55 <= delay <= 61, delay)
+
+    def test_past_http_date(self):
+        nt.assert_equal(retry.parse_retry_after(utils.formatdate(time.time() - 60, usegmt=True)), 0)
+
+    def test_missing_or_invalid(self):
+        nt.assert_is_none(retry.parse_retry_after(None))
+        nt.assert_is_none(retry.parse_retry_after(''))
+        nt.assert_is_none(retry.parse_retry_after('soon'))
+
+
+class TestBackoffDelay(object):
+
+    def test_grows_exponentially(self):
+        for attempt, limit in ((1, 1), (2, 2), (3, 4), (5, 16)):
+            delays = [retry.backoff_delay(attempt) for i in range(200)]
+            nt.assert_true(all(0 <= delay <= limit for delay in delays), (attempt, max(delays)))
+
+    def test_capped(self):
+        nt.assert_true(all(retry.backoff_delay(30) <= 300 for i in range(200)))
+
+    def test_honours_retry_after(self):
+        nt.assert_true(all(retry.backoff_delay(1, retry_after=30) >= 30 for i in range(200)))
+
+
+class TestHandleFailures(object):
+
+    def setup(self):
+        self.ok = dispatcher.Result(_channel('ok'), True, 200, None)
+        self.busy = dispatcher.Result(_channel('busy'), False, None, retry.RetryableError('429', retry_after=20))
+        self.down = dispatcher.Result(_channel('down'), False, None, retry.RetryableError('503'))
+        self.broken = dispatcher.Result(_channel('broken'), False, None, ValueError('400'))
+        self.paced = dispatcher.Result(_channel('paced'), False, None, retry.Deferred('Paced', retry_after=5))
+        self.send = mock.Mock(__name__='send')
+
+    @mock.patch.object(retry, '_store_dead_letters')
+    @mock.patch.object(dispatcher, 'dispatch_later')
+    def test_retries_retryable_failures_together(self, dispatch_later, store):
+        retry.handle_failures(u'slack', [self.ok, self.busy, self.down, self.broken], 1, self.send, 'message')
+
+        nt.assert_equal(dispatch_later.call_count, 1)
+        args, kwargs = dispatch_later.call_args
+        delay, func, func_args, func_kwargs = args
+        nt.assert_true(delay >= 20, delay)
+        nt.assert_is(func, self.send)
+        nt.assert_equal(func_args, ([self.busy.item, self.down.item], 'message'))
+        nt.assert_equal(func_kwargs, {'attempt': 2})
+
+        # Permanent failures are stored right away
+        store.assert_called_once_with(u'slack', [self.broken], 1, ('message',), {})
+
+        # Retries abandoned when the process exits are stored too
+        store.reset_mock()
+        kwargs['on_abandon']()
+        store.assert_called_once_with(u'slack', [self.busy, self.down], 1, ('message',), {})
+
+    @mock.patch.object(retry, '_store_dead_letters')
+    @mock.patch.object(dispatcher, 'dispatch_later')
+    def test_last_attempt_stores_every_failure(self, dispatch_later, store):
+        retry.handle_failures(u'slack', [self.ok, self.busy, self.broken], retry.max_attempts(), self.send, 'message')
+
+        nt.assert_false(dispatch_later.called)
+        store.assert_called_once_with(u'slack', [self.busy, self.broken], retry.max_attempts(), ('message',), {})
+
+    @mock.patch.object(retry, '_store_dead_letters')
+    @mock.patch.object(dispatcher, 'dispatch_later')
+    def test_nothing_to_do_on_success(self, dispatch_later, store):
+        retry.handle_failures(u'slack', [self.ok], 1, self.send, 'message')
+
+        nt.assert_false(dispatch_later.called)
+        nt.assert_false(store.called)
+
+    @mock.patch.object(retry, '_store_dead_letters')
+    @mock.patch.object(dispatcher, 'dispatch_later')
+    def test_deferred_deliveries_keep_their_attempt(self, dispatch_later, store):
+        retry.handle_failures(u'slack', [self.paced, self.down], 2, self.send, 'message', event_key=u'key')
+
+        nt.assert_equal(dispatch_later.call_count, 2)
+        calls = dict((call[0][2][0][0].id, call[0]) for call in dispatch_later.call_args_list)
+
+        nt.assert_equal(calls['down'][3], {'attempt': 3, 'event_key': u'key'})
+        delay, _, func_args, func_kwargs = calls['paced']
+        nt.assert_true(delay >= 5, delay)
+        nt.assert_equal(func_args, ([self.paced.item], 'message'))
+        # Claimed by the deferred call already
+        nt.assert_equal(func_kwargs, {'attempt': 2, 'event_key': None})
+        nt.assert_false(store.called)
+
+    @mock.patch.object(retry, '_store_dead_letters')
+    @mock.patch.object(dispatcher, 'dispatch_later')
+    def test_deferred_deliveries_are_not_exhausted(self, dispatch_later, store):
+        retry.handle_failures(u'slack', [self.paced], retry.max_attempts(), self.send, 'message')
+
+        nt.assert_equal(dispatch_later.call_args[0][3], {'attempt': retry.max_attempts(), 'event_key': None})
+        nt.assert_false(store.called)
@@ -0,0 +1,103 @@
+"""Tests for smtp.py."""
+import threading
+import time
+
+import mock
+import nose.tools as nt
+
+import ckanext.notify.smtp as smtp
+
+
+def _connected(last_used=None):
+    session = smtp.SMTPSession()
+    session.connection = mock.Mock()
+    session.last_used = time.time() if last_used is None else last_used
+    return session
+
+
+class TestSessionPool(object):
+
+    def test_released_sessions_are_reused(self):
+        pool = smtp.SessionPool(2, 60)
+        session = _connected()
+        pool.release(session)
+
+        nt.assert_is(pool.acquire(), session)
+        nt.assert_equal(pool.idle(), 0)
+
+    def test_sessions_are_not_shared_while_in_use(self):
+        pool = smtp.SessionPool(2, 60)
+        pool.release(_connected())
+
+        first = pool.acquire()
+        nt.assert_is_not(pool.acquire(), first)
+
+    def test_expired_sessions_are_closed_instead_of_reused(self):
+        pool = smtp.SessionPool(2, 60)
+        session = _connected(time.time() - 61)
+        connection = session.connection
+        pool._idle.append(session)
+
+        nt.assert_is_not(pool.acquire(), session)
+        nt.assert_true(connection.quit.called)
+
+    def test_idle_sessions_are_closed_by_the_timer(self):
+        pool = smtp.SessionPool(2, 0.05)
+        session = _connected()
+        connection = session.connection
+        pool.release(session)
+
+        time.sleep(0.2)
+
+        nt.assert_true(connection.quit.called)
+        nt.assert_equal(pool.idle(), 0)
+
+    def test_sessions_beyond_the_size_are_closed(self):
+        pool = smtp.SessionPool(1, 60)
+        sessions = [_connected(), _connected()]
+        connection = sessions[1].connection
+        for session in sessions:
+            pool.release(session)
+
+        nt.assert_equal(pool.idle(), 1)
+        nt.assert_true(connection.quit.called)
+
+    def test_disconnected_sessions_are_not_kept(self):
+        pool = smtp.SessionPool(2, 60)
+        pool.release(smtp.SMTPSession())
+        nt.assert_equal(pool.idle(), 0)
+
+    def test_close(self):
+        pool = smtp.SessionPool(2, 60)
+        session = _connected()
+        connection = session.connection
+        pool.release(session)
+
+        pool.close()
+
+        nt.assert_true(connection.quit.called)
+        nt.assert_equal(pool.idle(), 0)
+
+    def test_threads_borrow_their_own_session(self):
+        pool = smtp.SessionPool(4, 60)
+        borrowed = []
+        barrier = threading.Event()
+
+        def work():
+            with smtp.session() as session:
+                session.connection = mock.Mock()
+                session.last_used = time.time()
+                borrowed.append(session)
+                barrier.wait(1)
+
+        with mock.patch.object(smtp, 'get_pool', return_value=pool):
+            threads = [threading.Thread(target=work) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            barrier.set()
+            for thread in threads:
+                thread.join()
+
+        nt.assert_equal(len(set(id(session) for session in borrowed)), 3)
+        nt.assert_equal(pool.idle(), 3)
@@ -0,0 +1,47 @@
+"""Tests for transport.py."""
+import json
+
+import mock
+import nose.tools as nt
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.transport as transport
+
+
+class TestSession(object):
+
+    def setup(self):
+        transport._session = None
+
+    def teardown(self):
+        transport._session = None
+
+    def test_session_is_shared(self):
+        nt.assert_is(transport.get_session(), transport.get_session())
+
+    def test_forked_process_gets_its_own_session(self):
+        session = transport.get_session()
+
+        with mock.patch.object(transport.os, 'getpid', return_value=transport._session_pid + 1):
+            nt.assert_is_not(transport.get_session(), session)
+
+    @helpers.change_config('ckanext.notify.dispatch_workers', '3')
+    @helpers.change_config('ckanext.notify.fanout_concurrency', '5')
+    def test_pool_holds_a_connection_per_thread(self):
+        adapter = transport.get_session().get_adapter('https://hooks.slack.com')
+
+        nt.assert_equal(adapter._pool_maxsize, 15)
+        nt.assert_equal(adapter.max_retries.total, 0)
+
+    @helpers.change_config('ckanext.notify.http.pool_maxsize', '4')
+    def test_pool_size_is_configurable(self):
+        nt.assert_equal(transport.get_session().get_adapter('https://hooks.slack.com')._pool_maxsize, 4)
+
+    @helpers.change_config('ckanext.notify.http.connect_timeout', '1')
+    @helpers.change_config('ckanext.notify.http.read_timeout', '2')
+    def test_posts_have_timeouts(self):
+        with mock.patch.object(transport.requests.Session, 'post') as post:
+            transport.post_json('https://hooks.slack.com/services/T/B/X', {'text': u'Hello'})
+
+        post.assert_called_once_with('https://hooks.slack.com/services/T/B/X', data=json.dumps({'text': u'Hello'}),
+                                     timeout=(1.0, 2.0))
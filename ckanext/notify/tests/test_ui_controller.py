@@ -0,0 +1,162 @@
+"""Tests for the conditional and paged responses of controllers/ui_controller.py."""
+import datetime
+import json
+
+import mock
+import nose.tools as nt
+import webob
+
+import ckan.tests.helpers as helpers
+import ckanext.notify.controllers.ui_controller as ui_controller
+
+
+ORGANIZATION_ID = u'org-id'
+
+UPDATED = datetime.datetime(2017, 3, 1, 12, 0, 0)
+
+
+class TestNotModified(object):
+
+    def setup(self):
+        self.state = (3, UPDATED)
+        self.user = u'admin'
+        self.patches = [
+            mock.patch.object(ui_controller.cache, 'version_state', side_effect=lambda organization_id: self.state),
+            mock.patch.object(ui_controller.helpers, 'lang', return_value=u'en'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def _get(self, *variant, **headers):
+        '''Returns whether a request with the headers given is answered with 304, and its response.'''
+        request = webob.Request.blank('/organization/channels/org', headers=headers)
+        response = webob.Response()
+        with mock.patch.object(ui_controller, 'request', request), \
+                mock.patch.object(ui_controller, 'response', response), \
+                mock.patch.object(ui_controller, 'c', mock.Mock(user=self.user)):
+            not_modified = ui_controller.DataRequestsNotifyUI()._not_modified(ORGANIZATION_ID, *variant)
+        return not_modified, response
+
+    def _etag(self, *variant):
+        return self._get(*variant)[1].etag
+
+    def test_first_request(self):
+        not_modified, response = self._get()
+
+        nt.assert_false(not_modified)
+        nt.assert_equal(response.status_int, 200)
+        nt.assert_true(response.etag)
+        nt.assert_equal(response.last_modified.replace(tzinfo=None), UPDATED)
+        nt.assert_in('no-cache', response.headers['Cache-Control'])
+
+    def test_current_etag_is_not_modified(self):
+        not_modified, response = self._get(**{'If-None-Match': '"{0}"'.format(self._etag())})
+
+        nt.assert_true(not_modified)
+        nt.assert_equal(response.status_int, 304)
+
+    def test_etag_changes_with_the_version(self):
+        etag = self._etag()
+        self.state = (4, UPDATED + datetime.timedelta(seconds=1))
+
+        not_modified, response = self._get(**{'If-None-Match': '"{0}"'.format(etag)})
+
+        nt.assert_false(not_modified)
+        nt.assert_equal(response.status_int, 200)
+        nt.assert_not_equal(response.etag, etag)
+
+    def test_etag_depends_on_the_user_and_the_variant(self):
+        etag = self._etag()
+        nt.assert_not_equal(self._etag(u'slack'), etag)
+        nt.assert_not_equal(self._etag(u'q=general'), etag)
+
+        self.user = u'someone-else'
+        nt.assert_not_equal(self._etag(), etag)
+
+    def test_if_modified_since(self):
+        nt.assert_true(self._get(**{'If-Modified-Since': 'Wed, 01 Mar 2017 12:00:00 GMT'})[0])
+        nt.assert_true(self._get(**{'If-Modified-Since': 'Wed, 01 Mar 2017 13:00:00 GMT'})[0])
+        nt.assert_false(self._get(**{'If-Modified-Since': 'Wed, 01 Mar 2017 11:59:59 GMT'})[0])
+
+    def test_etag_takes_precedence_over_the_date(self):
+        not_modified, _ = self._get(**{'If-None-Match': '"outdated"',
+                                       'If-Modified-Since': 'Wed, 01 Mar 2017 13:00:00 GMT'})
+        nt.assert_false(not_modified)
+
+    def test_organization_never_changed(self):
+        self.state = (0, None)
+
+        not_modified, response = self._get(**{'If-Modified-Since': 'Wed, 01 Mar 2017 13:00:00 GMT'})
+
+        nt.assert_false(not_modified)
+        nt.assert_is_none(response.last_modified)
+
+
+class TestChannelsList(object):
+
+    def setup(self):
+        self.request = webob.Request.blank('/notify/channels/org/slack.json')
+        self.response = webob.Response()
+        self.patches = [
+            mock.patch.object(ui_controller, 'request', self.request),
+            mock.patch.object(ui_controller, 'response', self.response),
+            mock.patch.object(ui_controller, 'c', mock.Mock(user=u'admin')),
+            mock.patch.object(ui_controller.helpers, 'lang', return_value=u'en'),
+            mock.patch.object(ui_controller.cache, 'version_state', return_value=(3, UPDATED)),
+            mock.patch.object(ui_controller.DataRequestsNotifyUI, '_authorize_channels',
+                              return_value=ORGANIZATION_ID),
+            mock.patch.object(ui_controller.toolkit, 'get_action'),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.channels_show = ui_controller.toolkit.get_action.return_value
+        self.channels_show.return_value = []
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def _list(self):
+        return ui_controller.DataRequestsNotifyUI().organization_channels_list(u'org', u'slack')
+
+    def test_unchanged_list_is_not_loaded(self):
+        self._list()
+        self.channels_show.reset_mock()
+        self.request.headers['If-None-Match'] = '"{0}"'.format(self.response.etag)
+        self.response.status_int = 200
+
+        nt.assert_equal(self._list(), '')
+        nt.assert_equal(self.response.status_int, 304)
+        nt.assert_false(self.channels_show.called)
+
+    def test_changed_list_is_loaded(self):
+        self.request.headers['If-None-Match'] = '"outdated"'
+
+        nt.assert_true(json.loads(self._list())['success'])
+        nt.assert_equal(self.response.status_int, 200)
+        nt.assert_true(self.channels_show.called)
+
+    @helpers.change_config('ckanext.notify.channels.page_size', '2')
+    def test_pages_tell_whether_there_is_a_next_one(self):
+        self.channels_show.return_value = [{'id': u'1'}, {'id': u'2'}, {'id': u'3'}]
+        self.request.GET['q'] = u'ops'
+        self.request.GET['offset'] = u'2'
+
+        page = json.loads(self._list())['result']
+
+        nt.assert_equal(self.channels_show.call_args[0][1],
+                        {'organization_id': ORGANIZATION_ID, 'q': u'ops', 'limit': 3, 'offset': 2})
+        nt.assert_equal([channel['id'] for channel in page['channels']], [u'1', u'2'])
+        nt.assert_true(page['more'])
+
+    def test_invalid_offset(self):
+        self.request.GET['offset'] = u'first'
+
+        with mock.patch.object(ui_controller.toolkit, 'abort', side_effect=Exception) as abort:
+            nt.assert_raises(Exception, self._list)
+
+        nt.assert_equal(abort.call_args[0][0], 400)
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+import requests
+
+import ckan.plugins.toolkit as toolkit
+
+from ckan.common import config
+from requests.adapters import HTTPAdapter
+
+
+_session = None
+_session_pid = None
+_timeout = None
+_lock = threading.Lock()
+
+
+def _create_session():
+    pool_connections = toolkit.asint(config.get('ckanext.notify.http.pool_connections', 10))
+    # Every worker may post to the same host from each of its fan-out threads, connections beyond the pool are closed
+    workers = toolkit.asint(config.get('ckanext.notify.dispatch_workers', 4))
+    concurrency = toolkit.asint(config.get('ckanext.notify.fanout_concurrency', 8))
+    pool_maxsize = toolkit.asint(config.get('ckanext.notify.http.pool_maxsize', max(10, workers * concurrency)))
+
+    # Retries are not done by the adapter, a failed post is reported to the caller
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Content-type': 'application/json'})
+
+    return session
+
+
+def get_session():
+    '''
+    Returns the HTTP session shared by every webhook delivery of the process.
+    The session keeps a pool of keep-alive connections per host, so only the
+    first post to a host pays for the TCP and TLS handshakes. Connections are
+    never shared with a forked child process.
+    '''
+    global _session, _session_pid, _timeout
+
+    if _session is None or _session_pid != os.getpid():
+        with _lock:
+            if _session is None or _session_pid != os.getpid():
+                _timeout = (
+                    float(config.get('ckanext.notify.http.connect_timeout', 3.05)),
+                    float(config.get('ckanext.notify.http.read_timeout', 10)),
+                )
+                _session = _create_session()
+                _session_pid = os.getpid()
+
+    return _session
+
+
+def post_json(url, payload):
+    '''
+    Posts `payload` as JSON to `url` through the shared session. Raises a
+    requests exception when the connect or read timeout is exceeded.
+    '''
+    session = get_session()
+    return session.post(url, data=json.dumps(payload), timeout=_timeout)
@@ -8,14 +8,11 @@ _slack_webhook = re.compile(r'^https://hooks\.slack\.com/services/T\w+/B\w+/\w+'
 _email_format = re.compile(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$')
 
 
-def validate_slack_form(context, request_data):
+def slack_errors(request_data):
+    '''Returns the errors of the fields of a slack channel, without checking whether it exists.'''
     errors = {}
 
     # Check webhook_url
-
-    if db.Org_Slack_Details.slack_channel_exists(request_data['webhook_url'], request_data['slack_channel']):
-            errors[toolkit._('Webhook URL')] = [toolkit._('The channel already exists')]
-
     if len(request_data['webhook_url']) > constants.WEBHOOK_MAX_LENGTH:
         errors[toolkit._('Webhook URL')] =\
             [toolkit._('Webhook URL must be a maximum of {} characters long').format(constants.WEBHOOK_MAX_LENGTH)]
@@ -37,16 +34,25 @@ def validate_slack_form(context, request_data):
     if not request_data['slack_channel']:
         errors[toolkit._('Channel')] = [toolkit._('Channel cannot be empty')]
 
+    return errors
+
+
+def validate_slack_form(context, request_data):
+    errors = {}
+
+    if db.Channel.exists(constants.CHANNEL_TYPE_SLACK, request_data['webhook_url'], request_data['slack_channel']):
+            errors[toolkit._('Webhook URL')] = [toolkit._('The channel already exists')]
+
+    errors.update(slack_errors(request_data))
+
     if len(errors) > 0:
         raise toolkit.ValidationError(errors)
 
 
-def validate_email_form(context, request_data):
+def email_errors(request_data):
+    '''Returns the errors of the fields of an email channel, without checking whether it exists.'''
     errors = {}
 
-    if db.Org_Email_Details.email_channel_exists(request_data['email']):
-            errors[toolkit._('Email')] = [toolkit._('The channel already exists')]
-
     if len(request_data['email']) > constants.EMAIL_MAX_LENGTH:
         errors[toolkit._('Email')] =\
             [toolkit._('Email must be a maximum of {} characters long').format(constants.EMAIL_MAX_LENGTH)]
@@ -57,5 +63,33 @@ def validate_email_form(context, request_data):
     if not request_data['email']:
         errors[toolkit._('Email')] = [toolkit._('Email cannot be empty')]
 
+    return errors
+
+
+def validate_email_form(context, request_data):
+    errors = {}
+
+    if db.Channel.exists(constants.CHANNEL_TYPE_EMAIL, request_data['email']):
+            errors[toolkit._('Email')] = [toolkit._('The channel already exists')]
+
+    errors.update(email_errors(request_data))
+
+    if len(errors) > 0:
+        raise toolkit.ValidationError(errors)
+
+
+def validate_datarequest(context, datarequest):
+    errors = {}
+
+    if not datarequest.get('datarequest_url'):
+        errors[toolkit._('Data Request URL')] = [toolkit._('Data Request URL cannot be empty')]
+
+    if not datarequest.get('title'):
+        errors[toolkit._('Title')] = [toolkit._('Title cannot be empty')]
+
+    # Data requests may have an empty description, but the messages always show it
+    if datarequest.get('description') is None:
+        errors[toolkit._('Description')] = [toolkit._('Description has not been included')]
+
     if len(errors) > 0:
         raise toolkit.ValidationError(errors)
@@ -84,6 +84,9 @@ setup(
 
         [babel.extractors]
         ckan = ckan.lib.extract:extract_ckan
+
+        [paste.paster_command]
+        notify = ckanext.notify.commands:NotifyCommand
     ''',
 
     # If you are changing from the default layout of your extension, you may